@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from typing import Any
 from urllib.parse import urlparse
 
 import requests
 
+from app.utils.cancellation import CancelToken
+
 GAMMA_API_BASE = "https://gamma-api.polymarket.com"
 
 
@@ -23,9 +26,23 @@ class EventMeta:
     slug: str
     title: str
     markets: list[MarketMeta]
+    start_ts: int | None = None  # начало ивента (unix), если Gamma его отдала
+
 
+def _parse_iso_ts(value: Any) -> int | None:
+    # Gamma отдаёт даты как "2024-01-04T22:58:00Z" / "2024-01-04T22:58:00.123456Z"
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
 
-def _extract_event_slug(url_or_slug: str) -> str:
+
+def extract_event_slug(url_or_slug: str) -> str:
     s = (url_or_slug or "").strip()
     if s.startswith("http://") or s.startswith("https://"):
         path = urlparse(s).path.strip("/")
@@ -41,10 +58,15 @@ def _extract_event_slug(url_or_slug: str) -> str:
     return s
 
 
-def resolve_event(event_url_or_slug: str, timeout_s: int = 30) -> EventMeta:
-    slug = _extract_event_slug(event_url_or_slug)
+def resolve_event(event_url_or_slug: str, timeout_s: int = 30, cancel: CancelToken | None = None) -> EventMeta:
+    slug = extract_event_slug(event_url_or_slug)
 
+    if cancel is not None:
+        cancel.raise_if_cancelled()
     r = requests.get(f"{GAMMA_API_BASE}/events/slug/{slug}", timeout=timeout_s)
+    if cancel is not None:
+        # сам запрос не прервать — но результат отменённой операции не нужен
+        cancel.raise_if_cancelled()
     r.raise_for_status()
     data: dict[str, Any] = r.json()
 
@@ -66,4 +88,6 @@ def resolve_event(event_url_or_slug: str, timeout_s: int = 30) -> EventMeta:
             )
         )
 
-    return EventMeta(event_id=event_id, slug=slug, title=title, markets=markets)
+    start_ts = _parse_iso_ts(data.get("startDate")) or _parse_iso_ts(data.get("creationDate"))
+
+    return EventMeta(event_id=event_id, slug=slug, title=title, markets=markets, start_ts=start_ts)
@@ -9,6 +9,8 @@ import time
 
 import requests
 
+from app.utils.cancellation import CancelToken, sleep as cancellable_sleep
+
 
 DATA_API_BASE = "https://data-api.polymarket.com"
 
@@ -38,16 +40,16 @@ class Trade:
     tx_hash: str
 
 
-def _sleep(seconds: float) -> None:
-    if seconds > 0:
-        time.sleep(seconds)
+def _sleep(seconds: float, cancel: CancelToken | None = None) -> None:
+    # с токеном сон прерывается отменой (OperationCancelled)
+    cancellable_sleep(seconds, cancel)
 
 
-def _backoff_sleep(attempt: int, base: float = 0.8, cap: float = 20.0) -> None:
+def _backoff_sleep(attempt: int, base: float = 0.8, cap: float = 20.0, cancel: CancelToken | None = None) -> None:
     # экспонента + небольшой jitter
     s = min(cap, base * (2**attempt))
     s *= random.uniform(0.85, 1.15)
-    _sleep(s)
+    _sleep(s, cancel)
 
 
 def _get_json_with_retries(
@@ -56,10 +58,13 @@ def _get_json_with_retries(
     params: dict[str, Any],
     timeout_s: float = 30.0,
     max_retries: int = 8,
+    cancel: CancelToken | None = None,
 ) -> list[dict[str, Any]]:
     last_err: Exception | None = None
 
     for attempt in range(max_retries + 1):
+        if cancel is not None:
+            cancel.raise_if_cancelled()
         try:
             r = _SESSION.get(url, params=params, timeout=timeout_s)
 
@@ -70,8 +75,8 @@ def _get_json_with_retries(
                 log.warning("429 rate limited. retry_after=%s attempt=%s", ra, attempt)
                 if attempt >= max_retries:
                     r.raise_for_status()
-                _sleep(wait_s if wait_s is not None else 3.0)
-                _backoff_sleep(attempt)
+                _sleep(wait_s if wait_s is not None else 3.0, cancel)
+                _backoff_sleep(attempt, cancel=cancel)
                 continue
 
             # 5xx — временные проблемы
@@ -79,7 +84,7 @@ def _get_json_with_retries(
                 log.warning("HTTP %s from data-api. attempt=%s", r.status_code, attempt)
                 if attempt >= max_retries:
                     r.raise_for_status()
-                _backoff_sleep(attempt)
+                _backoff_sleep(attempt, cancel=cancel)
                 continue
 
             r.raise_for_status()
@@ -93,7 +98,7 @@ def _get_json_with_retries(
             log.warning("Request failed: %r attempt=%s/%s params=%s", e, attempt, max_retries, params)
             if attempt >= max_retries:
                 raise
-            _backoff_sleep(attempt)
+            _backoff_sleep(attempt, cancel=cancel)
 
     # теоретически не дойдём
     raise RuntimeError(f"Failed to fetch json after retries: {last_err!r}")
@@ -110,6 +115,8 @@ def iter_event_trades(
     progress_cb: Callable[[int, int], None] | None = None,  # (processed_trades, offset)
     progress_every: int = 2000,
     max_trades: int | None = None,  # если хочешь ограничить для теста
+    raw_filter: Callable[[dict[str, Any]], bool] | None = None,  # напр. MarketFilter.is_trade_allowed
+    cancel: CancelToken | None = None,  # проверяется перед каждой страницей и в паузах
 ) -> Iterator[Trade]:
     offset = 0
     processed = 0
@@ -123,7 +130,9 @@ def iter_event_trades(
         now = time.time()
         elapsed = now - last_request_ts
         if elapsed < min_request_interval_s:
-            _sleep(min_request_interval_s - elapsed)
+            _sleep(min_request_interval_s - elapsed, cancel)
+        elif cancel is not None:
+            cancel.raise_if_cancelled()
 
         last_request_ts = time.time()
 
@@ -137,6 +146,7 @@ def iter_event_trades(
             },
             timeout_s=timeout_s,
             max_retries=max_retries,
+            cancel=cancel,
         )
 
         if not batch:
@@ -156,6 +166,10 @@ def iter_event_trades(
         prev_signature = signature
 
         for t in batch:
+            # отсекаем ненужные рынки до построения Trade
+            if raw_filter is not None and not raw_filter(t):
+                continue
+
             tr = Trade(
                 condition_id=str(t.get("conditionId") or ""),
                 market_slug=str(t.get("slug") or ""),
@@ -1,13 +1,162 @@
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import json
+import re
 from pathlib import Path
+from typing import Any, Iterable, Iterator
+
 import yaml
 
+# ключи сырого трейда из Data API, по которым фильтруем
+_RAW_TOKEN_ID = "asset"
+_RAW_CONDITION_ID = "conditionId"
+_RAW_EVENT_SLUG = "eventSlug"
+_RAW_MARKET_SLUG = "slug"
+
+_GLOB_CHARS = set("*?[")
+
+
+class _PrefixTrie:
+    """
+    Trie по префиксам slug-ов: паттерны вида "bitcoin-above-*".
+    Проверка стоит O(len(slug)) независимо от количества паттернов.
+    """
+    _END = object()
+
+    def __init__(self) -> None:
+        self._root: dict = {}
+
+    def add(self, prefix: str) -> None:
+        node = self._root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[self._END] = True
+
+    def __bool__(self) -> bool:
+        return bool(self._root)
+
+    def matches(self, s: str) -> bool:
+        node = self._root
+        if self._END in node:
+            return True
+        for ch in s:
+            node = node.get(ch)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+
+class _RuleSet:
+    """
+    Скомпилированный набор правил (whitelist или blacklist).
+
+    token_ids / condition_ids / event_slugs — hash-индексы (set),
+    market_slugs — точные slug-и в set, префиксы "xxx*" в trie,
+    остальные glob-ы склеены в одну регулярку.
+    """
+
+    def __init__(self, spec: dict[str, Any] | None) -> None:
+        spec = spec or {}
+
+        self.token_ids: frozenset[str] = _str_set(spec.get("token_ids"), "token_ids")
+        self.condition_ids: frozenset[str] = _str_set(spec.get("condition_ids"), "condition_ids")
+        self.event_slugs: frozenset[str] = _str_set(spec.get("event_slugs"), "event_slugs")
+        if _str_set(spec.get("tags"), "tags"):
+            # в трейдах Data API тегов нет — такое правило молча ничего бы не отсекало
+            raise ValueError("tags filter is not supported: trades carry no tags; use event_slugs / market_slugs")
+
+        exact: set[str] = set()
+        self._slug_prefixes = _PrefixTrie()
+        globs: list[str] = []
+        for pattern in _str_set(spec.get("market_slugs"), "market_slugs"):
+            if not (_GLOB_CHARS & set(pattern)):
+                exact.add(pattern)
+            elif pattern.endswith("*") and not (_GLOB_CHARS & set(pattern[:-1])):
+                self._slug_prefixes.add(pattern[:-1])
+            else:
+                globs.append(fnmatch.translate(pattern))
+
+        self.market_slugs: frozenset[str] = frozenset(exact)
+        self._slug_re = re.compile("|".join(f"(?:{g})" for g in globs)) if globs else None
+
+        self.is_empty = not (
+            self.token_ids
+            or self.condition_ids
+            or self.event_slugs
+            or self.market_slugs
+            or self._slug_prefixes
+            or self._slug_re
+        )
+
+    def matches_raw(self, t: dict[str, Any]) -> bool:
+        if self.condition_ids and t.get(_RAW_CONDITION_ID) in self.condition_ids:
+            return True
+        if self.token_ids and t.get(_RAW_TOKEN_ID) in self.token_ids:
+            return True
+        if self.event_slugs and t.get(_RAW_EVENT_SLUG) in self.event_slugs:
+            return True
+
+        slug = t.get(_RAW_MARKET_SLUG)
+        if slug:
+            if slug in self.market_slugs:
+                return True
+            if self._slug_prefixes and self._slug_prefixes.matches(slug):
+                return True
+            if self._slug_re is not None and self._slug_re.match(slug):
+                return True
+
+        return False
+
+
+def _str_set(values: Any, field: str) -> frozenset[str]:
+    if values is None:
+        return frozenset()
+    if not isinstance(values, list):
+        raise ValueError(f"{field} must be a list")
+    return frozenset(str(v) for v in values if v is not None and str(v) != "")
+
+
+def _fingerprint(mode: str, whitelist: dict[str, Any], blacklist: dict[str, Any]) -> str:
+    # порядок и дубли в списках на фильтр не влияют
+    def canon(spec: dict[str, Any]) -> dict[str, list[str]]:
+        return {k: sorted(_str_set(spec.get(k), k)) for k in sorted(spec)}
+
+    doc = {"mode": mode, "whitelist": canon(whitelist) if mode == "whitelist" else {}, "blacklist": canon(blacklist)}
+    raw = json.dumps(doc, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
 
 class MarketFilter:
+    """
+    Фильтр рынков из markets.yaml.
+
+    mode: all | whitelist
+    whitelist / blacklist:
+      token_ids, condition_ids, event_slugs, market_slugs (glob)
+
+    Старый формат (whitelist — просто список token_id) тоже поддерживается.
+    Применяется к сырым dict-ам Data API до нормализации и записи в БД.
+    fingerprint — отпечаток правил ("" — фильтр ничего не отсекает): по нему
+    общий стор узнаёт, что история ивента выкачана с другим фильтром.
+    """
+
     def __init__(self, config_path: Path):
         self.mode = None
         self.whitelist = set()
         self._load_config(config_path)
 
+    @classmethod
+    def from_dict(cls, config: dict[str, Any]) -> "MarketFilter":
+        self = cls.__new__(cls)
+        self.mode = None
+        self.whitelist = set()
+        self._apply_config(config or {})
+        return self
+
     def _load_config(self, config_path: Path):
         if not config_path.exists():
             raise FileNotFoundError(f"markets.yaml not found: {config_path}")
@@ -15,22 +164,63 @@ class MarketFilter:
         with config_path.open("r", encoding="utf-8") as f:
             config = yaml.safe_load(f) or {}
 
+        self._apply_config(config)
+
+    def _apply_config(self, config: dict[str, Any]) -> None:
         self.mode = config.get("mode", "all")
 
         if self.mode not in {"all", "whitelist"}:
             raise ValueError(f"Invalid markets mode: {self.mode}")
 
-        if self.mode == "whitelist":
-            whitelist = config.get("whitelist", [])
-            if not isinstance(whitelist, list):
-                raise ValueError("whitelist must be a list")
-            self.whitelist = set(whitelist)
+        whitelist = config.get("whitelist") or {}
+        if isinstance(whitelist, list):
+            # старый формат: список token_id
+            whitelist = {"token_ids": whitelist}
+        if not isinstance(whitelist, dict):
+            raise ValueError("whitelist must be a list or a mapping")
+
+        blacklist = config.get("blacklist") or {}
+        if not isinstance(blacklist, dict):
+            raise ValueError("blacklist must be a mapping")
+
+        self._allow = _RuleSet(whitelist if self.mode == "whitelist" else None)
+        self._deny = _RuleSet(blacklist)
+        self.whitelist = set(self._allow.token_ids)
+        self.fingerprint = _fingerprint(self.mode, whitelist, blacklist) if not self.passes_all else ""
+
+    @property
+    def passes_all(self) -> bool:
+        """mode: all и пустой blacklist — фильтр ничего не отсекает."""
+        return self.mode == "all" and self._deny.is_empty
 
     def is_market_allowed(self, token_id: str) -> bool:
+        if token_id in self._deny.token_ids:
+            return False
+
         if self.mode == "all":
             return True
 
         if self.mode == "whitelist":
-            return token_id in self.whitelist
+            return token_id in self._allow.token_ids
 
         return False  # на всякий случай
+
+    def is_trade_allowed(self, raw_trade: dict[str, Any]) -> bool:
+        """Проверка сырого трейда Data API (ключи conditionId / asset / slug / eventSlug)."""
+        if not self._deny.is_empty and self._deny.matches_raw(raw_trade):
+            return False
+
+        if self.mode == "whitelist":
+            return self._allow.matches_raw(raw_trade)
+
+        return True
+
+    def filter_raw_trades(self, raw_trades: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        if self.passes_all:
+            yield from raw_trades
+            return
+
+        allowed = self.is_trade_allowed
+        for t in raw_trades:
+            if allowed(t):
+                yield t
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from app.config_loader import load_yaml
+
+# Очередь алёртов между ingest_once (пишет) и ботом (читает и рассылает
+# подписчикам). SQLite в WAL: писатель и читатель — разные процессы.
+#
+# Алёрты нумеруются id по возрастанию; потребитель хранит в consumers
+# последний обработанный id и читает всё, что после него (at-least-once:
+# offset коммитится после рассылки).
+#
+# Путь — config/settings.yaml: alert_outbox.path (относительный — от
+# Polymarket_client); писатель и бот открывают очередь через open_alert_outbox().
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+SETTINGS_CONFIG = BASE_DIR / "config" / "settings.yaml"
+DEFAULT_OUTBOX_PATH = "data/alert_outbox.sqlite"
+
+
+@dataclass(frozen=True)
+class Alert:
+    alert_type: str  # BUY_BIG_NEW | SELL_BIG_NEW | ...
+    reason: str
+    wallet: str
+    condition_id: str
+    side: str
+    notional_usd: float  # сумма окна
+    trade_count: int  # трейдов в окне
+    window_start_ts: int
+    event_slug: str = ""  # если известен (у записей из лога трейдов его нет)
+    market_title: str = ""
+
+
+def decode_alert(payload: str) -> Alert:
+    """ValueError / TypeError — битая запись; потребитель её пропускает."""
+    return Alert(**json.loads(payload))
+
+
+def alert_outbox_path(settings_path: str | Path = SETTINGS_CONFIG) -> Path:
+    settings = load_yaml(Path(settings_path)) or {}
+    cfg = settings.get("alert_outbox", {}) or {}
+    path = Path(cfg.get("path", DEFAULT_OUTBOX_PATH))
+    if not path.is_absolute():
+        path = BASE_DIR / path
+    return path
+
+
+def open_alert_outbox(settings_path: str | Path = SETTINGS_CONFIG) -> "AlertOutbox":
+    return AlertOutbox(alert_outbox_path(settings_path))
+
+
+class AlertOutbox:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS alerts (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              created_at REAL NOT NULL,
+              payload TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS consumers (
+              name TEXT PRIMARY KEY,
+              last_id INTEGER NOT NULL
+            );
+            """
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def put(self, alert: Alert) -> int:
+        payload = json.dumps(asdict(alert), ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            cur = self._conn.execute("INSERT INTO alerts(created_at, payload) VALUES (?,?)", (time.time(), payload))
+            self._conn.commit()
+            return int(cur.lastrowid)
+
+    def read(self, after_id: int, *, limit: int = 100) -> list[tuple[int, str]]:
+        """(id, payload) после after_id; разбор — decode_alert, по одной записи."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM alerts WHERE id>? ORDER BY id LIMIT ?", (int(after_id), int(limit))
+            ).fetchall()
+        return [(int(alert_id), payload) for alert_id, payload in rows]
+
+    def last_id(self) -> int:
+        with self._lock:
+            (n,) = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM alerts").fetchone()
+            return int(n)
+
+    # ---------- потребители ----------
+    def load_offset(self, consumer: str) -> int | None:
+        """Последний обработанный id; None — потребитель ещё ничего не читал."""
+        with self._lock:
+            row = self._conn.execute("SELECT last_id FROM consumers WHERE name=?", (consumer,)).fetchone()
+        return int(row[0]) if row is not None else None
+
+    def commit_offset(self, consumer: str, last_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO consumers(name, last_id) VALUES (?,?)
+                ON CONFLICT(name) DO UPDATE SET last_id=excluded.last_id
+                """,
+                (consumer, int(last_id)),
+            )
+            self._conn.commit()
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import bisect
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+from app.notification.alert_outbox import Alert
+
+# Подписки пользователей бота на алёрты:
+#   market  <condition_id>  — любой алёрт по рынку;
+#   event   <slug>          — по любому рынку события;
+#   wallet  <адрес>         — по кошельку;
+#   min_usd <сумма>         — любой алёрт, где сумма окна >= суммы.
+#
+# Источник правды — SQLite, в памяти — обратные индексы, которые обновляются
+# при каждой записи (write-through):
+#   market / wallet / event -> set(user_id);
+#   condition_id -> set(slug событий) — рынки событий, на которые подписаны
+#     (у алёрта из лога трейдов slug события может не быть);
+#   min_usd — отсортированный список (сумма, user_id): подходят все записи
+#     левее bisect_right(сумма алёрта).
+# match() стоит O(число совпадений), а не O(число пользователей).
+
+KINDS = ("market", "event", "wallet", "min_usd")
+
+# защита от бесконечных списков подписок у одного пользователя
+MAX_PER_USER = 200
+
+
+def normalize_value(kind: str, value: str) -> str:
+    """Каноничное значение подписки; неверный формат -> ValueError."""
+    v = (value or "").strip()
+    if kind == "market":
+        v = v.lower()
+        if len(v) != 66 or not v.startswith("0x") or not _is_hex(v[2:]):
+            raise ValueError("conditionId рынка — 0x и 64 hex-символа")
+        return v
+    if kind == "wallet":
+        v = v.lower()
+        if len(v) != 42 or not v.startswith("0x") or not _is_hex(v[2:]):
+            raise ValueError("адрес кошелька — 0x и 40 hex-символов")
+        return v
+    if kind == "event":
+        if not v:
+            raise ValueError("нужен slug или ссылка на событие")
+        return v.lower()
+    if kind == "min_usd":
+        try:
+            usd = float(v.replace(",", ".").lstrip("$"))
+        except ValueError:
+            raise ValueError("минимальная сумма — число в $") from None
+        if not usd > 0:
+            raise ValueError("минимальная сумма должна быть больше нуля")
+        return repr(usd)
+    raise ValueError(f"unknown subscription kind {kind!r}; expected one of: {', '.join(KINDS)}")
+
+
+def _is_hex(s: str) -> bool:
+    try:
+        int(s, 16)
+    except ValueError:
+        return False
+    return True
+
+
+class SubscriptionStore:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS subscriptions (
+              user_id INTEGER NOT NULL,
+              kind TEXT NOT NULL,
+              value TEXT NOT NULL,
+              created_at REAL NOT NULL,
+              PRIMARY KEY (user_id, kind, value)
+            );
+            CREATE TABLE IF NOT EXISTS event_markets (
+              event_slug TEXT NOT NULL,
+              condition_id TEXT NOT NULL,
+              PRIMARY KEY (event_slug, condition_id)
+            );
+            """
+        )
+
+        self._index: dict[str, dict[str, set[int]]] = {"market": {}, "event": {}, "wallet": {}}
+        self._events_by_market: dict[str, set[str]] = {}
+        self._min_usd: list[tuple[float, int]] = []
+        self._by_user: dict[int, set[tuple[str, str]]] = {}
+
+        for user_id, kind, value in self._conn.execute("SELECT user_id, kind, value FROM subscriptions"):
+            self._add_locked(int(user_id), kind, value)
+        for slug, cid in self._conn.execute("SELECT event_slug, condition_id FROM event_markets"):
+            self._events_by_market.setdefault(cid, set()).add(slug)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- запись ----------
+    def follow(self, user_id: int, kind: str, value: str) -> bool:
+        """False — такая подписка уже есть."""
+        value = normalize_value(kind, value)
+        with self._lock:
+            mine = self._by_user.get(user_id, set())
+            if (kind, value) in mine:
+                return False
+            if len(mine) >= MAX_PER_USER:
+                raise ValueError(f"не больше {MAX_PER_USER} подписок")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO subscriptions(user_id, kind, value, created_at) VALUES (?,?,?,?)",
+                (user_id, kind, value, time.time()),
+            )
+            self._conn.commit()
+            self._add_locked(user_id, kind, value)
+            return True
+
+    def unfollow(self, user_id: int, kind: str, value: str) -> bool:
+        """False — такой подписки не было."""
+        value = normalize_value(kind, value)
+        with self._lock:
+            if (kind, value) not in self._by_user.get(user_id, ()):
+                return False
+            self._conn.execute(
+                "DELETE FROM subscriptions WHERE user_id=? AND kind=? AND value=?", (user_id, kind, value)
+            )
+            self._conn.commit()
+            self._remove_locked(user_id, kind, value)
+            return True
+
+    def set_event_markets(self, event_slug: str, condition_ids: Iterable[str]) -> None:
+        """Рынки события (из resolve_event) — по ним алёрт находит подписчиков события."""
+        slug = normalize_value("event", event_slug)
+        cids = {normalize_value("market", cid) for cid in condition_ids}
+        with self._lock:
+            old = {cid for (cid,) in self._conn.execute(
+                "SELECT condition_id FROM event_markets WHERE event_slug=?", (slug,)
+            )}
+            self._conn.execute("DELETE FROM event_markets WHERE event_slug=?", (slug,))
+            self._conn.executemany(
+                "INSERT INTO event_markets(event_slug, condition_id) VALUES (?,?)", [(slug, cid) for cid in cids]
+            )
+            self._conn.commit()
+            for cid in old - cids:
+                slugs = self._events_by_market.get(cid)
+                if slugs is not None:
+                    slugs.discard(slug)
+                    if not slugs:
+                        del self._events_by_market[cid]
+            for cid in cids:
+                self._events_by_market.setdefault(cid, set()).add(slug)
+
+    # ---------- чтение ----------
+    def user_subscriptions(self, user_id: int) -> list[tuple[str, str]]:
+        with self._lock:
+            return sorted(self._by_user.get(user_id, ()), key=lambda kv: (KINDS.index(kv[0]), kv[1]))
+
+    def match(self, alert: Alert) -> set[int]:
+        """user_id всех, кому нужен этот алёрт."""
+        cid = (alert.condition_id or "").lower()
+        wallet = (alert.wallet or "").lower()
+        with self._lock:
+            users: set[int] = set()
+            users |= self._index["market"].get(cid, set())
+            users |= self._index["wallet"].get(wallet, set())
+
+            slugs = set(self._events_by_market.get(cid, ()))
+            if alert.event_slug:
+                slugs.add(alert.event_slug.lower())
+            for slug in slugs:
+                users |= self._index["event"].get(slug, set())
+
+            hi = bisect.bisect_right(self._min_usd, (float(alert.notional_usd), float("inf")))
+            users.update(user_id for _usd, user_id in self._min_usd[:hi])
+            return users
+
+    # ---------- индексы ----------
+    def _add_locked(self, user_id: int, kind: str, value: str) -> None:
+        self._by_user.setdefault(user_id, set()).add((kind, value))
+        if kind == "min_usd":
+            bisect.insort(self._min_usd, (float(value), user_id))
+        else:
+            self._index[kind].setdefault(value, set()).add(user_id)
+
+    def _remove_locked(self, user_id: int, kind: str, value: str) -> None:
+        mine = self._by_user.get(user_id)
+        if mine is not None:
+            mine.discard((kind, value))
+            if not mine:
+                del self._by_user[user_id]
+        if kind == "min_usd":
+            i = bisect.bisect_left(self._min_usd, (float(value), user_id))
+            if i < len(self._min_usd) and self._min_usd[i] == (float(value), user_id):
+                del self._min_usd[i]
+        else:
+            users = self._index[kind].get(value)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._index[kind][value]
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import zipfile
+from pathlib import Path
+
+from app.ingestion.event_resolver import EventMeta
+from app.reporting.report_tables import (
+    PARTICIPANT_HEADERS,
+    SUMMARY_HEADERS,
+    event_summary_pairs,
+    market_ids,
+    market_participants,
+    market_sheet_titles,
+    markets_sorted,
+    participant_row,
+    summary_row,
+)
+from app.services.event_aggregator import EventReportData
+from app.utils.cancellation import CancelToken, checked
+
+# Те же листы, что в xlsx, но каждый — gzip CSV внутри одного zip:
+#   event.csv.gz    — ключ / значение по ивенту;
+#   Summary.csv.gz  — таблица рынков;
+#   <лист>.csv.gz   — участники рынка, имя как у листа в xlsx.
+# Строки пишутся сразу в поток архива, ничего не копится в памяти.
+# Записи zip — STORED: внутри уже gzip, второй раз не сжимаем.
+
+
+def _open_csv(zf: zipfile.ZipFile, name: str):
+    raw = zf.open(name, "w")
+    gz = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+    text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+    return raw, gz, text
+
+
+def _write_csv(zf: zipfile.ZipFile, name: str, header: list | None, rows) -> None:
+    raw, gz, text = _open_csv(zf, name)
+    try:
+        w = csv.writer(text)
+        if header is not None:
+            w.writerow(header)
+        w.writerows(rows)
+    finally:
+        text.close()  # закрывает gz
+        raw.close()
+
+
+def export_event_report_csv_zip(
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    market_id_by_cid = market_ids(event)
+    markets = markets_sorted(report)
+    participants_of = market_participants(report, top_k)
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        _write_csv(zf, "event.csv.gz", ["key", "value"], event_summary_pairs(report))
+        _write_csv(zf, "Summary.csv.gz", SUMMARY_HEADERS, (summary_row(m, market_id_by_cid) for m in markets))
+        for m, title in market_sheet_titles(markets, taken=["Summary"]):
+            _write_csv(
+                zf,
+                f"{title}.csv.gz",
+                ["conditionId", *PARTICIPANT_HEADERS],
+                ([m.condition_id, *participant_row(p)] for p in checked(participants_of(m.condition_id), cancel)),
+            )
+    return str(out)
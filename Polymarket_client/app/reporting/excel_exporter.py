@@ -1,25 +1,45 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Font
 from openpyxl.utils import get_column_letter
 
 from app.ingestion.event_resolver import EventMeta
-from app.services.event_aggregator import EventReportData, ParticipantTotals
-
-
-def _safe_sheet_title(title: str) -> str:
-    t = (title or "").strip()
-    if not t:
-        return "Market"
-    for ch in ['\\', '/', '?', '*', '[', ']', ':']:
-        t = t.replace(ch, " ")
-    t = " ".join(t.split())
-    return t[:31]
+from app.reporting.report_tables import (
+    PARTICIPANT_HEADERS,
+    SUMMARY_HEADERS,
+    event_summary_pairs,
+    market_ids,
+    market_participants,
+    market_sheet_titles,
+    market_summary_pairs,
+    markets_sorted,
+    participant_row,
+    summary_row,
+)
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals
+from app.utils.cancellation import CancelToken, checked
+
+# Книга пишется в режиме write_only: строки уходят во временный XML листа
+# сразу при append(), а не копятся объектами Cell. Поэтому всё, что относится
+# к листу целиком (ширины колонок, freeze panes), задаётся до первой строки,
+# стили ячеек — через WriteOnlyCell, а автофильтр — в конце, когда известно
+# число строк.
+
+SUMMARY_WIDTHS = {1: 10, 2: 22, 3: 40, 4: 60, 5: 12, 6: 14, 7: 14, 8: 14, 9: 14}
+PARTICIPANT_WIDTHS = {
+    1: 18, 2: 18, 3: 44, 4: 8,
+    5: 12, 6: 14, 7: 12, 8: 14,
+    9: 12, 10: 14, 11: 12, 12: 12,
+    13: 12, 14: 20, 15: 20,
+}
+
+# строка заголовка таблицы на обоих типах листов (выше — блок «ключ / значение»)
+TABLE_ROW = 8
 
 
 def _set_col_widths(ws, widths: Dict[int, int]) -> None:
@@ -27,160 +47,113 @@ def _set_col_widths(ws, widths: Dict[int, int]) -> None:
         ws.column_dimensions[get_column_letter(col_idx)].width = w
 
 
-def _ts_to_str(ts: int | None) -> str:
-    if not ts:
-        return ""
-    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+def _styled(ws, value, *, font: Font | None = None, alignment: Alignment | None = None) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+
+def _append_key_values(ws, pairs: list[tuple[str, object]], bold: Font) -> None:
+    for key, value in pairs:
+        ws.append([_styled(ws, key, font=bold), value])
+    # пустые строки до заголовка таблицы
+    for _ in range(TABLE_ROW - 1 - len(pairs)):
+        ws.append([])
+
+
+def _append_headers(ws, headers: list[str], bold: Font) -> None:
+    align = Alignment(wrap_text=True, vertical="top")
+    ws.append([_styled(ws, h, font=bold, alignment=align) for h in headers])
 
 
-def export_event_report_xlsx(*, event: EventMeta, report: EventReportData, out_path: str) -> str:
-    wb = Workbook()
+def discard_workbook(wb: Workbook) -> None:
+    """
+    Закрывает листы недописанной write_only книги и удаляет их временные
+    файлы (иначе они лежат в tmp до выхода процесса).
+    """
+    for ws in wb.worksheets:
+        try:
+            ws.close()
+        except Exception:
+            pass
+        writer = getattr(ws, "_writer", None)
+        if writer is not None:
+            try:
+                writer.cleanup()
+            except (OSError, ValueError):
+                pass
+
+
+def write_summary_sheet(wb: Workbook, *, event: EventMeta, report: EventReportData, markets: list[MarketTotals]) -> None:
     bold = Font(bold=True)
+    ws = wb.create_sheet(title="Summary")
+    ws.freeze_panes = f"A{TABLE_ROW + 1}"
+    _set_col_widths(ws, SUMMARY_WIDTHS)
+
+    _append_key_values(ws, event_summary_pairs(report), bold)
+    _append_headers(ws, SUMMARY_HEADERS, bold)
 
-    # =====================
-    # Summary sheet
-    # =====================
-    ws = wb.active
-    ws.title = "Summary"
-
-    ws["A1"], ws["B1"] = "Event title", report.event_title
-    ws["A2"], ws["B2"] = "Event id", report.event_id
-    ws["A3"], ws["B3"] = "As of (UTC)", report.as_of_utc
-    ws["A4"], ws["B4"] = "Total trades", report.total_trades
-    ws["A5"], ws["B5"] = "Unique traders", report.unique_traders
-    ws["A6"], ws["B6"] = "Total turnover (USD)", float(report.total_turnover_usd)
-
-    for r in range(1, 7):
-        ws[f"A{r}"].font = bold
-
-    start_row = 8
-    headers = [
-        "market_id",
-        "conditionId",
-        "market_slug",
-        "question",
-        "trades_count",
-        "unique_traders",
-        "buy_usd",
-        "sell_usd",
-        "turnover_usd",
-    ]
-    for c, h in enumerate(headers, 1):
-        cell = ws.cell(row=start_row, column=c, value=h)
-        cell.font = bold
-        cell.alignment = Alignment(wrap_text=True, vertical="top")
-
-    market_id_by_cid = {m.condition_id: m.market_id for m in event.markets}
-
-    markets_sorted = sorted(report.markets.values(), key=lambda x: x.turnover_usd, reverse=True)
-    row = start_row + 1
-    for m in markets_sorted:
-        ws.cell(row, 1, market_id_by_cid.get(m.condition_id, ""))
-        ws.cell(row, 2, m.condition_id)
-        ws.cell(row, 3, m.market_slug)
-        ws.cell(row, 4, m.question)
-        ws.cell(row, 5, m.trades_count)
-        ws.cell(row, 6, len(m.unique_traders))
-        ws.cell(row, 7, float(m.buy_usd))
-        ws.cell(row, 8, float(m.sell_usd))
-        ws.cell(row, 9, float(m.turnover_usd))
+    market_id_by_cid = market_ids(event)
+    row = TABLE_ROW + 1
+    for m in markets:
+        ws.append(summary_row(m, market_id_by_cid))
         row += 1
 
-    ws.freeze_panes = ws[f"A{start_row+1}"]
-    ws.auto_filter.ref = f"A{start_row}:I{row-1}"
-    _set_col_widths(ws, {1: 10, 2: 22, 3: 40, 4: 60, 5: 12, 6: 14, 7: 14, 8: 14, 9: 14})
-
-    # =====================
-    # Per-market sheets
-    # =====================
-    per_market: Dict[str, list[ParticipantTotals]] = {}
-    for (cid, _wallet, _outcome), p in report.participants.items():
-        per_market.setdefault(cid, []).append(p)
-
-    for m in markets_sorted:
-        # имя листа = вопрос рынка (если пусто -> slug)
-        desired = m.question or m.market_slug or "Market"
-        title = _safe_sheet_title(desired)
-
-        # защита от дублей названий листов
-        base = title
-        k = 2
-        while title in wb.sheetnames:
-            title = _safe_sheet_title(f"{base}-{k}")
-            k += 1
-
-        wsm = wb.create_sheet(title=title)
-
-        wsm["A1"], wsm["B1"] = "question", m.question
-        wsm["A2"], wsm["B2"] = "market_slug", m.market_slug
-        wsm["A3"], wsm["B3"] = "conditionId", m.condition_id
-        wsm["A4"], wsm["B4"] = "trades_count", m.trades_count
-        wsm["A5"], wsm["B5"] = "unique_traders", len(m.unique_traders)
-        wsm["A6"], wsm["B6"] = "turnover_usd", float(m.turnover_usd)
-
-        for r in range(1, 7):
-            wsm[f"A{r}"].font = bold
-
-        table_row = 8
-        p_headers = [
-            "trader_name",
-            "trader_pseudonym",
-            "trader_address",
-            "outcome",
-            "buy_shares",
-            "buy_usd",
-            "sell_shares",
-            "sell_usd",
-            "net_shares",
-            "net_spent_usd",
-            "avg_buy_price",
-            "avg_sell_price",
-            "trades_count",
-            "first_ts_utc",
-            "last_ts_utc",
-        ]
-        for c, h in enumerate(p_headers, 1):
-            cell = wsm.cell(row=table_row, column=c, value=h)
-            cell.font = bold
-            cell.alignment = Alignment(wrap_text=True, vertical="top")
-
-        plist = per_market.get(m.condition_id, [])
-        plist.sort(key=lambda p: (p.net_spent_usd, p.buy_usd + p.sell_usd), reverse=True)
-
-        r = table_row + 1
-        for p in plist:
-            wsm.cell(r, 1, p.trader_name)
-            wsm.cell(r, 2, p.trader_pseudonym)
-            wsm.cell(r, 3, p.trader_address)
-            wsm.cell(r, 4, p.outcome)
-
-            wsm.cell(r, 5, float(p.buy_shares))
-            wsm.cell(r, 6, float(p.buy_usd))
-            wsm.cell(r, 7, float(p.sell_shares))
-            wsm.cell(r, 8, float(p.sell_usd))
-
-            wsm.cell(r, 9, float(p.net_shares))
-            wsm.cell(r, 10, float(p.net_spent_usd))
-
-            wsm.cell(r, 11, float(p.avg_buy_price) if p.avg_buy_price is not None else "")
-            wsm.cell(r, 12, float(p.avg_sell_price) if p.avg_sell_price is not None else "")
-
-            wsm.cell(r, 13, p.trades_count)
-            wsm.cell(r, 14, _ts_to_str(p.first_ts))
-            wsm.cell(r, 15, _ts_to_str(p.last_ts))
-            r += 1
-
-        wsm.freeze_panes = wsm["A9"]
-        wsm.auto_filter.ref = f"A{table_row}:O{max(table_row, r-1)}"
-        _set_col_widths(
-            wsm,
-            {
-                1: 18, 2: 18, 3: 44, 4: 8,
-                5: 12, 6: 14, 7: 12, 8: 14,
-                9: 12, 10: 14, 11: 12, 12: 12,
-                13: 12, 14: 20, 15: 20,
-            },
-        )
+    ws.auto_filter.ref = f"A{TABLE_ROW}:I{row-1}"
+
+
+def write_market_sheet(
+    wb: Workbook,
+    *,
+    market: MarketTotals,
+    title: str,
+    participants: Iterable[ParticipantTotals],
+    cancel: CancelToken | None = None,
+) -> None:
+    bold = Font(bold=True)
+    wsm = wb.create_sheet(title=title)
+    wsm.freeze_panes = f"A{TABLE_ROW + 1}"
+    _set_col_widths(wsm, PARTICIPANT_WIDTHS)
+
+    _append_key_values(wsm, market_summary_pairs(market), bold)
+    _append_headers(wsm, PARTICIPANT_HEADERS, bold)
+
+    r = TABLE_ROW + 1
+    for p in checked(participants, cancel):
+        wsm.append(participant_row(p))
+        r += 1
+
+    wsm.auto_filter.ref = f"A{TABLE_ROW}:O{max(TABLE_ROW, r-1)}"
+
+
+def export_event_report_xlsx(
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    """
+    top_k — на листе рынка только K лучших участников (в том же порядке, что и
+    полный лист) и последней строкой «others (N)» — сумма по остальным.
+    cancel — проверяется на каждом листе и каждые CHECK_EVERY строк.
+    """
+    wb = Workbook(write_only=True)
+    markets = markets_sorted(report)
+
+    try:
+        write_summary_sheet(wb, event=event, report=report, markets=markets)
+
+        participants_of = market_participants(report, top_k)
+        for m, title in market_sheet_titles(markets, taken=wb.sheetnames):
+            write_market_sheet(wb, market=m, title=title, participants=participants_of(m.condition_id), cancel=cancel)
+    except BaseException:
+        discard_workbook(wb)
+        raise
 
     out = Path(out_path)
     out.parent.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from app.ingestion.event_resolver import EventMeta
+from app.reporting.report_tables import market_ids, market_participants, market_record, markets_sorted, participant_record
+from app.services.event_aggregator import EventReportData
+from app.utils.cancellation import CancelToken, checked
+
+# Одна JSON-запись на строку, поле "type" — вид записи:
+#   {"type": "event", ...}        — первой строкой;
+#   {"type": "market", ...}       — рынки по обороту;
+#   {"type": "participant", ...}  — участники, рынок за рынком, в порядке листа xlsx.
+# ts — unix-секунды, пустые значения — null.
+
+
+def export_event_report_ndjson(
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    market_id_by_cid = market_ids(event)
+    markets = markets_sorted(report)
+    participants_of = market_participants(report, top_k)
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    with out.open("w", encoding="utf-8", newline="\n") as f:
+        f.write(
+            dumps(
+                {
+                    "type": "event",
+                    "event_id": report.event_id,
+                    "event_slug": report.event_slug,
+                    "event_title": report.event_title,
+                    "as_of_utc": report.as_of_utc,
+                    "total_trades": report.total_trades,
+                    "unique_traders": report.unique_traders,
+                    "total_turnover_usd": float(report.total_turnover_usd),
+                }
+            )
+        )
+        f.write("\n")
+        for m in markets:
+            f.write(dumps({"type": "market", **market_record(m, market_id_by_cid)}))
+            f.write("\n")
+        for m in markets:
+            for p in checked(participants_of(m.condition_id), cancel):
+                f.write(dumps({"type": "participant", **participant_record(p)}))
+                f.write("\n")
+    return str(out)
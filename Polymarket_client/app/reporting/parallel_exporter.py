@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import replace
+from pathlib import Path
+
+from openpyxl import Workbook
+
+from app.ingestion.event_resolver import EventMeta
+from app.reporting.excel_exporter import write_market_sheet, write_summary_sheet
+from app.reporting.report_tables import market_participants, market_sheet_titles, markets_sorted
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals
+from app.services.spill_aggregator import TraderCount
+from app.utils.cancellation import CancelToken, checked
+
+# Параллельный xlsx для ивентов с десятками рынков: лист каждого рынка
+# рендерится отдельной книгой в своём процессе, книги складываются в zip
+# вместе с Summary.xlsx. Сам рендер (openpyxl, XML) — CPU, поэтому
+# процессы, а не потоки.
+#
+# В процесс уходит только то, что нужно листу: рынок (вместо set-а
+# трейдеров — TraderCount) и его участники в порядке листа. Одновременно
+# в полёте не больше 2 * workers рынков, чтобы не копировать в очередь
+# пула весь отчёт сразу.
+#
+# Токен отмены в процессы не передаётся (threading.Event не pickle-ится):
+# его проверяет родитель между рынками и пока ждёт пул, а при отмене
+# снимает ещё не начатые книги. Одна книга рынка дорендеривается.
+
+# как часто родитель, ожидая пул, смотрит на токен отмены
+CANCEL_POLL_S = 0.5
+
+
+def _default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def _render_market_workbook(path: str, market: MarketTotals, title: str, participants: list[ParticipantTotals]) -> str:
+    wb = Workbook(write_only=True)
+    write_market_sheet(wb, market=market, title=title, participants=participants)
+    wb.save(path)
+    return path
+
+
+def _wait_some(pending: set[Future], cancel: CancelToken | None) -> set[Future]:
+    """Ждёт хотя бы одну готовую книгу; отдаёт ещё не готовые."""
+    while True:
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        timeout = CANCEL_POLL_S if cancel is not None else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            fut.result()
+        if done or not pending:
+            return pending
+
+
+def export_event_report_xlsx_zip(
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    workers: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    """
+    zip: Summary.xlsx + по книге на рынок ("NN <лист>.xlsx", NN — место рынка
+    по обороту). Листы — те же, что в export_event_report_xlsx.
+    """
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    workers = workers or _default_workers()
+
+    markets = markets_sorted(report)
+    participants_of = market_participants(report, top_k)
+    width = max(2, len(str(len(markets))))
+
+    with tempfile.TemporaryDirectory(prefix="pm_xlsx_", dir=out.parent) as tmp:
+        summary_path = Path(tmp) / "Summary.xlsx"
+        files: list[tuple[str, str]] = [(str(summary_path), "Summary.xlsx")]
+
+        jobs = []
+        for i, (m, title) in enumerate(market_sheet_titles(markets, taken=["Summary"]), 1):
+            name = f"{i:0{width}d} {title}.xlsx"
+            path = str(Path(tmp) / f"market_{i}.xlsx")
+            files.append((path, name))
+            jobs.append((path, m, title))
+
+        # spawn: экспорт идёт и из процесса пула бота — fork скопировал бы его SQLite-соединения и потоки
+        ex = ProcessPoolExecutor(
+            max_workers=max(1, min(workers, len(jobs) or 1)), mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            pending: set[Future] = set()
+            for path, m, title in jobs:
+                if len(pending) >= 2 * workers:
+                    pending = _wait_some(pending, cancel)
+                light = replace(m, unique_traders=TraderCount(len(m.unique_traders)))
+                participants = list(checked(participants_of(m.condition_id), cancel))
+                pending.add(ex.submit(_render_market_workbook, path, light, title, participants))
+
+            # Summary — пока пул занят рынками
+            wb = Workbook(write_only=True)
+            write_summary_sheet(wb, event=event, report=report, markets=markets)
+            wb.save(summary_path)
+
+            while pending:
+                pending = _wait_some(pending, cancel)
+        except BaseException:
+            ex.shutdown(wait=True, cancel_futures=True)
+            raise
+        ex.shutdown(wait=True)
+
+        # xlsx уже deflate-сжат — в zip кладём как есть
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+            for path, name in files:
+                zf.write(path, name)
+    return str(out)
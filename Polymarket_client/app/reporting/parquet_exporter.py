@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from app.ingestion.event_resolver import EventMeta
+from app.reporting.report_tables import market_ids, market_participants, market_record, markets_sorted, participant_record
+from app.services.event_aggregator import EventReportData
+from app.utils.cancellation import CancelToken, checked
+
+# Parquet (pyarrow — опциональная зависимость, импортируется при экспорте).
+# В zip две таблицы:
+#   markets.parquet      — рынки; поля ивента — в key-value метаданных файла;
+#   participants.parquet — участники всех рынков (длинный формат, condition_id
+#                          в колонке), рынок за рынком в порядке листа xlsx.
+# Участники пишутся row group-ами по ROW_GROUP_SIZE строк.
+
+ROW_GROUP_SIZE = 64_000
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("parquet export needs pyarrow (pip install pyarrow)") from e
+    return pa, pq
+
+
+def _participant_schema(pa):
+    return pa.schema(
+        [
+            ("condition_id", pa.string()),
+            ("trader_address", pa.string()),
+            ("outcome", pa.string()),
+            ("trader_name", pa.string()),
+            ("trader_pseudonym", pa.string()),
+            ("buy_shares", pa.float64()),
+            ("buy_usd", pa.float64()),
+            ("sell_shares", pa.float64()),
+            ("sell_usd", pa.float64()),
+            ("net_shares", pa.float64()),
+            ("net_spent_usd", pa.float64()),
+            ("avg_buy_price", pa.float64()),
+            ("avg_sell_price", pa.float64()),
+            ("trades_count", pa.int64()),
+            ("first_ts", pa.int64()),
+            ("last_ts", pa.int64()),
+        ]
+    )
+
+
+def _chunks(records: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    chunk: list[dict] = []
+    for rec in records:
+        chunk.append(rec)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_event_report_parquet_zip(
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    pa, pq = _require_pyarrow()
+
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    market_id_by_cid = market_ids(event)
+    markets = markets_sorted(report)
+    participants_of = market_participants(report, top_k)
+
+    with tempfile.TemporaryDirectory(prefix="pm_parquet_", dir=out.parent) as tmp:
+        markets_path = Path(tmp) / "markets.parquet"
+        participants_path = Path(tmp) / "participants.parquet"
+
+        markets_table = pa.Table.from_pylist([market_record(m, market_id_by_cid) for m in markets])
+        markets_table = markets_table.replace_schema_metadata(
+            {
+                "event_id": str(report.event_id),
+                "event_slug": report.event_slug,
+                "event_title": report.event_title,
+                "as_of_utc": report.as_of_utc,
+                "total_trades": str(report.total_trades),
+                "unique_traders": str(report.unique_traders),
+                "total_turnover_usd": repr(float(report.total_turnover_usd)),
+            }
+        )
+        pq.write_table(markets_table, markets_path)
+
+        schema = _participant_schema(pa)
+        records = (
+            participant_record(p) for m in markets for p in checked(participants_of(m.condition_id), cancel)
+        )
+        with pq.ParquetWriter(participants_path, schema) as writer:
+            for chunk in _chunks(records, ROW_GROUP_SIZE):
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+        # parquet и так сжат — в zip кладём как есть
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+            zf.write(markets_path, "markets.parquet")
+            zf.write(participants_path, "participants.parquet")
+    return str(out)
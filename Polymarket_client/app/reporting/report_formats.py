@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import importlib.util
+from dataclasses import dataclass
+from typing import Callable
+
+from app.ingestion.event_resolver import EventMeta
+from app.reporting.csv_exporter import export_event_report_csv_zip
+from app.reporting.excel_exporter import export_event_report_xlsx
+from app.reporting.ndjson_exporter import export_event_report_ndjson
+from app.reporting.parallel_exporter import export_event_report_xlsx_zip
+from app.reporting.parquet_exporter import export_event_report_parquet_zip
+from app.services.event_aggregator import EventReportData
+from app.utils.cancellation import CancelToken
+
+# Реестр форматов отчёта. Все экспортёры — функции с одной сигнатурой:
+#   export(*, event, report, out_path, top_k=None, cancel=None) -> путь к файлу.
+# xlsx — для людей; остальные — для скриптов, без затрат на таблицу Excel.
+# parquet есть в реестре, только если установлен pyarrow (опциональная зависимость).
+
+ExportFn = Callable[..., str]
+
+
+@dataclass(frozen=True)
+class ReportFormat:
+    name: str
+    extension: str  # вместе с точкой, может быть составным (".csv.zip")
+    export: ExportFn
+    description: str
+
+
+REPORT_FORMATS: dict[str, ReportFormat] = {
+    f.name: f
+    for f in (
+        ReportFormat("xlsx", ".xlsx", export_event_report_xlsx, "Excel workbook, one sheet per market"),
+        ReportFormat("xlsx.zip", ".xlsx.zip", export_event_report_xlsx_zip, "zip of per-market workbooks rendered in parallel"),
+        ReportFormat("csv", ".csv.zip", export_event_report_csv_zip, "zip of gzip CSV files, one per sheet"),
+        ReportFormat("parquet", ".parquet.zip", export_event_report_parquet_zip, "zip of markets/participants Parquet"),
+        ReportFormat("ndjson", ".ndjson", export_event_report_ndjson, "newline-delimited JSON records"),
+    )
+    if f.name != "parquet" or importlib.util.find_spec("pyarrow") is not None
+}
+
+DEFAULT_REPORT_FORMAT = "xlsx"
+
+
+def get_report_format(name: str) -> ReportFormat:
+    fmt = REPORT_FORMATS.get((name or "").strip().lower())
+    if fmt is None:
+        raise ValueError(f"Unknown report format {name!r}; expected one of: {', '.join(REPORT_FORMATS)}")
+    return fmt
+
+
+def export_event_report(
+    fmt: str,
+    *,
+    event: EventMeta,
+    report: EventReportData,
+    out_path: str,
+    top_k: int | None = None,
+    cancel: CancelToken | None = None,
+) -> str:
+    return get_report_format(fmt).export(event=event, report=report, out_path=out_path, top_k=top_k, cancel=cancel)
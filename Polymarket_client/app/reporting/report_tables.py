@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator
+
+from app.ingestion.event_resolver import EventMeta
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals
+from app.services.participant_table import ParticipantTable
+from app.services.spill_aggregator import SpilledParticipants
+from app.services.top_participants import default_sort_key, top_participants_per_market
+
+# Таблицы отчёта, общие для всех форматов (xlsx, csv, parquet, ndjson):
+# какие листы есть, в каком порядке рынки и участники, что в колонках.
+
+SUMMARY_HEADERS = [
+    "market_id",
+    "conditionId",
+    "market_slug",
+    "question",
+    "trades_count",
+    "unique_traders",
+    "buy_usd",
+    "sell_usd",
+    "turnover_usd",
+]
+
+PARTICIPANT_HEADERS = [
+    "trader_name",
+    "trader_pseudonym",
+    "trader_address",
+    "outcome",
+    "buy_shares",
+    "buy_usd",
+    "sell_shares",
+    "sell_usd",
+    "net_shares",
+    "net_spent_usd",
+    "avg_buy_price",
+    "avg_sell_price",
+    "trades_count",
+    "first_ts_utc",
+    "last_ts_utc",
+]
+
+
+def safe_sheet_title(title: str) -> str:
+    t = (title or "").strip()
+    if not t:
+        return "Market"
+    for ch in ['\\', '/', '?', '*', '[', ']', ':']:
+        t = t.replace(ch, " ")
+    t = " ".join(t.split())
+    return t[:31]
+
+
+def ts_to_str(ts: int | None) -> str:
+    if not ts:
+        return ""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def markets_sorted(report: EventReportData) -> list[MarketTotals]:
+    """Порядок рынков отчёта: по обороту, по убыванию."""
+    return sorted(report.markets.values(), key=lambda x: x.turnover_usd, reverse=True)
+
+
+def market_sheet_titles(markets: Iterable[MarketTotals], taken: Iterable[str] = ()) -> Iterator[tuple[MarketTotals, str]]:
+    """(рынок, уникальное имя листа) — имя = вопрос рынка (если пусто -> slug)."""
+    used = set(taken)
+    for m in markets:
+        desired = m.question or m.market_slug or "Market"
+        title = safe_sheet_title(desired)
+
+        # защита от дублей названий листов
+        base = title
+        k = 2
+        while title in used:
+            title = safe_sheet_title(f"{base}-{k}")
+            k += 1
+        used.add(title)
+        yield m, title
+
+
+def event_summary_pairs(report: EventReportData) -> list[tuple[str, object]]:
+    return [
+        ("Event title", report.event_title),
+        ("Event id", report.event_id),
+        ("As of (UTC)", report.as_of_utc),
+        ("Total trades", report.total_trades),
+        ("Unique traders", report.unique_traders),
+        ("Total turnover (USD)", float(report.total_turnover_usd)),
+    ]
+
+
+def market_summary_pairs(m: MarketTotals) -> list[tuple[str, object]]:
+    return [
+        ("question", m.question),
+        ("market_slug", m.market_slug),
+        ("conditionId", m.condition_id),
+        ("trades_count", m.trades_count),
+        ("unique_traders", len(m.unique_traders)),
+        ("turnover_usd", float(m.turnover_usd)),
+    ]
+
+
+def summary_row(m: MarketTotals, market_id_by_cid: Dict[str, object]) -> list:
+    return [
+        market_id_by_cid.get(m.condition_id, ""),
+        m.condition_id,
+        m.market_slug,
+        m.question,
+        m.trades_count,
+        len(m.unique_traders),
+        float(m.buy_usd),
+        float(m.sell_usd),
+        float(m.turnover_usd),
+    ]
+
+
+def market_ids(event: EventMeta) -> Dict[str, object]:
+    return {m.condition_id: m.market_id for m in event.markets}
+
+
+def participant_row(p: ParticipantTotals) -> list:
+    return [
+        p.trader_name,
+        p.trader_pseudonym,
+        p.trader_address,
+        p.outcome,
+        float(p.buy_shares),
+        float(p.buy_usd),
+        float(p.sell_shares),
+        float(p.sell_usd),
+        float(p.net_shares),
+        float(p.net_spent_usd),
+        float(p.avg_buy_price) if p.avg_buy_price is not None else "",
+        float(p.avg_sell_price) if p.avg_sell_price is not None else "",
+        p.trades_count,
+        ts_to_str(p.first_ts),
+        ts_to_str(p.last_ts),
+    ]
+
+
+def participant_record(p: ParticipantTotals) -> dict:
+    """Участник для машинных форматов: типизированные значения, ts — unix-секунды."""
+    return {
+        "condition_id": p.condition_id,
+        "trader_address": p.trader_address,
+        "outcome": p.outcome,
+        "trader_name": p.trader_name,
+        "trader_pseudonym": p.trader_pseudonym,
+        "buy_shares": float(p.buy_shares),
+        "buy_usd": float(p.buy_usd),
+        "sell_shares": float(p.sell_shares),
+        "sell_usd": float(p.sell_usd),
+        "net_shares": float(p.net_shares),
+        "net_spent_usd": float(p.net_spent_usd),
+        "avg_buy_price": p.avg_buy_price,
+        "avg_sell_price": p.avg_sell_price,
+        "trades_count": int(p.trades_count),
+        "first_ts": p.first_ts,
+        "last_ts": p.last_ts,
+    }
+
+
+def market_record(m: MarketTotals, market_id_by_cid: Dict[str, object]) -> dict:
+    return {
+        "market_id": market_id_by_cid.get(m.condition_id),
+        "condition_id": m.condition_id,
+        "market_slug": m.market_slug,
+        "question": m.question,
+        "trades_count": int(m.trades_count),
+        "unique_traders": len(m.unique_traders),
+        "buy_usd": float(m.buy_usd),
+        "sell_usd": float(m.sell_usd),
+        "turnover_usd": float(m.turnover_usd),
+    }
+
+
+def market_participants(
+    report: EventReportData, top_k: int | None = None
+) -> Callable[[str], Iterable[ParticipantTotals]]:
+    """
+    conditionId -> участники рынка в порядке листа (net_spent_usd, оборот — по
+    убыванию). top_k — K лучших и строка «others (N)».
+    """
+    if top_k:
+        tops = top_participants_per_market(report.participants.values(), top_k)
+
+        def top_rows(cid: str) -> Iterable[ParticipantTotals]:
+            top = tops.get(cid)
+            if top is None:
+                return ()
+            return top.top + ([top.others] if top.others is not None else [])
+
+        return top_rows
+
+    if isinstance(report.participants, SpilledParticipants):
+        # сортирует SQLite, по одному рынку за раз
+        return report.participants.iter_market_sorted
+    if isinstance(report.participants, ParticipantTable):
+        # сортируются номера строк рынка; объекты участников — только на время листа
+        return report.participants.iter_market_sorted
+
+    # объекты участников уже в памяти — держим только списки ссылок на них
+    per_market: Dict[str, list[ParticipantTotals]] = {}
+    for (cid, _wallet, _outcome), p in report.participants.items():
+        per_market.setdefault(cid, []).append(p)
+    for plist in per_market.values():
+        plist.sort(key=default_sort_key, reverse=True)
+    return lambda cid: per_market.get(cid, ())
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+from typing import Callable, Iterable, Iterator
+
+from app.ingestion.event_resolver import EventMeta, MarketMeta
+from app.services.event_aggregator import COMPACT_MIN_PARTICIPANTS, EventReportData, MarketTotals, ParticipantTotals
+from app.services.participant_table import ParticipantTable
+from app.services.spill_aggregator import SpilledParticipants, TraderCount, participant_limit
+from app.storage.sqlite_event_store import (
+    DEFAULT_BATCH_SIZE,
+    count_event_traders,
+    count_participants,
+    iter_market_totals,
+    iter_market_trader_counts,
+    iter_participant_totals,
+)
+from app.utils.cancellation import CHECK_EVERY, CancelToken, checked
+
+# Отчёт ивента из готовых итогов стора (participant_totals / market_totals):
+# SQL-чтение — в app/storage/sqlite_event_store, здесь — сборка EventReportData
+# (dict, ParticipantTable на больших ивентах или SpilledParticipants, если
+# участников больше бюджета).
+
+
+def aggregate_event_from_db(
+    conn: sqlite3.Connection,
+    event: EventMeta,
+    *,
+    as_of_utc: str,
+    memory_budget_mb: float | None = None,
+    compact: bool | None = None,
+    cancel: CancelToken | None = None,
+    progress_cb: Callable[[int, int], None] | None = None,
+) -> EventReportData:
+    """
+    То же, что aggregate_event(event, iter_trades_from_db(...)), но из таблиц
+    participant_totals / market_totals, которые insert_trades держит в актуальном
+    состоянии (строки — iter_participant_totals / iter_market_totals).
+    Время — пропорционально числу участников, а не трейдов.
+
+    memory_budget_mb — если участников больше, чем влезает в бюджет, они
+    переливаются в SpilledParticipants (временный файл), а число трейдеров
+    рынков считается в SQL.
+
+    compact — участники в ParticipantTable (трейдеры рынков — из SQL):
+    True — всегда, None — если участников больше COMPACT_MIN_PARTICIPANTS.
+
+    cancel — проверяется каждые CHECK_EVERY строк участников.
+    progress_cb(обработано участников, всего участников) — каждые CHECK_EVERY строк.
+    """
+    markets = _markets_from_rows(event, iter_market_totals(conn, event_id=event.event_id))
+    participant_rows = iter_participant_totals(conn, event_id=event.event_id)
+
+    n_participants = 0
+    if memory_budget_mb is not None or progress_cb is not None or compact is None:
+        n_participants = count_participants(conn, event_id=event.event_id)
+    participant_rows = checked(participant_rows, cancel)
+    if progress_cb is not None:
+        participant_rows = _reporting_rows(participant_rows, n_participants, progress_cb)
+
+    if memory_budget_mb is not None and n_participants > participant_limit(memory_budget_mb):
+        return _spilled_report_from_db(conn, event, markets, participant_rows, as_of_utc=as_of_utc)
+    if compact or (compact is None and n_participants > COMPACT_MIN_PARTICIPANTS):
+        return _compact_report_from_db(conn, event, markets, participant_rows, as_of_utc=as_of_utc)
+
+    participants: dict[tuple[str, str, str], ParticipantTotals] = {}
+    all_traders: set[str] = set()
+    for (
+        cid, wallet, name, pseudonym, outcome,
+        buy_shares, buy_usd, sell_shares, sell_usd,
+        trades_count, first_ts, last_ts,
+    ) in participant_rows:
+        markets[cid].unique_traders.add(wallet)
+        all_traders.add(wallet)
+        participants[(cid, wallet, outcome)] = ParticipantTotals(
+            condition_id=cid,
+            trader_address=wallet,
+            outcome=outcome,
+            trader_name=name or "",
+            trader_pseudonym=pseudonym or "",
+            buy_shares=buy_shares,
+            buy_usd=buy_usd,
+            sell_shares=sell_shares,
+            sell_usd=sell_usd,
+            trades_count=int(trades_count),
+            first_ts=first_ts,
+            last_ts=last_ts,
+        )
+
+    return EventReportData(
+        event_id=event.event_id,
+        event_slug=event.slug,
+        event_title=event.title,
+        as_of_utc=as_of_utc,
+        total_trades=sum(m.trades_count for m in markets.values()),
+        unique_traders=len(all_traders),
+        total_turnover_usd=sum(m.turnover_usd for m in markets.values()),
+        markets=markets,
+        participants=participants,
+    )
+
+
+def _reporting_rows(rows: Iterable[tuple], total: int, progress_cb: Callable[[int, int], None]) -> Iterator[tuple]:
+    done = 0
+    for row in rows:
+        yield row
+        done += 1
+        if done % CHECK_EVERY == 0:
+            try:
+                progress_cb(done, total)
+            except Exception:
+                # прогресс не должен ломать агрегацию
+                pass
+
+
+def _spilled_report_from_db(
+    conn: sqlite3.Connection,
+    event: EventMeta,
+    markets: dict[str, MarketTotals],
+    participant_rows: Iterable[tuple],
+    *,
+    as_of_utc: str,
+) -> EventReportData:
+    out = SpilledParticipants(tempfile.mkdtemp(prefix="pm_agg_"))
+    batch: list[tuple] = []
+    try:
+        for (
+            cid, wallet, name, pseudonym, outcome,
+            buy_shares, buy_usd, sell_shares, sell_usd,
+            trades_count, first_ts, last_ts,
+        ) in participant_rows:
+            batch.append(
+                (cid, wallet, outcome, name or "", pseudonym or "",
+                 buy_shares, buy_usd, sell_shares, sell_usd, int(trades_count), first_ts, last_ts)
+            )
+            if len(batch) >= DEFAULT_BATCH_SIZE:
+                out.add_rows(batch)
+                batch = []
+        out.add_rows(batch)
+        out.seal()
+    except BaseException:
+        # отмена / ошибка на середине — временный файл не ждёт сборщика мусора
+        out.close()
+        raise
+
+    return _report_with_sql_traders(conn, event, markets, out, as_of_utc=as_of_utc)
+
+
+def _compact_report_from_db(
+    conn: sqlite3.Connection,
+    event: EventMeta,
+    markets: dict[str, MarketTotals],
+    participant_rows: Iterable[tuple],
+    *,
+    as_of_utc: str,
+) -> EventReportData:
+    table = ParticipantTable()
+    for (
+        cid, wallet, name, pseudonym, outcome,
+        buy_shares, buy_usd, sell_shares, sell_usd,
+        trades_count, first_ts, last_ts,
+    ) in participant_rows:
+        table.add_values(
+            table.row(cid, wallet, outcome, name or "", pseudonym or ""),
+            buy_shares, buy_usd, sell_shares, sell_usd, int(trades_count), first_ts, last_ts,
+        )
+    return _report_with_sql_traders(conn, event, markets, table, as_of_utc=as_of_utc)
+
+
+def _report_with_sql_traders(
+    conn: sqlite3.Connection,
+    event: EventMeta,
+    markets: dict[str, MarketTotals],
+    participants: SpilledParticipants | ParticipantTable,
+    *,
+    as_of_utc: str,
+) -> EventReportData:
+    # число трейдеров рынков — в SQL, без set-а кошельков на рынок
+    for cid, traders in iter_market_trader_counts(conn, event_id=event.event_id):
+        markets[cid].unique_traders = TraderCount(traders)
+    unique_traders = count_event_traders(conn, event_id=event.event_id)
+
+    return EventReportData(
+        event_id=event.event_id,
+        event_slug=event.slug,
+        event_title=event.title,
+        as_of_utc=as_of_utc,
+        total_trades=sum(m.trades_count for m in markets.values()),
+        unique_traders=unique_traders,
+        total_turnover_usd=sum(m.turnover_usd for m in markets.values()),
+        markets=markets,
+        participants=participants,
+    )
+
+
+def _markets_from_rows(event: EventMeta, rows: Iterable[tuple]) -> dict[str, MarketTotals]:
+    market_by_cid: dict[str, MarketMeta] = {m.condition_id: m for m in event.markets}
+
+    markets: dict[str, MarketTotals] = {}
+    for cid, trade_slug, trade_title, trades_count, buy_usd, sell_usd, turnover_usd in rows:
+        mm = market_by_cid.get(cid)
+        markets[cid] = MarketTotals(
+            condition_id=cid,
+            market_slug=(mm.slug if mm else (trade_slug or "")),
+            question=(mm.question if mm else (trade_title or "")),
+            trades_count=int(trades_count),
+            buy_usd=buy_usd,
+            sell_usd=sell_usd,
+            turnover_usd=turnover_usd,
+        )
+    return markets
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from sys import intern
 from typing import Callable, Dict, Iterable, Tuple
 
 from app.ingestion.event_resolver import EventMeta, MarketMeta
 from app.ingestion.trades_loader import Trade
+from app.utils.cancellation import CHECK_EVERY, CancelToken
+from app.utils.hyperloglog import HyperLogLog
 
+# compact=None (по умолчанию): участники копятся в dict, пока их не больше
+# COMPACT_MIN_PARTICIPANTS, дальше — переезд в ParticipantTable
+# (app/services/participant_table): на огромных ивентах dict объектов
+# ParticipantTotals — основная память отчёта.
+COMPACT_MIN_PARTICIPANTS = 200_000
 
-@dataclass
+
+@dataclass(slots=True)
 class MarketTotals:
     condition_id: str
     market_slug: str
@@ -17,14 +26,32 @@ class MarketTotals:
     buy_usd: float = 0.0
     sell_usd: float = 0.0
     turnover_usd: float = 0.0
-    unique_traders: set[str] = None
+    # set кошельков, либо HyperLogLog при aggregate_event(approx_unique_traders=True)
+    unique_traders: set[str] | HyperLogLog = None
 
     def __post_init__(self):
         if self.unique_traders is None:
             self.unique_traders = set()
 
-
-@dataclass
+    def merge(self, other: "MarketTotals") -> "MarketTotals":
+        """Вливает other (тот же рынок, другая часть трейдов) в self. Ассоциативно."""
+        if not self.market_slug:
+            self.market_slug = other.market_slug
+        if not self.question:
+            self.question = other.question
+        self.trades_count += other.trades_count
+        self.buy_usd += other.buy_usd
+        self.sell_usd += other.sell_usd
+        self.turnover_usd += other.turnover_usd
+        if isinstance(other.unique_traders, HyperLogLog) and not isinstance(self.unique_traders, HyperLogLog):
+            # точный set | приблизительный = приблизительный
+            self.unique_traders = other.unique_traders | self.unique_traders
+        else:
+            self.unique_traders |= other.unique_traders
+        return self
+
+
+@dataclass(slots=True)
 class ParticipantTotals:
     condition_id: str
     trader_address: str
@@ -42,6 +69,23 @@ class ParticipantTotals:
     first_ts: int | None = None
     last_ts: int | None = None
 
+    def merge(self, other: "ParticipantTotals") -> "ParticipantTotals":
+        """Вливает other (тот же ключ, другая часть трейдов) в self. Ассоциативно."""
+        if not self.trader_name:
+            self.trader_name = other.trader_name
+        if not self.trader_pseudonym:
+            self.trader_pseudonym = other.trader_pseudonym
+        self.buy_shares += other.buy_shares
+        self.buy_usd += other.buy_usd
+        self.sell_shares += other.sell_shares
+        self.sell_usd += other.sell_usd
+        self.trades_count += other.trades_count
+        if other.first_ts is not None and (self.first_ts is None or other.first_ts < self.first_ts):
+            self.first_ts = other.first_ts
+        if other.last_ts is not None and (self.last_ts is None or other.last_ts > self.last_ts):
+            self.last_ts = other.last_ts
+        return self
+
     @property
     def net_shares(self) -> float:
         return self.buy_shares - self.sell_shares
@@ -80,7 +124,37 @@ def aggregate_event(
     as_of_utc: str,
     progress_cb: Callable[[int], None] | None = None,
     progress_every: int = 500,
+    base: EventReportData | None = None,
+    approx_unique_traders: bool = False,
+    compact: bool | None = None,
+    memory_budget_mb: float | None = None,
+    cancel: CancelToken | None = None,
 ) -> EventReportData:
+    """
+    base — ранее посчитанный отчёт по этому ивенту (например, из снапшота,
+    см. app/storage/report_snapshot): тогда trades — только новые трейды,
+    которых в base ещё нет, и они доливаются в него. Словари markets /
+    participants берутся из base и изменяются на месте.
+
+    compact — участники в ParticipantTable: True — сразу, False — никогда,
+    None — когда их больше COMPACT_MIN_PARTICIPANTS.
+    approx_unique_traders — трейдеры рынков в HyperLogLog вместо set (~1% ошибки).
+
+    memory_budget_mb — сверх бюджета состояние участников уходит на диск
+    (см. app/services/spill_aggregator); с base / compact=True не сочетается.
+
+    cancel — проверяется каждые CHECK_EVERY трейдов (OperationCancelled).
+    """
+    if memory_budget_mb is not None:
+        if base is not None or compact:
+            raise ValueError("memory_budget_mb cannot be combined with base or compact")
+        # spill_aggregator сам вызывает aggregate_event по кускам
+        from app.services.spill_aggregator import aggregate_event_spilling
+
+        return aggregate_event_spilling(
+            event, trades, as_of_utc, memory_budget_mb=memory_budget_mb, progress_cb=progress_cb, cancel=cancel
+        )
+
     market_by_cid: dict[str, MarketMeta] = {m.condition_id: m for m in event.markets}
 
     markets: dict[str, MarketTotals] = {}
@@ -90,6 +164,26 @@ def aggregate_event(
     total_trades = 0
     total_turnover = 0.0
 
+    if base is not None:
+        if base.event_id != event.event_id:
+            raise ValueError(f"base report is for event {base.event_id}, not {event.event_id}")
+        markets = base.markets
+        participants = base.participants
+        total_trades = base.total_trades
+        total_turnover = base.total_turnover_usd
+
+    # participant_table импортирует ParticipantTotals из этого модуля
+    from app.services.participant_table import ParticipantTable
+
+    table: ParticipantTable | None = None
+    if isinstance(participants, ParticipantTable):
+        table = participants
+    elif compact or (compact is None and len(participants) > COMPACT_MIN_PARTICIPANTS):
+        table = participants = to_participant_table(participants.values())
+
+    if base is not None and table is None:
+        all_traders = {wallet for (_cid, wallet, _outcome) in participants}
+
     # защитимся от странных значений
     if progress_every <= 0:
         progress_every = 500
@@ -100,12 +194,17 @@ def aggregate_event(
         if not cid or not wallet:
             continue
 
+        # одна копия строк на весь отчёт: ключи, участники и set-ы рынков ссылаются на неё
+        cid = intern(cid)
+        wallet = intern(wallet)
+
         mm = market_by_cid.get(cid)
         if cid not in markets:
             markets[cid] = MarketTotals(
                 condition_id=cid,
                 market_slug=(mm.slug if mm else tr.market_slug),
                 question=(mm.question if mm else tr.market_title),
+                unique_traders=(HyperLogLog() if approx_unique_traders else None),
             )
         mt = markets[cid]
 
@@ -113,6 +212,7 @@ def aggregate_event(
         price = float(tr.price)
         usd = size * price
         side = (tr.side or "").upper()
+        ts = int(tr.timestamp or 0)
 
         mt.trades_count += 1
         mt.turnover_usd += usd
@@ -121,46 +221,58 @@ def aggregate_event(
         elif side == "SELL":
             mt.sell_usd += usd
 
+        if table is None and compact is None and len(participants) > COMPACT_MIN_PARTICIPANTS:
+            # порог пройден — дальше участники копятся в таблице
+            table = participants = to_participant_table(participants.values())
+            all_traders = set()
+
         mt.unique_traders.add(wallet)
-        all_traders.add(wallet)
+        if table is None:
+            # в компактном режиме кошельки ивента и так перечислены в таблице
+            all_traders.add(wallet)
 
         # per-participant per-outcome
-        outcome = tr.outcome or ""
-        key = (cid, wallet, outcome)
-        if key not in participants:
-            participants[key] = ParticipantTotals(
-                condition_id=cid,
-                trader_address=wallet,
-                outcome=outcome,
-                trader_name=tr.name or "",
-                trader_pseudonym=tr.pseudonym or "",
-            )
-        pt = participants[key]
-
-        # обновляем имя/ник если раньше пусто
-        if not pt.trader_name and tr.name:
-            pt.trader_name = tr.name
-        if not pt.trader_pseudonym and tr.pseudonym:
-            pt.trader_pseudonym = tr.pseudonym
-
-        if side == "BUY":
-            pt.buy_shares += size
-            pt.buy_usd += usd
-        elif side == "SELL":
-            pt.sell_shares += size
-            pt.sell_usd += usd
-
-        pt.trades_count += 1
-        ts = int(tr.timestamp or 0)
-        if ts:
-            if pt.first_ts is None or ts < pt.first_ts:
-                pt.first_ts = ts
-            if pt.last_ts is None or ts > pt.last_ts:
-                pt.last_ts = ts
+        if table is not None:
+            table.add_trade(table.row(cid, wallet, tr.outcome or "", tr.name, tr.pseudonym), side, size, usd, ts)
+        else:
+            outcome = intern(tr.outcome or "")
+            key = (cid, wallet, outcome)
+            pt = participants.get(key)
+            if pt is None:
+                pt = participants[key] = ParticipantTotals(
+                    condition_id=cid,
+                    trader_address=wallet,
+                    outcome=outcome,
+                    trader_name=tr.name or "",
+                    trader_pseudonym=tr.pseudonym or "",
+                )
+
+            # обновляем имя/ник если раньше пусто
+            if not pt.trader_name and tr.name:
+                pt.trader_name = tr.name
+            if not pt.trader_pseudonym and tr.pseudonym:
+                pt.trader_pseudonym = tr.pseudonym
+
+            if side == "BUY":
+                pt.buy_shares += size
+                pt.buy_usd += usd
+            elif side == "SELL":
+                pt.sell_shares += size
+                pt.sell_usd += usd
+
+            pt.trades_count += 1
+            if ts:
+                if pt.first_ts is None or ts < pt.first_ts:
+                    pt.first_ts = ts
+                if pt.last_ts is None or ts > pt.last_ts:
+                    pt.last_ts = ts
 
         total_trades += 1
         total_turnover += usd
 
+        if cancel is not None and total_trades % CHECK_EVERY == 0:
+            cancel.raise_if_cancelled()
+
         if progress_cb and (total_trades % progress_every == 0):
             try:
                 progress_cb(total_trades)
@@ -181,7 +293,64 @@ def aggregate_event(
         event_title=event.title,
         as_of_utc=as_of_utc,
         total_trades=total_trades,
-        unique_traders=len(all_traders),
+        unique_traders=(table.wallet_count if table is not None else len(all_traders)),
+        total_turnover_usd=total_turnover,
+        markets=markets,
+        participants=participants,
+    )
+
+
+def to_participant_table(participants: Iterable[ParticipantTotals]) -> "ParticipantTable":
+    """Копия участников в ParticipantTable (участники одного ключа суммируются)."""
+    from app.services.participant_table import ParticipantTable
+
+    table = ParticipantTable()
+    for pt in participants:
+        table.add_totals(pt)
+    return table
+
+
+def merge_reports(
+    event: EventMeta,
+    reports: Iterable[EventReportData],
+    as_of_utc: str,
+) -> EventReportData:
+    """
+    Сводит отчёты по частям трейдов ивента (любое разбиение) в один.
+    Частичные отчёты не изменяются: первая встреча ключа копируется.
+    unique_traders пересчитывается по кошелькам участников — сумма по частям
+    считала бы дважды тех, кто попал в несколько частей.
+    """
+    markets: dict[str, MarketTotals] = {}
+    participants: dict[tuple[str, str, str], ParticipantTotals] = {}
+    total_trades = 0
+    total_turnover = 0.0
+
+    for rep in reports:
+        total_trades += rep.total_trades
+        total_turnover += rep.total_turnover_usd
+
+        for cid, mt in rep.markets.items():
+            cur = markets.get(cid)
+            if cur is None:
+                markets[cid] = replace(mt, unique_traders=mt.unique_traders.copy())
+            else:
+                cur.merge(mt)
+
+        for key, pt in rep.participants.items():
+            cur = participants.get(key)
+            if cur is None:
+                participants[key] = replace(pt)
+            else:
+                cur.merge(pt)
+
+    return EventReportData(
+        event_id=event.event_id,
+        event_slug=event.slug,
+        event_title=event.title,
+        as_of_utc=as_of_utc,
+        total_trades=total_trades,
+        unique_traders=len({wallet for (_cid, wallet, _outcome) in participants}),
         total_turnover_usd=total_turnover,
         markets=markets,
         participants=participants,
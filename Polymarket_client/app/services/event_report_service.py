@@ -0,0 +1,379 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from app.ingestion.event_resolver import EventMeta, resolve_event
+from app.ingestion.trades_loader import Trade, iter_event_trades
+from app.reporting.report_formats import DEFAULT_REPORT_FORMAT, get_report_format
+from app.services.db_aggregator import aggregate_event_from_db
+from app.services.event_aggregator import EventReportData, aggregate_event
+from app.storage.columnar_cache import default_cache_dir, has_event_cache, refresh_event_cache
+from app.storage.report_cache import CachedReport, ReportCache, report_cache_key
+from app.storage.report_snapshot import default_snapshot_path, load_report_snapshot, save_report_snapshot
+from app.storage.sqlite_connections import SqliteStore, get_store
+from app.storage.sqlite_event_store import (
+    get_event_sync,
+    has_trade_id,
+    insert_trades,
+    iter_trades_from_db,
+    mark_event_synced,
+    max_trade_id,
+    purge_event_trades,
+    upsert_event,
+    upsert_markets,
+)
+from app.utils.cancellation import CancelToken
+from app.utils.file_lock import file_lock
+from app.utils.progress_reporter import ProgressReporter
+
+# общий стор на все ивенты (бот и CLI читают через него)
+DEFAULT_DB_PATH = Path(__file__).resolve().parents[3] / "out" / "events.sqlite"
+
+# если ивент синхронизировали не раньше чем max_age_s назад — в API не ходим
+DEFAULT_MAX_AGE_S = 60.0
+
+# Data API отдаёт трейды от новых к старым; при дельте листаем, пока не уйдём
+# ниже high_water_ts - overlap (перекрытие на поздно доехавшие трейды, дубли
+# отсекает dedup_key)
+DEFAULT_OVERLAP_S = 300
+
+
+def _event_lock(db_path: str, event_id: int):
+    # один ивент в одном сторе синхронизирует только один поток / процесс (отчёты
+    # бота собираются в пуле процессов), остальные ждут и читают готовое
+    return file_lock(Path(f"{db_path}.locks") / f"event_{int(event_id)}.lock")
+
+
+@dataclass(frozen=True)
+class SyncResult:
+    fetched: int
+    inserted: int
+    ignored: int
+    mode: str  # "fresh" (в API не ходили) | "delta" | "full"
+    complete: bool  # дошли до конца истории / до high-water mark
+
+
+def utc_now_str() -> str:
+    return datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def sync_event_trades(
+    store: SqliteStore,
+    event: EventMeta,
+    *,
+    max_age_s: float = DEFAULT_MAX_AGE_S,
+    overlap_s: int = DEFAULT_OVERLAP_S,
+    api_limit: int = 500,
+    chunk_size: int = 500,
+    taker_only: bool = False,
+    raw_filter: Callable[[dict[str, Any]], bool] | None = None,
+    raw_filter_key: str = "",
+    max_trades: int | None = None,
+    max_shares: float | None = None,
+    log: Callable[[str], None] | None = None,
+    cancel: CancelToken | None = None,
+    progress_cb: Callable[[int, int, float | None], None] | None = None,
+) -> SyncResult:
+    """
+    Догружает трейды ивента в стор: полная выгрузка, если полной истории ещё нет,
+    иначе дельта до high-water mark. Сеть — в текущем потоке, каждая пачка
+    уходит отдельной транзакцией в поток-писатель стора.
+    При отмене (cancel) уже записанные пачки остаются в сторе, а high-water
+    mark не двигается — следующая синхронизация догрузит историю целиком.
+
+    progress_cb(fetched, inserted, fraction) — после каждой страницы API;
+    fraction — доля пройденного интервала времени (трейды идут от новых к
+    старым: от самого нового до high-water mark при дельте или до начала
+    ивента при полной выгрузке), None — если нижняя граница неизвестна.
+
+    raw_filter_key — отпечаток raw_filter (MarketFilter.fingerprint), без него
+    фильтр не принимается: история в сторе помнит, с каким фильтром выкачана,
+    и при смене фильтра (в т.ч. на "без фильтра") ивент выкачивается заново.
+    """
+    if raw_filter is not None and not raw_filter_key:
+        raise ValueError("raw_filter needs raw_filter_key (e.g. MarketFilter.fingerprint)")
+
+    def upsert_meta(conn) -> None:
+        upsert_event(conn, event)
+        upsert_markets(conn, event)
+
+    store.write(upsert_meta)
+
+    with store.reader() as conn:
+        state = get_event_sync(conn, event_id=event.event_id)
+    now = time.time()
+    if state is not None and (state.taker_only != bool(taker_only) or state.filter_key != raw_filter_key):
+        # история в другом режиме takerOnly (с maker-трейдами или без) или с другим
+        # фильтром рынков — её не догрузить дельтой, и смешивать её с новой нельзя:
+        # выкачиваем ивент заново
+        store.write(lambda conn: purge_event_trades(conn, event_id=event.event_id))
+        state = None
+    have_full = state is not None and state.full_synced
+
+    if have_full and state.last_synced_at is not None and (now - state.last_synced_at) < max_age_s:
+        return SyncResult(fetched=0, inserted=0, ignored=0, mode="fresh", complete=True)
+
+    stop_below_ts: int | None = None
+    if have_full and state.high_water_ts is not None:
+        stop_below_ts = state.high_water_ts - int(overlap_s)
+    mode = "delta" if stop_below_ts is not None else "full"
+
+    buf: list[Trade] = []
+    fetched = 0
+    inserted = 0
+    ignored = 0
+    cum_shares = 0.0
+    max_ts: int | None = None
+    last_ts: int | None = None
+    complete = True
+    floor_ts = stop_below_ts if stop_below_ts is not None else event.start_ts
+
+    def on_page(_processed: int, _offset: int) -> None:
+        fraction = None
+        if floor_ts is not None and max_ts is not None and last_ts is not None and max_ts > floor_ts:
+            fraction = min(1.0, max(0.0, (max_ts - last_ts) / (max_ts - floor_ts)))
+        try:
+            progress_cb(fetched, inserted, fraction)
+        except Exception:
+            # прогресс не должен ломать синхронизацию
+            pass
+
+    def flush() -> None:
+        nonlocal inserted, ignored
+        batch = list(buf)
+        stats = store.write(lambda conn: insert_trades(conn, event_id=event.event_id, trades=batch))
+        inserted += stats.inserted
+        ignored += stats.ignored
+        buf.clear()
+        if log:
+            log(f"   fetched={fetched} inserted={inserted} ignored={ignored} cum_shares≈{cum_shares:.4f}")
+
+    for tr in iter_event_trades(
+        event.event_id,
+        limit=int(api_limit),
+        taker_only=bool(taker_only),
+        raw_filter=raw_filter,
+        cancel=cancel,
+        progress_cb=on_page if progress_cb is not None else None,
+        progress_every=int(api_limit),
+    ):
+        if stop_below_ts is not None and tr.timestamp and tr.timestamp < stop_below_ts:
+            # дальше только то, что уже лежит в БД
+            break
+
+        fetched += 1
+        cum_shares += abs(float(tr.size or 0.0))
+        if tr.timestamp and (max_ts is None or tr.timestamp > max_ts):
+            max_ts = tr.timestamp
+        if tr.timestamp:
+            last_ts = tr.timestamp
+        buf.append(tr)
+
+        if len(buf) >= int(chunk_size):
+            flush()
+
+        if max_trades and fetched >= int(max_trades):
+            if log:
+                log(f"   Reached max_trades={max_trades}, stopping fetch.")
+            complete = False
+            break
+
+        if max_shares and cum_shares >= float(max_shares):
+            if log:
+                log(f"   Reached max_shares={max_shares}, stopping fetch.")
+            complete = False
+            break
+
+    if buf:
+        flush()
+
+    # high-water mark двигаем только если дельта/выгрузка дошла до конца,
+    # иначе между ним и старыми данными осталась бы дыра
+    store.write(
+        lambda conn: mark_event_synced(
+            conn,
+            event_id=event.event_id,
+            full_synced=complete,
+            taker_only=bool(taker_only),
+            filter_key=raw_filter_key,
+            high_water_ts=max_ts if complete else None,
+            synced_at=now,
+        )
+    )
+
+    cache_root = default_cache_dir(store.db_path)
+    if inserted and has_event_cache(cache_root, event.event_id):
+        # колоночный кэш ивента (--engine numpy) уже заведён — дописываем в него дельту сразу
+        with store.reader() as conn:
+            refresh_event_cache(conn, cache_root, event.event_id)
+
+    return SyncResult(fetched=fetched, inserted=inserted, ignored=ignored, mode=mode, complete=complete)
+
+
+def aggregate_event_incremental(
+    store: SqliteStore,
+    event: EventMeta,
+    *,
+    as_of_utc: str,
+    snapshot_path: str | Path | None = None,
+    progress_cb: Callable[[int], None] | None = None,
+    compact: bool | None = None,
+    approx_unique_traders: bool = False,
+) -> EventReportData:
+    """
+    aggregate_event, который продолжает с сохранённого снапшота: из стора
+    читаются только трейды с id больше high-water mark снапшота, затем
+    снапшот перезаписывается. Без снапшота — полный проход (и первый снапшот).
+    compact / approx_unique_traders — как в aggregate_event.
+    """
+    path = Path(snapshot_path) if snapshot_path else default_snapshot_path(store.db_path, event.event_id)
+
+    base, high_water_id = None, 0
+    snap = load_report_snapshot(path)
+    if snap is not None and snap[0].event_id == event.event_id:
+        base, high_water_id = snap
+
+    with store.reader() as conn:
+        if base is not None and not has_trade_id(conn, event_id=event.event_id, trade_id=high_water_id):
+            # трейды ивента удалялись (смена режима takerOnly) — снапшот устарел
+            base, high_water_id = None, 0
+
+        # MAX(id) и сами трейды читаются в одной транзакции — одно и то же состояние
+        new_high_water_id = max_trade_id(conn, event_id=event.event_id, after_id=high_water_id)
+        if base is not None and new_high_water_id == high_water_id:
+            base.as_of_utc = as_of_utc
+            return base
+
+        report = aggregate_event(
+            event,
+            iter_trades_from_db(conn, event_id=event.event_id, after_id=high_water_id),
+            as_of_utc,
+            progress_cb=progress_cb,
+            base=base,
+            approx_unique_traders=approx_unique_traders,
+            compact=compact,
+        )
+
+    save_report_snapshot(path, report, high_water_id=new_high_water_id)
+    return report
+
+
+def build_event_report(
+    event_url_or_slug: str,
+    *,
+    db_path: str | Path = DEFAULT_DB_PATH,
+    max_age_s: float = DEFAULT_MAX_AGE_S,
+    as_of_utc: str | None = None,
+    memory_budget_mb: float | None = None,
+    cancel: CancelToken | None = None,
+    **sync_kwargs: Any,
+) -> tuple[EventMeta, EventReportData, SyncResult]:
+    """
+    resolve -> синхронизация ивента в общем сторе (или ничего, если данные свежие)
+    -> агрегаты из БД. Второй запрос того же ивента обходится дельтой.
+    memory_budget_mb — см. aggregate_event_from_db.
+    cancel — кооперативная отмена (OperationCancelled) на любом шаге.
+    """
+    ev = resolve_event(event_url_or_slug, cancel=cancel)
+    store = get_store(db_path)
+
+    with _event_lock(store.db_path, ev.event_id):
+        sync = sync_event_trades(store, ev, max_age_s=max_age_s, cancel=cancel, **sync_kwargs)
+
+    # чтение — из пула читателей, параллельно с записью других ивентов
+    with store.reader() as conn:
+        report = aggregate_event_from_db(
+            conn, ev, as_of_utc=as_of_utc or utc_now_str(), memory_budget_mb=memory_budget_mb, cancel=cancel
+        )
+
+    return ev, report, sync
+
+
+def build_event_report_file(
+    event_url_or_slug: str,
+    *,
+    cache: ReportCache,
+    fmt: str = DEFAULT_REPORT_FORMAT,
+    top_k: int | None = None,
+    db_path: str | Path = DEFAULT_DB_PATH,
+    max_age_s: float = DEFAULT_MAX_AGE_S,
+    memory_budget_mb: float | None = None,
+    cancel: CancelToken | None = None,
+    progress: ProgressReporter | None = None,
+    **sync_kwargs: Any,
+) -> tuple[EventMeta, CachedReport]:
+    """
+    Как build_event_report, но сразу файл отчёта — из кэша, если для этого
+    ивента с тем же high-water mark (MAX(trades.id)), форматом и опциями он уже
+    собирался. Иначе агрегаты -> экспорт -> файл кладётся в cache.
+    As of (UTC) в файле из кэша — время первой сборки: данные с тех пор те же.
+    При отмене (cancel) недописанный файл удаляется, в кэш ничего не попадает.
+    progress — этапы и счётчики сборки (загрузка трейдов, агрегация, экспорт).
+    """
+    report_format = get_report_format(fmt)
+    if progress:
+        progress.stage("Поиск ивента")
+    ev = resolve_event(event_url_or_slug, cancel=cancel)
+    store = get_store(db_path)
+
+    sync_progress = None
+    if progress:
+        progress.stage("Загрузка трейдов")
+
+        def sync_progress(fetched: int, inserted: int, fraction: float | None) -> None:
+            progress.trades_progress(fetched, inserted, fraction=fraction)
+
+    with _event_lock(store.db_path, ev.event_id):
+        sync_event_trades(
+            store, ev, max_age_s=max_age_s, cancel=cancel, progress_cb=sync_progress, **sync_kwargs
+        )
+
+    with store.reader() as conn:
+        # high-water mark и агрегаты — из одной транзакции чтения
+        high_water_id = max_trade_id(conn, event_id=ev.event_id)
+        key = report_cache_key(
+            event_id=ev.event_id,
+            high_water_id=high_water_id,
+            fmt=report_format.name,
+            top_k=top_k,
+            taker_only=bool(sync_kwargs.get("taker_only", False)),
+            market_filter=sync_kwargs.get("raw_filter_key") or None,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            if progress:
+                progress.done()
+            return ev, cached
+
+        aggregate_progress = None
+        if progress:
+            progress.stage("Агрегация")
+
+            def aggregate_progress(done: int, total: int) -> None:
+                progress.trades_progress(done, fraction=done / total if total else None, unit="участников")
+
+        report = aggregate_event_from_db(
+            conn,
+            ev,
+            as_of_utc=utc_now_str(),
+            memory_budget_mb=memory_budget_mb,
+            cancel=cancel,
+            progress_cb=aggregate_progress,
+        )
+
+    filename = f"event_{ev.slug}{report_format.extension}"
+    staging = cache.staging_path(key, report_format.extension)
+    if progress:
+        progress.stage(f"Экспорт {report_format.name}")
+    try:
+        report_format.export(event=ev, report=report, out_path=str(staging), top_k=top_k, cancel=cancel)
+        cached = cache.put(key, staging, filename=filename, extension=report_format.extension)
+        if progress:
+            progress.done()
+        return ev, cached
+    finally:
+        staging.unlink(missing_ok=True)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, Literal
+
+from app.ingestion.event_resolver import EventMeta
+from app.ingestion.trades_loader import Trade
+from app.services.event_aggregator import EventReportData, aggregate_event, merge_reports
+from app.services.vectorized_aggregator import aggregate_columns, columns_from_batches
+from app.storage.sqlite_connections import open_read_only
+from app.storage.sqlite_event_store import iter_trade_batches
+
+# Параллельная агрегация ивента: трейды режутся на непересекающиеся части
+# (по рынку или по кошельку), каждая часть агрегируется в своём процессе,
+# частичные EventReportData сводятся merge_reports.
+#
+# - по condition_id: ключи участников в частях не пересекаются, рынки тоже;
+# - по кошельку: участники не пересекаются, рынки сливаются через MarketTotals.merge
+#   (пригодится, когда в ивенте один огромный рынок).
+
+PartitionBy = Literal["condition_id", "wallet"]
+
+
+def _default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def _stable_hash(s: str) -> int:
+    # hash() строк рандомизирован между процессами — нужен стабильный
+    return zlib.crc32(s.encode("utf-8"))
+
+
+def partition_trades(trades: Iterable[Trade], parts: int, *, by: PartitionBy = "condition_id") -> list[list[Trade]]:
+    if parts <= 0:
+        raise ValueError("parts must be > 0")
+    out: list[list[Trade]] = [[] for _ in range(parts)]
+    if by == "condition_id":
+        for tr in trades:
+            out[_stable_hash(tr.condition_id) % parts].append(tr)
+    elif by == "wallet":
+        for tr in trades:
+            out[_stable_hash(tr.proxy_wallet) % parts].append(tr)
+    else:
+        raise ValueError(f"Invalid partition_by: {by}")
+    return out
+
+
+def aggregate_event_parallel(
+    event: EventMeta,
+    trades: Iterable[Trade],
+    as_of_utc: str,
+    *,
+    workers: int | None = None,
+    partition_by: PartitionBy = "condition_id",
+    progress_cb: Callable[[int], None] | None = None,
+) -> EventReportData:
+    """
+    aggregate_event по частям в пуле процессов. Части передаются воркерам
+    через pickle, так что выигрыш есть на больших ивентах; на одном ядре —
+    обычный aggregate_event.
+    """
+    workers = workers or _default_workers()
+    if workers <= 1:
+        return aggregate_event(event, trades, as_of_utc, progress_cb=progress_cb)
+
+    parts = [p for p in partition_trades(trades, workers, by=partition_by) if p]
+    return _run_pool(
+        workers,
+        [(aggregate_event, (event, p, as_of_utc)) for p in parts],
+        event,
+        as_of_utc,
+        progress_cb,
+    )
+
+
+def _aggregate_db_part(
+    db_path: str,
+    event: EventMeta,
+    as_of_utc: str,
+    condition_id: str | None,
+    wallet_partition: tuple[int, int] | None,
+) -> EventReportData:
+    conn = open_read_only(db_path)
+    try:
+        conn.execute("BEGIN")  # один снимок на всё чтение части
+        batches = iter_trade_batches(
+            conn,
+            event_id=event.event_id,
+            condition_id=condition_id,
+            wallet_partition=wallet_partition,
+        )
+        cols = columns_from_batches(batches, event_id=event.event_id)
+    finally:
+        conn.close()
+    return aggregate_columns(event, cols, as_of_utc)
+
+
+def aggregate_event_parallel_from_db(
+    db_path: str | Path,
+    event: EventMeta,
+    *,
+    as_of_utc: str,
+    workers: int | None = None,
+    partition_by: PartitionBy = "condition_id",
+    progress_cb: Callable[[int], None] | None = None,
+) -> EventReportData:
+    """
+    Каждый воркер сам читает свою часть из SQLite (read-only, WAL) и агрегирует
+    её векторно — в родителя возвращаются только агрегаты.
+
+    Части берутся из снимков в разных процессах: если в это время идёт запись,
+    они могут разойтись на свежие трейды — для отчёта это не страшнее, чем
+    чтение на секунду позже.
+    """
+    db_path = str(Path(db_path).resolve())
+    workers = workers or _default_workers()
+
+    if partition_by == "condition_id":
+        conn = open_read_only(db_path)
+        try:
+            # крупные рынки — первыми, чтобы хвост пула не ждал один большой
+            rows = conn.execute(
+                """
+                SELECT m.condition_id
+                FROM market_totals AS mt
+                JOIN trade_markets AS m ON m.market_key = mt.market_key
+                WHERE mt.event_id=?
+                ORDER BY mt.trades_count DESC
+                """,
+                (int(event.event_id),),
+            ).fetchall()
+        finally:
+            conn.close()
+        jobs = [
+            (_aggregate_db_part, (db_path, event, as_of_utc, r[0], None))
+            for r in rows
+        ]
+    elif partition_by == "wallet":
+        jobs = [
+            (_aggregate_db_part, (db_path, event, as_of_utc, None, (k, workers)))
+            for k in range(workers)
+        ]
+    else:
+        raise ValueError(f"Invalid partition_by: {partition_by}")
+
+    return _run_pool(workers, jobs, event, as_of_utc, progress_cb)
+
+
+def _run_pool(
+    workers: int,
+    jobs: list[tuple[Callable[..., EventReportData], tuple]],
+    event: EventMeta,
+    as_of_utc: str,
+    progress_cb: Callable[[int], None] | None,
+) -> EventReportData:
+    done = 0
+
+    # spawn: агрегация идёт и из процесса пула бота / CLI с открытым SqliteStore —
+    # fork скопировал бы его соединения и поток писателя
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(workers, len(jobs) or 1)), mp_context=multiprocessing.get_context("spawn")
+    ) as ex:
+        futures = [ex.submit(fn, *args) for fn, args in jobs]
+        for fut in as_completed(futures):
+            done += fut.result().total_trades
+            if progress_cb:
+                try:
+                    progress_cb(done)
+                except Exception:
+                    # прогресс не должен ломать агрегацию
+                    pass
+
+    # сводим в порядке задач, а не завершения — порядок рынков в отчёте стабилен
+    return merge_reports(event, [f.result() for f in futures], as_of_utc)
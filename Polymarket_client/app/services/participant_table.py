@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Mapping
+from typing import Iterator
+
+from app.services.event_aggregator import ParticipantTotals
+
+# Компактное хранилище ParticipantTotals для огромных ивентов (struct-of-arrays).
+#
+# Вместо dict[(cid, wallet, outcome)] -> объект с десятком полей:
+# - conditionId / кошелёк / исход заменены целыми id (строка хранится один раз);
+# - индекс по ключу — хэш-таблица с открытой адресацией в array('i'): в слоте
+#   номер строки, сам ключ не хранится, а собирается из колонок строки.
+#   8-16 байт на участника (2-4 слота по 4 байта) вместо записи dict с int-ключом;
+# - поля — колонки array('d') / array('q'), без объекта и boxed float на строку.
+#
+# Снаружи это Mapping с тем же интерфейсом, что и dict из aggregate_event:
+# report.participants.items() / [key] отдают ParticipantTotals, собранные на лету.
+# Это снимки строки на момент чтения: изменения в них в таблицу не попадают, а
+# последующие add_trade / add_totals не меняют уже выданные объекты.
+# iter_market_sorted — участники одного рынка в порядке листа, без списка
+# объектов на весь ивент.
+#
+# Имя / ник хранятся на кошелёк (первое непустое), а не на ключ участника.
+
+_NO_TS = 0
+
+# ключ индекса: wid << 40 | mid << 20 | oid (рынков и исходов у ивента меньше 2**20)
+_ID_BITS = 20
+
+_EMPTY = -1
+_MIN_SLOTS = 8
+_HASH_MUL = 0x9E3779B97F4A7C15  # фибоначчиево хэширование: старшие биты key * φ·2**64
+_MASK64 = (1 << 64) - 1
+
+
+def _row_key(wid: int, mid: int, oid: int) -> int:
+    if (mid | oid) >> _ID_BITS:
+        raise OverflowError("too many markets / outcomes for ParticipantTable")
+    return (wid << (2 * _ID_BITS)) | (mid << _ID_BITS) | oid
+
+
+class ParticipantTable(Mapping):
+    __slots__ = (
+        "_market_ids", "_markets",
+        "_wallet_ids", "_wallets", "_names", "_pseudonyms",
+        "_slots", "_slot_shift", "_by_market", "_by_market_len",
+        "_outcome_ids", "_outcomes",
+        "_market", "_wallet", "_outcome",
+        "_buy_shares", "_buy_usd", "_sell_shares", "_sell_usd",
+        "_trades_count", "_first_ts", "_last_ts",
+    )
+
+    def __init__(self) -> None:
+        self._market_ids: dict[str, int] = {}
+        self._markets: list[str] = []
+        self._wallet_ids: dict[str, int] = {}
+        self._wallets: list[str] = []
+        self._names: list[str] = []
+        self._pseudonyms: list[str] = []
+        self._outcome_ids: dict[str, int] = {}
+        self._outcomes: list[str] = []
+        # открытая адресация (линейное пробирование), заполнена не больше чем наполовину
+        self._slots = array("i", [_EMPTY]) * _MIN_SLOTS
+        self._slot_shift = 64 - (_MIN_SLOTS.bit_length() - 1)
+        # mid -> номера строк рынка (для iter_market_sorted), строится лениво
+        self._by_market: dict[int, array] | None = None
+        self._by_market_len = 0
+
+        self._market = array("i")
+        self._wallet = array("i")
+        self._outcome = array("i")
+        self._buy_shares = array("d")
+        self._buy_usd = array("d")
+        self._sell_shares = array("d")
+        self._sell_usd = array("d")
+        self._trades_count = array("q")
+        self._first_ts = array("q")
+        self._last_ts = array("q")
+
+    # ---------- запись ----------
+    def row(self, condition_id: str, wallet: str, outcome: str, name: str = "", pseudonym: str = "") -> int:
+        """Номер строки участника; создаётся при первом обращении."""
+        mid = self._market_ids.get(condition_id)
+        if mid is None:
+            mid = self._market_ids[condition_id] = len(self._markets)
+            self._markets.append(condition_id)
+
+        wid = self._wallet_ids.get(wallet)
+        if wid is None:
+            wid = self._wallet_ids[wallet] = len(self._wallets)
+            self._wallets.append(wallet)
+            self._names.append(name or "")
+            self._pseudonyms.append(pseudonym or "")
+        else:
+            if name and not self._names[wid]:
+                self._names[wid] = name
+            if pseudonym and not self._pseudonyms[wid]:
+                self._pseudonyms[wid] = pseudonym
+
+        oid = self._outcome_ids.get(outcome)
+        if oid is None:
+            oid = self._outcome_ids[outcome] = len(self._outcomes)
+            self._outcomes.append(outcome)
+
+        key = _row_key(wid, mid, oid)
+        slot, r = self._lookup(key)
+        if r == _EMPTY:
+            r = len(self._market)
+            self._slots[slot] = r
+            self._market.append(mid)
+            self._wallet.append(wid)
+            self._outcome.append(oid)
+            self._buy_shares.append(0.0)
+            self._buy_usd.append(0.0)
+            self._sell_shares.append(0.0)
+            self._sell_usd.append(0.0)
+            self._trades_count.append(0)
+            self._first_ts.append(_NO_TS)
+            self._last_ts.append(_NO_TS)
+            if 2 * len(self._market) > len(self._slots):
+                self._grow()
+        return r
+
+    # ---------- индекс ----------
+    def _slot_of(self, key: int) -> int:
+        return ((key * _HASH_MUL) & _MASK64) >> self._slot_shift
+
+    def _lookup(self, key: int) -> tuple[int, int]:
+        """(слот, номер строки) для key; строки нет — (свободный слот, _EMPTY)."""
+        slots = self._slots
+        mask = len(slots) - 1
+        i = self._slot_of(key)
+        while True:
+            r = slots[i]
+            if r == _EMPTY or _row_key(self._wallet[r], self._market[r], self._outcome[r]) == key:
+                return i, r
+            i = (i + 1) & mask
+
+    def _grow(self) -> None:
+        size = len(self._slots) * 2
+        self._slots = slots = array("i", [_EMPTY]) * size
+        self._slot_shift = 64 - (size.bit_length() - 1)
+        mask = size - 1
+        for r in range(len(self._market)):
+            i = self._slot_of(_row_key(self._wallet[r], self._market[r], self._outcome[r]))
+            while slots[i] != _EMPTY:
+                i = (i + 1) & mask
+            slots[i] = r
+
+    def add_trade(self, row: int, side: str, size: float, usd: float, ts: int) -> None:
+        """side — уже в верхнем регистре (BUY / SELL / прочее)."""
+        if side == "BUY":
+            self._buy_shares[row] += size
+            self._buy_usd[row] += usd
+        elif side == "SELL":
+            self._sell_shares[row] += size
+            self._sell_usd[row] += usd
+
+        self._trades_count[row] += 1
+        if ts:
+            first = self._first_ts[row]
+            if first == _NO_TS or ts < first:
+                self._first_ts[row] = ts
+            if ts > self._last_ts[row]:
+                self._last_ts[row] = ts
+
+    def add_totals(self, pt: ParticipantTotals) -> None:
+        """Вливает готовый ParticipantTotals (снапшот, частичный отчёт)."""
+        r = self.row(pt.condition_id, pt.trader_address, pt.outcome, pt.trader_name, pt.trader_pseudonym)
+        self.add_values(
+            r, pt.buy_shares, pt.buy_usd, pt.sell_shares, pt.sell_usd, pt.trades_count, pt.first_ts, pt.last_ts
+        )
+
+    def add_values(
+        self,
+        row: int,
+        buy_shares: float,
+        buy_usd: float,
+        sell_shares: float,
+        sell_usd: float,
+        trades_count: int,
+        first_ts: int | None,
+        last_ts: int | None,
+    ) -> None:
+        """Вливает готовые суммы участника (строка participant_totals) без объекта ParticipantTotals."""
+        self._buy_shares[row] += buy_shares
+        self._buy_usd[row] += buy_usd
+        self._sell_shares[row] += sell_shares
+        self._sell_usd[row] += sell_usd
+        self._trades_count[row] += trades_count
+        if first_ts is not None and (self._first_ts[row] == _NO_TS or first_ts < self._first_ts[row]):
+            self._first_ts[row] = first_ts
+        if last_ts is not None and last_ts > self._last_ts[row]:
+            self._last_ts[row] = last_ts
+
+    # ---------- чтение ----------
+    def _key(self, r: int) -> tuple[str, str, str]:
+        return self._markets[self._market[r]], self._wallets[self._wallet[r]], self._outcomes[self._outcome[r]]
+
+    def _totals(self, r: int) -> ParticipantTotals:
+        wid = self._wallet[r]
+        first, last = self._first_ts[r], self._last_ts[r]
+        return ParticipantTotals(
+            condition_id=self._markets[self._market[r]],
+            trader_address=self._wallets[wid],
+            outcome=self._outcomes[self._outcome[r]],
+            trader_name=self._names[wid],
+            trader_pseudonym=self._pseudonyms[wid],
+            buy_shares=self._buy_shares[r],
+            buy_usd=self._buy_usd[r],
+            sell_shares=self._sell_shares[r],
+            sell_usd=self._sell_usd[r],
+            trades_count=self._trades_count[r],
+            first_ts=(None if first == _NO_TS else first),
+            last_ts=(None if last == _NO_TS else last),
+        )
+
+    def _find(self, key: tuple[str, str, str]) -> int | None:
+        cid, wallet, outcome = key
+        mid = self._market_ids.get(cid)
+        wid = self._wallet_ids.get(wallet)
+        oid = self._outcome_ids.get(outcome)
+        if mid is None or wid is None or oid is None:
+            return None
+        _slot, r = self._lookup(_row_key(wid, mid, oid))
+        return None if r == _EMPTY else r
+
+    def __getitem__(self, key: tuple[str, str, str]) -> ParticipantTotals:
+        """Снимок строки участника (копия, см. выше)."""
+        r = self._find(key)
+        if r is None:
+            raise KeyError(key)
+        return self._totals(r)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, tuple) and len(key) == 3 and self._find(key) is not None
+
+    def __iter__(self) -> Iterator[tuple[str, str, str]]:
+        for r in range(len(self._market)):
+            yield self._key(r)
+
+    def __len__(self) -> int:
+        return len(self._market)
+
+    def items(self) -> Iterator[tuple[tuple[str, str, str], ParticipantTotals]]:  # type: ignore[override]
+        for r in range(len(self._market)):
+            pt = self._totals(r)
+            yield (pt.condition_id, pt.trader_address, pt.outcome), pt
+
+    def values(self) -> Iterator[ParticipantTotals]:  # type: ignore[override]
+        for r in range(len(self._market)):
+            yield self._totals(r)
+
+    def iter_market_sorted(self, condition_id: str) -> Iterator[ParticipantTotals]:
+        """Участники рынка в порядке листа Excel: net_spent_usd, затем оборот — по убыванию."""
+        mid = self._market_ids.get(condition_id)
+        if mid is None:
+            return
+        if self._by_market is None or self._by_market_len != len(self._market):
+            by_market: dict[int, array] = {}
+            for r, m in enumerate(self._market):
+                rows = by_market.get(m)
+                if rows is None:
+                    rows = by_market[m] = array("i")
+                rows.append(r)
+            self._by_market, self._by_market_len = by_market, len(self._market)
+
+        buy_usd, sell_usd = self._buy_usd, self._sell_usd
+        # сортировка устойчивая: при равных ключах — порядок появления, как у dict
+        rows = sorted(
+            self._by_market.get(mid, ()),
+            key=lambda r: (buy_usd[r] - sell_usd[r], buy_usd[r] + sell_usd[r]),
+            reverse=True,
+        )
+        for r in rows:
+            yield self._totals(r)
+
+    @property
+    def wallet_count(self) -> int:
+        return len(self._wallets)
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import hashlib
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import weakref
+import zlib
+from collections.abc import Mapping
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from app.ingestion.event_resolver import EventMeta
+from app.ingestion.trades_loader import Trade
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals, aggregate_event
+from app.utils.cancellation import CancelToken
+
+# Агрегация ивента с ограничением памяти.
+#
+# Трейды идут кусками через обычный aggregate_event, частичные участники
+# сливаются в общий dict. Как только он перерастает бюджет, участники
+# сбрасываются на диск в партиции по хэшу кошелька (pickle-пачки в файлах)
+# и dict очищается. В конце каждая партиция (~1/N всех участников) сводится
+# отдельно и дописывается в SpilledParticipants — временную SQLite-таблицу,
+# которая снаружи выглядит как dict участников.
+#
+# unique_traders рынков и ивента после сброса считаются точно, но без set-ов:
+# партиции по кошелькам не пересекаются, так что число кошельков — сумма по
+# партициям. У MarketTotals вместо set-а тогда TraderCount (только len()).
+#
+# Число партиций на старте фиксировано, а участников заранее не знаем: если
+# партиция всё равно больше бюджета, перед сведением она сама режется на
+# ceil(строк / лимит) * 2 под-партиций (другим хэшем кошелька) — рекурсивно,
+# до MAX_SPLIT_DEPTH уровней (дальше резать нечего: один кошелёк).
+
+# оценка памяти на участника в dict-е (объект, ключ, запись dict, float-ы)
+PARTICIPANT_BYTES = 512
+
+DEFAULT_PARTITIONS = 32
+
+MAX_SPLIT_DEPTH = 4
+
+
+def participant_limit(memory_budget_mb: float) -> int:
+    """Сколько участников держим в памяти при данном бюджете."""
+    return max(1000, int(memory_budget_mb * 1024 * 1024 / PARTICIPANT_BYTES))
+
+_PARTICIPANT_FIELDS = (
+    "condition_id", "trader_address", "outcome", "trader_name", "trader_pseudonym",
+    "buy_shares", "buy_usd", "sell_shares", "sell_usd", "trades_count", "first_ts", "last_ts",
+)
+
+
+class TraderCount:
+    """unique_traders рынка, от которого остался только размер (после сброса на диск)."""
+
+    __slots__ = ("_n",)
+
+    def __init__(self, n: int) -> None:
+        self._n = int(n)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def copy(self) -> "TraderCount":
+        return TraderCount(self._n)
+
+    def __ior__(self, other):
+        raise TypeError("unique trader counts of spilled reports cannot be merged")
+
+    def __repr__(self) -> str:
+        return f"TraderCount({self._n})"
+
+
+def _to_row(pt: ParticipantTotals) -> tuple:
+    return tuple(getattr(pt, f) for f in _PARTICIPANT_FIELDS)
+
+
+def _from_row(row: tuple) -> ParticipantTotals:
+    return ParticipantTotals(**dict(zip(_PARTICIPANT_FIELDS, row)))
+
+
+class SpilledParticipants(Mapping):
+    """
+    Участники отчёта во временном SQLite-файле. Mapping (cid, wallet, outcome) ->
+    ParticipantTotals; значения собираются при чтении, items()/values() идут
+    курсором, не поднимая всё в память. Файл удаляется close() или вместе с объектом.
+    """
+
+    def __init__(self, directory: str | Path) -> None:
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self._dir / "participants.sqlite"), check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE p (
+              condition_id TEXT NOT NULL, wallet TEXT NOT NULL, outcome TEXT NOT NULL,
+              name TEXT, pseudonym TEXT,
+              buy_shares REAL, buy_usd REAL, sell_shares REAL, sell_usd REAL,
+              trades_count INTEGER, first_ts INTEGER, last_ts INTEGER
+            );
+            """
+        )
+        self._len = 0
+        self._finalizer = weakref.finalize(self, _drop_dir, self._conn, self._dir)
+
+    def add_rows(self, rows: Iterable[tuple]) -> None:
+        cur = self._conn.executemany("INSERT INTO p VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+        self._len += cur.rowcount
+        self._conn.commit()
+
+    def seal(self) -> None:
+        """Индекс для поиска по ключу — один раз, после всех вставок."""
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS p_key ON p(condition_id, wallet, outcome)")
+        self._conn.commit()
+
+    def __getitem__(self, key: tuple[str, str, str]) -> ParticipantTotals:
+        row = self._conn.execute(
+            "SELECT * FROM p WHERE condition_id=? AND wallet=? AND outcome=?", tuple(key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _from_row(row)
+
+    def __iter__(self) -> Iterator[tuple[str, str, str]]:
+        yield from self._conn.execute("SELECT condition_id, wallet, outcome FROM p ORDER BY rowid")
+
+    def __len__(self) -> int:
+        return self._len
+
+    def items(self) -> Iterator[tuple[tuple[str, str, str], ParticipantTotals]]:  # type: ignore[override]
+        for row in self._conn.execute("SELECT * FROM p ORDER BY rowid"):
+            yield (row[0], row[1], row[2]), _from_row(row)
+
+    def values(self) -> Iterator[ParticipantTotals]:  # type: ignore[override]
+        for row in self._conn.execute("SELECT * FROM p ORDER BY rowid"):
+            yield _from_row(row)
+
+    def iter_market_sorted(self, condition_id: str) -> Iterator[ParticipantTotals]:
+        """Участники рынка в порядке листа Excel: net_spent_usd, затем оборот — по убыванию."""
+        for row in self._conn.execute(
+            """
+            SELECT * FROM p WHERE condition_id=?
+            ORDER BY buy_usd - sell_usd DESC, buy_usd + sell_usd DESC, rowid
+            """,
+            (condition_id,),
+        ):
+            yield _from_row(row)
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+def _drop_dir(conn: sqlite3.Connection, directory: Path) -> None:
+    try:
+        conn.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _partition_of(wallet: str, partitions: int, level: int) -> int:
+    data = wallet.encode("utf-8")
+    if level == 0:
+        return zlib.crc32(data) % partitions
+    # crc32 аффинный: соль не перемешала бы кошельки одной партиции — нужен другой хэш
+    digest = hashlib.blake2b(data, digest_size=8, person=b"spill%03d" % level).digest()
+    return int.from_bytes(digest, "little") % partitions
+
+
+class _Spill:
+    """Партиции участников на диске: partition = hash(wallet) % n (хэш зависит от level)."""
+
+    def __init__(self, directory: Path, partitions: int, level: int = 0) -> None:
+        self.dir = directory
+        self.partitions = partitions
+        self.level = level
+        self.counts = [0] * partitions  # строк в партиции (с повторами ключей — оценка сверху)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, k: int) -> Path:
+        return self.dir / f"part_{k:04d}.pkl"
+
+    def write(self, participants: Iterable[ParticipantTotals]) -> None:
+        buckets: list[list[tuple]] = [[] for _ in range(self.partitions)]
+        for pt in participants:
+            buckets[_partition_of(pt.trader_address, self.partitions, self.level)].append(_to_row(pt))
+        for k, rows in enumerate(buckets):
+            if rows:
+                with self._path(k).open("ab") as f:
+                    pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self.counts[k] += len(rows)
+
+    def split(self, k: int, limit: int) -> "_Spill":
+        """Режет партицию k на под-партиции не больше ~limit строк (файл k удаляется)."""
+        n = max(2, -(-self.counts[k] // limit) * 2)
+        sub = _Spill(self.dir / f"sub_{k:04d}", n, self.level + 1)
+        batch: list[ParticipantTotals] = []
+        for pt in self.read(k):
+            batch.append(pt)
+            if len(batch) >= limit:
+                sub.write(batch)
+                batch = []
+        sub.write(batch)
+        return sub
+
+    def read(self, k: int) -> Iterator[ParticipantTotals]:
+        path = self._path(k)
+        if not path.exists():
+            return
+        with path.open("rb") as f:
+            while True:
+                try:
+                    rows = pickle.load(f)
+                except EOFError:
+                    break
+                for row in rows:
+                    yield _from_row(row)
+        path.unlink()
+
+
+def aggregate_event_spilling(
+    event: EventMeta,
+    trades: Iterable[Trade],
+    as_of_utc: str,
+    *,
+    memory_budget_mb: float,
+    spill_dir: str | Path | None = None,
+    partitions: int = DEFAULT_PARTITIONS,
+    progress_cb: Callable[[int], None] | None = None,
+    cancel: CancelToken | None = None,
+) -> EventReportData:
+    """
+    aggregate_event, у которого состояние участников не выходит за
+    memory_budget_mb (по оценке PARTICIPANT_BYTES на участника). Пока бюджет
+    не превышен — обычный отчёт с dict-ом; иначе participants —
+    SpilledParticipants во временной папке (spill_dir или системный tmp).
+
+    Суммы считаются по кускам, поэтому float-ы могут отличаться от
+    aggregate_event в последних знаках.
+    """
+    limit = participant_limit(memory_budget_mb)
+    chunk_size = max(1000, limit // 4)
+
+    markets: dict[str, MarketTotals] = {}
+    participants: dict[tuple[str, str, str], ParticipantTotals] = {}
+    total_trades = 0
+    total_turnover = 0.0
+    spill: _Spill | None = None
+    work_dir: Path | None = None
+
+    try:
+        it = iter(trades)
+        while True:
+            batch = list(islice(it, chunk_size))
+            if not batch:
+                break
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            # кусок сразу вливается в общий dict — таблица тут только лишняя копия
+            part = aggregate_event(event, batch, as_of_utc, compact=False, cancel=cancel)
+            del batch
+
+            total_trades += part.total_trades
+            total_turnover += part.total_turnover_usd
+            for cid, mt in part.markets.items():
+                cur = markets.get(cid)
+                if cur is None:
+                    markets[cid] = mt
+                else:
+                    cur.merge(mt)
+            for key, pt in part.participants.items():
+                cur = participants.get(key)
+                if cur is None:
+                    participants[key] = pt
+                else:
+                    cur.merge(pt)
+
+            if len(participants) > limit:
+                if spill is None:
+                    work_dir = Path(tempfile.mkdtemp(prefix="pm_agg_", dir=spill_dir))
+                    spill = _Spill(work_dir / "spill", partitions)
+                spill.write(participants.values())
+                participants.clear()
+
+            if spill is not None:
+                # set-ы трейдеров рынков тоже растут без границ — после сброса считаем по партициям
+                for mt in markets.values():
+                    mt.unique_traders.clear()
+
+            if progress_cb:
+                try:
+                    progress_cb(total_trades)
+                except Exception:
+                    # прогресс не должен ломать агрегацию
+                    pass
+
+        if spill is None:
+            return EventReportData(
+                event_id=event.event_id,
+                event_slug=event.slug,
+                event_title=event.title,
+                as_of_utc=as_of_utc,
+                total_trades=total_trades,
+                unique_traders=len({wallet for (_cid, wallet, _outcome) in participants}),
+                total_turnover_usd=total_turnover,
+                markets=markets,
+                participants=participants,
+            )
+
+        spill.write(participants.values())
+        participants.clear()
+
+        out = SpilledParticipants(work_dir)
+        traders_by_market: dict[str, int] = dict.fromkeys(markets, 0)
+        total_wallets = 0
+        todo = [(spill, k) for k in reversed(range(spill.partitions))]
+        while todo:
+            part_spill, k = todo.pop()
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if part_spill.counts[k] > limit and part_spill.level < MAX_SPLIT_DEPTH:
+                # партиция не влезает в бюджет — сводим её по кускам
+                sub = part_spill.split(k, limit)
+                todo.extend((sub, j) for j in reversed(range(sub.partitions)))
+                continue
+            merged: dict[tuple[str, str, str], ParticipantTotals] = {}
+            for pt in part_spill.read(k):
+                key = (pt.condition_id, pt.trader_address, pt.outcome)
+                cur = merged.get(key)
+                if cur is None:
+                    merged[key] = pt
+                else:
+                    cur.merge(pt)
+
+            total_wallets += len({wallet for (_cid, wallet, _outcome) in merged})
+            for cid, _wallet in {(cid, wallet) for (cid, wallet, _outcome) in merged}:
+                traders_by_market[cid] += 1
+            out.add_rows(_to_row(pt) for pt in merged.values())
+        out.seal()
+        shutil.rmtree(spill.dir, ignore_errors=True)
+    except BaseException:
+        # отмена / ошибка на середине — временная папка не переживает вызов
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    for cid, mt in markets.items():
+        mt.unique_traders = TraderCount(traders_by_market[cid])
+
+    return EventReportData(
+        event_id=event.event_id,
+        event_slug=event.slug,
+        event_title=event.title,
+        as_of_utc=as_of_utc,
+        total_trades=total_trades,
+        unique_traders=total_wallets,
+        total_turnover_usd=total_turnover,
+        markets=markets,
+        participants=out,
+    )
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from app.services.event_aggregator import ParticipantTotals
+
+# Топ-K участников каждого рынка за один проход, без полной сортировки.
+#
+# На рынок — min-heap из K лучших по ключу сортировки; кто вытеснен или не
+# попал — вливается в одну строку «остальные» (суммы, число сделок, первый /
+# последний ts). Память и сортировка — O(K) на рынок, независимо от числа
+# трейдеров; вход может быть любым итератором (в т.ч. SpilledParticipants).
+
+SortKey = Callable[[ParticipantTotals], tuple]
+
+
+def default_sort_key(p: ParticipantTotals) -> tuple:
+    """Порядок листа рынка в Excel: больше всего потратили, затем оборот."""
+    return (p.net_spent_usd, p.buy_usd + p.sell_usd)
+
+
+@dataclass(slots=True)
+class MarketTop:
+    condition_id: str
+    top: list[ParticipantTotals] = field(default_factory=list)  # по убыванию ключа
+    others: ParticipantTotals | None = None
+    others_count: int = 0
+
+
+class TopKPerMarket:
+    """
+    Потоковый отбор: add() по одному участнику, result() — MarketTop по рынкам.
+    При равных ключах выигрывает тот, кто пришёл раньше — как у стабильной
+    sort(reverse=True) по тем же данным.
+    """
+
+    def __init__(self, k: int, *, sort_key: SortKey = default_sort_key) -> None:
+        if k <= 0:
+            raise ValueError("k must be positive")
+        self.k = k
+        self.sort_key = sort_key
+        # cid -> heap[(key, -seq, participant)]; корень — худший из оставленных
+        self._heaps: dict[str, list[tuple[tuple, int, ParticipantTotals]]] = {}
+        self._others: dict[str, MarketTop] = {}
+        self._seq = 0
+
+    def add(self, p: ParticipantTotals) -> None:
+        self._seq += 1
+        entry = (self.sort_key(p), -self._seq, p)
+        heap = self._heaps.setdefault(p.condition_id, [])
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+            return
+        if entry[:2] > heap[0][:2]:
+            entry = heapq.heapreplace(heap, entry)
+        self._roll_up(entry[2])
+
+    def update(self, participants: Iterable[ParticipantTotals]) -> "TopKPerMarket":
+        for p in participants:
+            self.add(p)
+        return self
+
+    def _roll_up(self, p: ParticipantTotals) -> None:
+        mt = self._others.get(p.condition_id)
+        if mt is None:
+            mt = self._others[p.condition_id] = MarketTop(
+                condition_id=p.condition_id,
+                others=ParticipantTotals(condition_id=p.condition_id, trader_address="", outcome=""),
+            )
+        mt.others.merge(p)
+        mt.others_count += 1
+
+    def result(self) -> dict[str, MarketTop]:
+        out: dict[str, MarketTop] = {}
+        for cid, heap in self._heaps.items():
+            mt = self._others.get(cid) or MarketTop(condition_id=cid)
+            mt.top = [p for _key, _seq, p in sorted(heap, key=lambda e: e[:2], reverse=True)]
+            if mt.others is not None:
+                # merge() подхватил имя первого влитого участника — подписываем строку сами
+                mt.others.trader_name = f"others ({mt.others_count})"
+                mt.others.trader_pseudonym = ""
+            out[cid] = mt
+        return out
+
+
+def top_participants_per_market(
+    participants: Iterable[ParticipantTotals],
+    k: int,
+    *,
+    sort_key: SortKey = default_sort_key,
+) -> dict[str, MarketTop]:
+    return TopKPerMarket(k, sort_key=sort_key).update(participants).result()
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from typing import Callable, Iterable
+
+import numpy as np
+
+from app.ingestion.event_resolver import EventMeta
+from app.ingestion.trades_loader import Trade
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals
+from app.storage.columnar_cache import COLUMNS, SIDE_BUY, SIDE_OTHER, SIDE_SELL, EventColumns, refresh_event_cache
+from app.storage.sqlite_event_store import TradeBatch
+
+# Векторный вариант aggregate_event: тот же EventReportData, но считается
+# по колонкам (EventColumns) через bincount / ufunc.at, без Python-цикла по трейдам.
+#
+# Ключ участника (market, wallet, outcome) факторизуется в один int64-код,
+# дальше все суммы — bincount с weights (суммирует в порядке трейдов, так что
+# float-результат совпадает с последовательным циклом), min/max времени —
+# np.minimum.at / np.maximum.at. Python-объекты создаются только на выходе —
+# по одному на рынок и участника. Порядок рынков и участников в dict-ах —
+# по первому появлению, как в aggregate_event.
+#
+# Выигрыш — когда колонки уже есть (columnar_cache, iter_trade_batches):
+# из потока Trade раскладка в колонки сама стоит столько же, сколько цикл.
+
+_TS_NONE_MIN = np.iinfo(np.int64).max
+_TS_NONE_MAX = np.iinfo(np.int64).min
+
+
+_SIDE_CODES = {"BUY": SIDE_BUY, "SELL": SIDE_SELL}
+
+
+def columns_from_trades(trades: Iterable[Trade], *, event_id: int = 0) -> EventColumns:
+    """
+    Раскладывает поток Trade в EventColumns (в памяти, без кэша на диске).
+    Имя/ник кошелька — первое непустое значение по этому кошельку.
+    """
+    markets: list[tuple[str, str, str]] = []
+    outcomes: list[str] = []
+    wallets: list[list[str]] = []
+    market_codes: dict[str, int] = {}
+    outcome_codes: dict[str, int] = {}
+    wallet_codes: dict[str, int] = {}
+
+    mc: list[int] = []
+    wc: list[int] = []
+    oc: list[int] = []
+    side: list[int] = []
+    size: list[float] = []
+    price: list[float] = []
+    ts: list[int] = []
+
+    for tr in trades:
+        cid = tr.condition_id
+        code = market_codes.get(cid)
+        if code is None:
+            code = market_codes[cid] = len(markets)
+            markets.append((cid, tr.market_slug or "", tr.market_title or ""))
+        mc.append(code)
+
+        wallet = tr.proxy_wallet
+        code = wallet_codes.get(wallet)
+        if code is None:
+            code = wallet_codes[wallet] = len(wallets)
+            wallets.append([wallet, tr.name or "", tr.pseudonym or ""])
+        else:
+            w = wallets[code]
+            if not w[1] and tr.name:
+                w[1] = tr.name
+            if not w[2] and tr.pseudonym:
+                w[2] = tr.pseudonym
+        wc.append(code)
+
+        outcome = tr.outcome or ""
+        code = outcome_codes.get(outcome)
+        if code is None:
+            code = outcome_codes[outcome] = len(outcomes)
+            outcomes.append(outcome)
+        oc.append(code)
+
+        side.append(_SIDE_CODES.get((tr.side or "").upper(), SIDE_OTHER))
+        size.append(tr.size)
+        price.append(tr.price)
+        ts.append(tr.timestamp or 0)
+
+    return _build_columns(event_id, mc, wc, oc, side, size, price, ts, markets, outcomes, wallets)
+
+
+def columns_from_batches(batches: Iterable[TradeBatch], *, event_id: int = 0) -> EventColumns:
+    """
+    EventColumns из пачек iter_trade_batches (SQLite): строки уже кортежи,
+    коды считаются по целым колонкам, без объекта на трейд.
+    """
+    markets: list[tuple[str, str, str]] = []
+    wallets: list[tuple[str, str, str]] = []
+    market_codes: dict[str, int] = {}
+    outcome_codes: dict[str, int] = {}
+    wallet_codes: dict[str, int] = {}
+
+    ids: list[int] = []
+    mc: list[int] = []
+    wc: list[int] = []
+    oc: list[int] = []
+    side: list[int] = []
+    size: list[float] = []
+    price: list[float] = []
+    ts: list[int] = []
+
+    for b in batches:
+        (b_id, b_cid, b_slug, b_title, b_wallet, b_name, b_pseudo,
+         b_side, b_outcome, _b_outcome_index, b_size, b_price, b_ts, _b_tx) = b.columns
+
+        for i, cid in enumerate(b_cid):
+            if cid not in market_codes:
+                market_codes[cid] = len(markets)
+                markets.append((cid, b_slug[i], b_title[i]))
+        for i, wallet in enumerate(b_wallet):
+            if wallet not in wallet_codes:
+                # профиль в сторе один на кошелёк — берём первую строку
+                wallet_codes[wallet] = len(wallets)
+                wallets.append((wallet, b_name[i], b_pseudo[i]))
+
+        ids.extend(b_id)
+        mc.extend(map(market_codes.__getitem__, b_cid))
+        wc.extend(map(wallet_codes.__getitem__, b_wallet))
+        oc.extend(outcome_codes.setdefault(o, len(outcome_codes)) for o in b_outcome)
+        side.extend(_SIDE_CODES.get(s.upper(), SIDE_OTHER) for s in b_side)
+        size.extend(b_size)
+        price.extend(b_price)
+        ts.extend(b_ts)
+
+    cols = _build_columns(event_id, mc, wc, oc, side, size, price, ts, markets, list(outcome_codes), wallets)
+    cols.trade_id = np.asarray(ids, dtype=COLUMNS["trade_id"])
+    cols.high_water_id = ids[-1] if ids else 0
+    return cols
+
+
+def _build_columns(
+    event_id: int,
+    mc: list[int],
+    wc: list[int],
+    oc: list[int],
+    side: list[int],
+    size: list[float],
+    price: list[float],
+    ts: list[int],
+    markets: list[tuple[str, str, str]],
+    outcomes: list[str],
+    wallets: list,
+) -> EventColumns:
+    n = len(mc)
+    return EventColumns(
+        event_id=int(event_id),
+        high_water_id=n,
+        trade_id=np.arange(1, n + 1, dtype=COLUMNS["trade_id"]),
+        market_code=np.asarray(mc, dtype=COLUMNS["market_code"]),
+        wallet_code=np.asarray(wc, dtype=COLUMNS["wallet_code"]),
+        outcome_code=np.asarray(oc, dtype=COLUMNS["outcome_code"]),
+        side=np.asarray(side, dtype=COLUMNS["side"]),
+        size=np.asarray(size, dtype=COLUMNS["size"]),
+        price=np.asarray(price, dtype=COLUMNS["price"]),
+        timestamp=np.asarray(ts, dtype=COLUMNS["timestamp"]),
+        markets=markets,
+        outcomes=outcomes,
+        wallets=[tuple(w) for w in wallets],
+    )
+
+
+# плотная факторизация (массив на всё пространство ключей) — пока оно не больше этого
+_DENSE_KEY_SPACE = 1 << 24
+
+
+def _factorize(keys: np.ndarray, key_space: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    keys (int64 в [0, key_space)) -> (first_idx, codes): группы пронумерованы
+    в порядке первого появления, first_idx[g] — индекс первой строки группы g,
+    codes[i] — группа строки i.
+    """
+    n = int(keys.size)
+    if key_space <= max(_DENSE_KEY_SPACE, 4 * n):
+        # коды и так маленькие: первое появление через minimum.at, без сортировки N строк
+        first = np.full(key_space, n, dtype=np.int64)
+        np.minimum.at(first, keys, np.arange(n, dtype=np.int64))
+        present = np.flatnonzero(first < n)
+        order = np.argsort(first[present], kind="stable")
+        rank = np.empty(key_space, dtype=np.int64)
+        rank[present[order]] = np.arange(order.size, dtype=np.int64)
+        return first[present[order]], rank[keys]
+
+    uniq_first, inverse = np.unique(keys, return_index=True, return_inverse=True)[1:]
+    order = np.argsort(uniq_first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return uniq_first[order], rank[inverse.reshape(-1)]
+
+
+def aggregate_columns(event: EventMeta, cols: EventColumns, as_of_utc: str) -> EventReportData:
+    market_by_cid = {m.condition_id: m for m in event.markets}
+
+    # трейды без рынка или кошелька aggregate_event пропускает
+    bad_market = np.fromiter((not m[0] for m in cols.markets), dtype=bool, count=len(cols.markets))
+    bad_wallet = np.fromiter((not w[0] for w in cols.wallets), dtype=bool, count=len(cols.wallets))
+
+    market_code = np.asarray(cols.market_code)
+    wallet_code = np.asarray(cols.wallet_code)
+    valid = ~(bad_market[market_code] | bad_wallet[wallet_code])
+
+    market_code = market_code[valid].astype(np.int64)
+    wallet_code = wallet_code[valid].astype(np.int64)
+    outcome_code = np.asarray(cols.outcome_code)[valid].astype(np.int64)
+    side = np.asarray(cols.side)[valid]
+    size = np.asarray(cols.size)[valid]
+    usd = size * np.asarray(cols.price)[valid]
+    ts = np.asarray(cols.timestamp)[valid]
+
+    n = int(market_code.size)
+    is_buy = side == SIDE_BUY
+    is_sell = side == SIDE_SELL
+    buy_usd = np.where(is_buy, usd, 0.0)
+    sell_usd = np.where(is_sell, usd, 0.0)
+
+    # ---------- рынки ----------
+    m_first, m_codes = _factorize(market_code, max(len(cols.markets), 1))
+    nm = int(m_first.size)
+    m_trades = np.bincount(m_codes, minlength=nm)
+    m_turnover = np.bincount(m_codes, weights=usd, minlength=nm)
+    m_buy = np.bincount(m_codes, weights=buy_usd, minlength=nm)
+    m_sell = np.bincount(m_codes, weights=sell_usd, minlength=nm)
+
+    # ---------- участники ----------
+    n_wallets = max(len(cols.wallets), 1)
+    n_outcomes = max(len(cols.outcomes), 1)
+    p_keys = (market_code * n_wallets + wallet_code) * n_outcomes + outcome_code
+    p_first, p_codes = _factorize(p_keys, max(len(cols.markets), 1) * n_wallets * n_outcomes)
+    npart = int(p_first.size)
+
+    p_trades = np.bincount(p_codes, minlength=npart)
+    p_buy_shares = np.bincount(p_codes, weights=np.where(is_buy, size, 0.0), minlength=npart)
+    p_sell_shares = np.bincount(p_codes, weights=np.where(is_sell, size, 0.0), minlength=npart)
+    p_buy_usd = np.bincount(p_codes, weights=buy_usd, minlength=npart)
+    p_sell_usd = np.bincount(p_codes, weights=sell_usd, minlength=npart)
+
+    # timestamp == 0 в first/last не участвует
+    has_ts = ts != 0
+    p_first_ts = np.full(npart, _TS_NONE_MIN, dtype=np.int64)
+    p_last_ts = np.full(npart, _TS_NONE_MAX, dtype=np.int64)
+    np.minimum.at(p_first_ts, p_codes[has_ts], ts[has_ts])
+    np.maximum.at(p_last_ts, p_codes[has_ts], ts[has_ts])
+
+    # у участника рынок и кошелёк фиксированы — unique_traders рынков собираем по ним
+    traders_by_market: list[set[str]] = [set() for _ in range(nm)]
+
+    participants: dict[tuple[str, str, str], ParticipantTotals] = {}
+    cols_first = zip(
+        market_code[p_first].tolist(),
+        m_codes[p_first].tolist(),
+        wallet_code[p_first].tolist(),
+        outcome_code[p_first].tolist(),
+        p_trades.tolist(),
+        p_buy_shares.tolist(),
+        p_buy_usd.tolist(),
+        p_sell_shares.tolist(),
+        p_sell_usd.tolist(),
+        p_first_ts.tolist(),
+        p_last_ts.tolist(),
+    )
+    for mc, mg, wc, oc, cnt, bs, bu, ss, su, fts, lts in cols_first:
+        cid = cols.markets[mc][0]
+        wallet, name, pseudo = cols.wallets[wc]
+        outcome = cols.outcomes[oc]
+        traders_by_market[mg].add(wallet)
+        participants[(cid, wallet, outcome)] = ParticipantTotals(
+            condition_id=cid,
+            trader_address=wallet,
+            outcome=outcome,
+            trader_name=name,
+            trader_pseudonym=pseudo,
+            buy_shares=bs,
+            buy_usd=bu,
+            sell_shares=ss,
+            sell_usd=su,
+            trades_count=cnt,
+            first_ts=(None if fts == _TS_NONE_MIN else fts),
+            last_ts=(None if lts == _TS_NONE_MAX else lts),
+        )
+
+    markets: dict[str, MarketTotals] = {}
+    for g, row in enumerate(m_first.tolist()):
+        cid, slug, title = cols.markets[int(market_code[row])]
+        mm = market_by_cid.get(cid)
+        markets[cid] = MarketTotals(
+            condition_id=cid,
+            market_slug=(mm.slug if mm else slug),
+            question=(mm.question if mm else title),
+            trades_count=int(m_trades[g]),
+            buy_usd=float(m_buy[g]),
+            sell_usd=float(m_sell[g]),
+            turnover_usd=float(m_turnover[g]),
+            unique_traders=traders_by_market[g],
+        )
+
+    # общий оборот — тоже bincount (один бакет), чтобы порядок сложения был как в цикле
+    total_turnover = float(np.bincount(np.zeros(n, dtype=np.int64), weights=usd, minlength=1)[0])
+
+    return EventReportData(
+        event_id=event.event_id,
+        event_slug=event.slug,
+        event_title=event.title,
+        as_of_utc=as_of_utc,
+        total_trades=n,
+        unique_traders=int(np.count_nonzero(np.bincount(wallet_code, minlength=n_wallets))),
+        total_turnover_usd=total_turnover,
+        markets=markets,
+        participants=participants,
+    )
+
+
+def aggregate_event_from_cache(
+    conn: sqlite3.Connection,
+    event: EventMeta,
+    *,
+    cache_root: str | Path,
+    as_of_utc: str,
+    progress_cb: Callable[[int], None] | None = None,
+) -> EventReportData:
+    """
+    Догоняет колоночный кэш ивента (читается только дельта из SQLite) и
+    агрегирует его векторно.
+    """
+    cols = refresh_event_cache(conn, cache_root, event.event_id)
+    report = aggregate_columns(event, cols, as_of_utc)
+
+    if progress_cb:
+        try:
+            progress_cb(report.total_trades)
+        except Exception:
+            # прогресс не должен ломать агрегацию
+            pass
+
+    return report
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from app.storage.sqlite_event_store import has_trade_id
+from app.utils.file_lock import file_lock
+
+# Колоночный кэш трейдов ивента рядом со стором:
+#
+#   <cache_root>/event_<id>/meta.json     версия, high_water_id, rows, длины словарей
+#   <cache_root>/event_<id>/<column>.bin  колонки фиксированной ширины (сырые байты)
+#   <cache_root>/event_<id>/<dict>.jsonl  markets / outcomes / wallets, строка = code
+#
+# Все файлы только дописываются: refresh читает из SQLite трейды с
+# id > high_water_id, дописывает их хвостом и атомарно подменяет meta.json.
+# Читатель берёт из файлов ровно rows строк (и len словарей) своей meta —
+# дописанный хвост, в том числе недописанный после падения, он не видит, а
+# открытые memmap-ы не ломаются. Недописанный хвост refresh обрезает сам.
+#
+# Если трейды ивента удалили (смена режима takerOnly), кэш собирается
+# заново в новых файлах (старые unlink-аются — чужие memmap-ы их переживут).
+
+CACHE_VERSION = 2
+
+SIDE_BUY = 1
+SIDE_SELL = -1
+SIDE_OTHER = 0
+
+COLUMNS: dict[str, np.dtype] = {
+    "trade_id": np.dtype(np.int64),       # id строки в trades (high-water mark)
+    "market_code": np.dtype(np.int32),    # индекс в dicts["markets"]
+    "wallet_code": np.dtype(np.int32),    # индекс в dicts["wallets"]
+    "outcome_code": np.dtype(np.int16),   # индекс в dicts["outcomes"]
+    "side": np.dtype(np.int8),            # SIDE_BUY / SIDE_SELL / SIDE_OTHER
+    "size": np.dtype(np.float64),
+    "price": np.dtype(np.float64),
+    "timestamp": np.dtype(np.int64),
+}
+
+DICTS = ("markets", "outcomes", "wallets")
+
+_FETCH_CHUNK = 50_000
+
+
+@dataclass
+class EventColumns:
+    event_id: int
+    high_water_id: int
+
+    trade_id: np.ndarray
+    market_code: np.ndarray
+    wallet_code: np.ndarray
+    outcome_code: np.ndarray
+    side: np.ndarray
+    size: np.ndarray
+    price: np.ndarray
+    timestamp: np.ndarray
+
+    markets: list[tuple[str, str, str]]         # (condition_id, slug, title)
+    outcomes: list[str]
+    wallets: list[tuple[str, str, str]]         # (address, name, pseudonym)
+
+    @property
+    def rows(self) -> int:
+        return int(self.trade_id.shape[0])
+
+
+def default_cache_dir(db_path: str | Path) -> Path:
+    return Path(str(db_path) + ".columns")
+
+
+def _event_dir(cache_root: Path, event_id: int) -> Path:
+    return Path(cache_root) / f"event_{int(event_id)}"
+
+
+def _read_meta(event_dir: Path) -> dict | None:
+    try:
+        meta = json.loads((event_dir / "meta.json").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return None
+    return meta if int(meta.get("version", 0)) == CACHE_VERSION else None
+
+
+def _write_meta(event_dir: Path, meta: dict) -> None:
+    tmp = event_dir / f".meta.json.tmp{os.getpid()}"
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, event_dir / "meta.json")
+
+
+def _empty_meta() -> dict:
+    return {
+        "version": CACHE_VERSION,
+        "high_water_id": 0,
+        "rows": 0,
+        "dicts": {name: {"count": 0, "bytes": 0} for name in DICTS},
+    }
+
+
+def _load_column(path: Path, dtype: np.dtype, rows: int, mmap: bool) -> np.ndarray:
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+    return np.fromfile(path, dtype=dtype, count=rows)
+
+
+def _load_dict(path: Path, nbytes: int) -> list:
+    if nbytes == 0:
+        return []
+    with path.open("rb") as f:
+        data = f.read(nbytes)
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+
+def has_event_cache(cache_root: str | Path, event_id: int) -> bool:
+    return (_event_dir(Path(cache_root), event_id) / "meta.json").exists()
+
+
+def load_event_cache(cache_root: str | Path, event_id: int, *, mmap: bool = True) -> EventColumns | None:
+    event_dir = _event_dir(Path(cache_root), event_id)
+    meta = _read_meta(event_dir)
+    if meta is None:
+        return None
+    return _load(event_dir, event_id, meta, mmap=mmap)
+
+
+def _load(event_dir: Path, event_id: int, meta: dict, *, mmap: bool) -> EventColumns:
+    rows = int(meta["rows"])
+    cols = {name: _load_column(event_dir / f"{name}.bin", dtype, rows, mmap) for name, dtype in COLUMNS.items()}
+    dicts = {name: _load_dict(event_dir / f"{name}.jsonl", int(meta["dicts"][name]["bytes"])) for name in DICTS}
+    return EventColumns(
+        event_id=int(event_id),
+        high_water_id=int(meta["high_water_id"]),
+        markets=[tuple(m) for m in dicts["markets"]],
+        outcomes=list(dicts["outcomes"]),
+        wallets=[tuple(w) for w in dicts["wallets"]],
+        **cols,
+    )
+
+
+def _reset_files(event_dir: Path) -> None:
+    # unlink, а не truncate: у читателей могут быть memmap-ы старых файлов
+    for old in event_dir.iterdir():
+        if old.name != ".lock" and old.is_file():
+            old.unlink()
+        elif old.is_dir():
+            # поколения из кэша версии 1
+            for f in old.iterdir():
+                f.unlink()
+            old.rmdir()
+
+
+def _truncate_tails(event_dir: Path, meta: dict) -> None:
+    # хвосты, которые дописал упавший refresh (в meta их нет)
+    rows = int(meta["rows"])
+    for name, dtype in COLUMNS.items():
+        path = event_dir / f"{name}.bin"
+        if path.exists() and path.stat().st_size > rows * dtype.itemsize:
+            os.truncate(path, rows * dtype.itemsize)
+    for name in DICTS:
+        path = event_dir / f"{name}.jsonl"
+        nbytes = int(meta["dicts"][name]["bytes"])
+        if path.exists() and path.stat().st_size > nbytes:
+            os.truncate(path, nbytes)
+
+
+def refresh_event_cache(conn: sqlite3.Connection, cache_root: str | Path, event_id: int) -> EventColumns:
+    """
+    Дописывает в кэш трейды ивента с id > high_water_id и публикует их новой meta.
+    Из SQLite читается только дельта, на диск пишется только она; если дельты
+    нет — возвращается текущий кэш.
+    """
+    event_dir = _event_dir(Path(cache_root), event_id)
+    event_dir.mkdir(parents=True, exist_ok=True)
+
+    with file_lock(event_dir / ".lock"):
+        meta = _read_meta(event_dir)
+        if meta is not None and not has_trade_id(conn, event_id=event_id, trade_id=int(meta["high_water_id"])):
+            # трейды ивента удалялись (смена режима takerOnly) — собираем кэш заново
+            meta = None
+        if meta is None:
+            _reset_files(event_dir)
+            meta = _empty_meta()
+        else:
+            _truncate_tails(event_dir, meta)
+
+        high_water_id = int(meta["high_water_id"])
+        prev_dicts = {
+            name: _load_dict(event_dir / f"{name}.jsonl", int(meta["dicts"][name]["bytes"])) for name in DICTS
+        }
+        market_codes = {m[0]: i for i, m in enumerate(prev_dicts["markets"])}
+        outcome_codes = {o: i for i, o in enumerate(prev_dicts["outcomes"])}
+        wallet_codes = {w[0]: i for i, w in enumerate(prev_dicts["wallets"])}
+        del prev_dicts
+
+        cur = conn.cursor()
+        cur.row_factory = None  # голые tuple, без sqlite3.Row
+        cur.execute(
+            """
+            SELECT
+              t.id, m.condition_id, m.slug, m.title,
+              w.proxy_wallet, w.name, w.pseudonym,
+              COALESCE(t.outcome, ''),
+              CASE UPPER(t.side) WHEN 'BUY' THEN 1 WHEN 'SELL' THEN -1 ELSE 0 END,
+              COALESCE(t.size, 0.0), COALESCE(t.price, 0.0), COALESCE(t.timestamp, 0)
+            FROM trades AS t
+            JOIN trade_markets AS m ON m.market_key = t.market_key
+            JOIN wallets AS w ON w.wallet_id = t.wallet_id
+            WHERE t.id > ? AND +t.event_id = ?
+            ORDER BY t.id
+            """,
+            (high_water_id, int(event_id)),
+        )
+
+        rows_total = int(meta["rows"])
+        dict_meta = {name: dict(meta["dicts"][name]) for name in DICTS}
+        col_files = {name: (event_dir / f"{name}.bin").open("ab") for name in COLUMNS}
+        dict_files = {name: (event_dir / f"{name}.jsonl").open("ab") for name in DICTS}
+
+        def add_entry(name: str, value) -> None:
+            line = (json.dumps(value, ensure_ascii=False) + "\n").encode("utf-8")
+            dict_files[name].write(line)
+            dict_meta[name]["count"] += 1
+            dict_meta[name]["bytes"] += len(line)
+
+        try:
+            while True:
+                rows = cur.fetchmany(_FETCH_CHUNK)
+                if not rows:
+                    break
+
+                mc = np.empty(len(rows), dtype=COLUMNS["market_code"])
+                wc = np.empty(len(rows), dtype=COLUMNS["wallet_code"])
+                oc = np.empty(len(rows), dtype=COLUMNS["outcome_code"])
+                for i, (_id, cid, slug, title, addr, name, pseudo, outcome, *_rest) in enumerate(rows):
+                    code = market_codes.get(cid)
+                    if code is None:
+                        code = market_codes[cid] = len(market_codes)
+                        add_entry("markets", (cid, slug or "", title or ""))
+                    mc[i] = code
+
+                    code = wallet_codes.get(addr)
+                    if code is None:
+                        code = wallet_codes[addr] = len(wallet_codes)
+                        add_entry("wallets", (addr, name or "", pseudo or ""))
+                    wc[i] = code
+
+                    code = outcome_codes.get(outcome)
+                    if code is None:
+                        code = outcome_codes[outcome] = len(outcome_codes)
+                        add_entry("outcomes", outcome)
+                    oc[i] = code
+
+                ids, side, size, price, ts = zip(*((r[0], r[8], r[9], r[10], r[11]) for r in rows))
+                chunk = {
+                    "trade_id": ids,
+                    "market_code": mc,
+                    "wallet_code": wc,
+                    "outcome_code": oc,
+                    "side": side,
+                    "size": size,
+                    "price": price,
+                    "timestamp": ts,
+                }
+                for name, dtype in COLUMNS.items():
+                    col_files[name].write(np.asarray(chunk[name], dtype=dtype).tobytes())
+                rows_total += len(rows)
+                high_water_id = int(ids[-1])
+        finally:
+            for f in (*col_files.values(), *dict_files.values()):
+                f.close()
+
+        if rows_total != int(meta["rows"]) or not (event_dir / "meta.json").exists():
+            meta = {
+                "version": CACHE_VERSION,
+                "high_water_id": high_water_id,
+                "rows": rows_total,
+                "dicts": dict_meta,
+            }
+            _write_meta(event_dir, meta)
+
+        return _load(event_dir, event_id, meta, mmap=True)
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+# Кэш готовых файлов отчёта, адресуемый содержимым: ключ — хэш от
+# (event_id, high-water mark данных ивента, формат, опции). Пока в стор не
+# пришёл ни один новый трейд, ключ тот же и отчёт не пересобирается.
+#
+# Индекс — SQLite рядом с файлами (несколько процессов / потоков бота видят
+# один и тот же кэш). Помимо файла запись помнит Telegram file_id отправленного
+# документа: повторная отправка идёт по file_id, без загрузки файла заново.
+#
+# Вытеснение — LRU по last_access, пока суммарный размер файлов больше
+# max_bytes. У вытесненной записи с file_id удаляется только файл (file_id
+# по-прежнему годится для отправки); число записей ограничено max_entries.
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+def report_cache_key(*, event_id: int, high_water_id: int, fmt: str, **options: Any) -> str:
+    """Ключ кэша; опции со значением None не влияют на ключ."""
+    doc = {
+        "event_id": int(event_id),
+        "high_water_id": int(high_water_id),
+        "format": fmt,
+        "options": {k: v for k, v in sorted(options.items()) if v is not None},
+    }
+    raw = json.dumps(doc, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class CachedReport:
+    key: str
+    filename: str  # имя файла для пользователя (с расширением формата)
+    path: Path | None  # None — файл вытеснен, остался только file_id
+    size: int
+    tg_file_id: str | None
+
+
+class ReportCache:
+    def __init__(
+        self,
+        root: str | Path,
+        *,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS reports (
+              key TEXT PRIMARY KEY,
+              filename TEXT NOT NULL,
+              rel_path TEXT,
+              size INTEGER NOT NULL DEFAULT 0,
+              tg_file_id TEXT,
+              created_at REAL NOT NULL,
+              last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reports_lru ON reports(last_access);
+            """
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- чтение ----------
+    def get(self, key: str) -> CachedReport | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, rel_path, size, tg_file_id FROM reports WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            filename, rel_path, size, file_id = row
+
+            path = (self.root / rel_path) if rel_path else None
+            if path is not None and not path.exists():
+                # файл удалили снаружи
+                path, size = None, 0
+                self._conn.execute("UPDATE reports SET rel_path=NULL, size=0 WHERE key=?", (key,))
+            if path is None and not file_id:
+                self._conn.execute("DELETE FROM reports WHERE key=?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE reports SET last_access=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+            return CachedReport(key=key, filename=filename, path=path, size=size, tg_file_id=file_id)
+
+    def stats(self) -> tuple[int, int]:
+        """(записей, байт в файлах)"""
+        with self._lock:
+            n, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports").fetchone()
+            return int(n), int(size)
+
+    # ---------- запись ----------
+    def staging_path(self, key: str, suffix: str) -> Path:
+        """Куда экспортёру писать файл перед put() — на том же диске, что и кэш."""
+        tmp = self.root / "tmp"
+        tmp.mkdir(exist_ok=True)
+        return tmp / f"{key}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+    def put(self, key: str, src_path: str | Path, *, filename: str, extension: str = "") -> CachedReport:
+        """Переносит готовый файл в кэш (rename) и вытесняет лишнее. extension — с точкой."""
+        src = Path(src_path)
+        rel = Path(key[:2]) / f"{key}{extension}"
+        dst = self.root / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if src.resolve() != dst.resolve():
+            shutil.move(str(src), str(dst))
+        size = dst.stat().st_size
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO reports(key, filename, rel_path, size, tg_file_id, created_at, last_access)
+                VALUES (?,?,?,?,NULL,?,?)
+                ON CONFLICT(key) DO UPDATE SET
+                  filename=excluded.filename, rel_path=excluded.rel_path, size=excluded.size,
+                  last_access=excluded.last_access
+                """,
+                (key, filename, rel.as_posix(), size, now, now),
+            )
+            self._conn.commit()
+            self._evict_locked(keep=key)
+            file_id = self._conn.execute("SELECT tg_file_id FROM reports WHERE key=?", (key,)).fetchone()[0]
+
+        return CachedReport(key=key, filename=filename, path=dst, size=size, tg_file_id=file_id)
+
+    def set_file_id(self, key: str, file_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE reports SET tg_file_id=? WHERE key=?", (file_id, key))
+            self._conn.commit()
+
+    def forget_file_id(self, key: str) -> None:
+        """file_id больше не принимается Telegram — следующая отправка загрузит файл."""
+        with self._lock:
+            self._conn.execute("UPDATE reports SET tg_file_id=NULL WHERE key=?", (key,))
+            self._conn.execute("DELETE FROM reports WHERE key=? AND rel_path IS NULL", (key,))
+            self._conn.commit()
+
+    def discard(self, key: str) -> None:
+        """Выкинуть запись вместе с файлом — следующий запрос соберёт отчёт заново."""
+        with self._lock:
+            row = self._conn.execute("SELECT rel_path FROM reports WHERE key=?", (key,)).fetchone()
+            if row is not None and row[0]:
+                (self.root / row[0]).unlink(missing_ok=True)
+            self._conn.execute("DELETE FROM reports WHERE key=?", (key,))
+            self._conn.commit()
+
+    # ---------- вытеснение ----------
+    def _evict_locked(self, *, keep: str) -> None:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()
+        if total > self.max_bytes:
+            for key, rel_path, size, file_id in self._conn.execute(
+                """
+                SELECT key, rel_path, size, tg_file_id FROM reports
+                WHERE rel_path IS NOT NULL AND key<>?
+                ORDER BY last_access
+                """,
+                (keep,),
+            ).fetchall():
+                try:
+                    (self.root / rel_path).unlink()
+                except FileNotFoundError:
+                    pass
+                if file_id:
+                    self._conn.execute("UPDATE reports SET rel_path=NULL, size=0 WHERE key=?", (key,))
+                else:
+                    self._conn.execute("DELETE FROM reports WHERE key=?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+        (n,) = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()
+        if n > self.max_entries:
+            for key, rel_path in self._conn.execute(
+                "SELECT key, rel_path FROM reports WHERE key<>? ORDER BY last_access LIMIT ?",
+                (keep, n - self.max_entries),
+            ).fetchall():
+                if rel_path:
+                    try:
+                        (self.root / rel_path).unlink()
+                    except FileNotFoundError:
+                        pass
+                self._conn.execute("DELETE FROM reports WHERE key=?", (key,))
+        self._conn.commit()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+from app.services.event_aggregator import EventReportData, MarketTotals, ParticipantTotals
+from app.utils.hyperloglog import HyperLogLog
+
+# Снапшот состояния агрегации ивента (EventReportData + high-water mark — id
+# последнего учтённого трейда в сторе), чтобы следующий отчёт доливал только
+# трейды с id > high_water_id.
+#
+# Формат: gzip(JSON), колонками — строки кошельков/рынков/исходов хранятся
+# один раз в словарях, в колонках участников — их индексы. float-ы в JSON
+# пишутся через repr и читаются без потерь. unique_traders рынка — список
+# индексов кошельков либо {"hll": ...} для приблизительного режима.
+
+SNAPSHOT_VERSION = 1
+
+_PARTICIPANT_NUM_COLUMNS = (
+    "buy_shares",
+    "buy_usd",
+    "sell_shares",
+    "sell_usd",
+    "trades_count",
+    "first_ts",
+    "last_ts",
+)
+
+
+def default_snapshot_path(db_path: str | Path, event_id: int) -> Path:
+    return Path(str(db_path) + ".snapshots") / f"event_{int(event_id)}.json.gz"
+
+
+def save_report_snapshot(path: str | Path, report: EventReportData, *, high_water_id: int) -> None:
+    wallets: dict[str, int] = {}
+    wallet_names: list[str] = []
+    wallet_pseudonyms: list[str] = []
+    outcomes: dict[str, int] = {}
+    market_codes = {cid: i for i, cid in enumerate(report.markets)}
+
+    def wallet_code(addr: str, name: str = "", pseudo: str = "") -> int:
+        code = wallets.get(addr)
+        if code is None:
+            code = wallets[addr] = len(wallet_names)
+            wallet_names.append(name)
+            wallet_pseudonyms.append(pseudo)
+        return code
+
+    p_cols: dict[str, list] = {"market": [], "wallet": [], "outcome": []}
+    p_cols.update({c: [] for c in _PARTICIPANT_NUM_COLUMNS})
+    for (cid, addr, outcome), pt in report.participants.items():
+        if cid not in market_codes:
+            # участник по рынку без MarketTotals — в нормальном отчёте не бывает
+            raise ValueError(f"participant market {cid} is missing from report.markets")
+        p_cols["market"].append(market_codes[cid])
+        p_cols["wallet"].append(wallet_code(addr, pt.trader_name, pt.trader_pseudonym))
+        p_cols["outcome"].append(outcomes.setdefault(outcome, len(outcomes)))
+        for c in _PARTICIPANT_NUM_COLUMNS:
+            p_cols[c].append(getattr(pt, c))
+
+    m_cols: dict[str, list] = {
+        "condition_id": [],
+        "market_slug": [],
+        "question": [],
+        "trades_count": [],
+        "buy_usd": [],
+        "sell_usd": [],
+        "turnover_usd": [],
+        "unique_traders": [],
+    }
+    for cid, mt in report.markets.items():
+        m_cols["condition_id"].append(cid)
+        m_cols["market_slug"].append(mt.market_slug)
+        m_cols["question"].append(mt.question)
+        m_cols["trades_count"].append(mt.trades_count)
+        m_cols["buy_usd"].append(mt.buy_usd)
+        m_cols["sell_usd"].append(mt.sell_usd)
+        m_cols["turnover_usd"].append(mt.turnover_usd)
+        if isinstance(mt.unique_traders, HyperLogLog):
+            m_cols["unique_traders"].append({"hll": mt.unique_traders.to_state()})
+        else:
+            m_cols["unique_traders"].append(sorted(wallet_code(w) for w in mt.unique_traders))
+
+    doc = {
+        "version": SNAPSHOT_VERSION,
+        "high_water_id": int(high_water_id),
+        "event": {
+            "event_id": report.event_id,
+            "event_slug": report.event_slug,
+            "event_title": report.event_title,
+            "as_of_utc": report.as_of_utc,
+            "total_trades": report.total_trades,
+            "unique_traders": report.unique_traders,
+            "total_turnover_usd": report.total_turnover_usd,
+        },
+        "wallets": {"address": list(wallets), "name": wallet_names, "pseudonym": wallet_pseudonyms},
+        "outcomes": list(outcomes),
+        "markets": m_cols,
+        "participants": p_cols,
+    }
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=1) as f:
+        json.dump(doc, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_report_snapshot(path: str | Path) -> tuple[EventReportData, int] | None:
+    """(отчёт, high_water_id) или None, если снапшота нет или он другой версии."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            doc = json.load(f)
+        if int(doc.get("version", 0)) != SNAPSHOT_VERSION:
+            return None
+        return _snapshot_from_doc(doc)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, KeyError, TypeError, IndexError, AttributeError):
+        # битый / недописанный файл или не та структура — просто пересчитаем с нуля
+        return None
+
+
+def _snapshot_from_doc(doc: dict) -> tuple[EventReportData, int]:
+    addrs = doc["wallets"]["address"]
+    names = doc["wallets"]["name"]
+    pseudos = doc["wallets"]["pseudonym"]
+    outcomes = doc["outcomes"]
+
+    m = doc["markets"]
+    markets: dict[str, MarketTotals] = {}
+    for i, cid in enumerate(m["condition_id"]):
+        traders = m["unique_traders"][i]
+        markets[cid] = MarketTotals(
+            condition_id=cid,
+            market_slug=m["market_slug"][i],
+            question=m["question"][i],
+            trades_count=m["trades_count"][i],
+            buy_usd=m["buy_usd"][i],
+            sell_usd=m["sell_usd"][i],
+            turnover_usd=m["turnover_usd"][i],
+            unique_traders=(
+                HyperLogLog.from_state(traders["hll"])
+                if isinstance(traders, dict)
+                else {addrs[w] for w in traders}
+            ),
+        )
+
+    cids = m["condition_id"]
+    p = doc["participants"]
+    participants: dict[tuple[str, str, str], ParticipantTotals] = {}
+    for mc, wc, oc, bs, bu, ss, su, cnt, fts, lts in zip(
+        p["market"], p["wallet"], p["outcome"], *(p[c] for c in _PARTICIPANT_NUM_COLUMNS)
+    ):
+        cid, addr, outcome = cids[mc], addrs[wc], outcomes[oc]
+        participants[(cid, addr, outcome)] = ParticipantTotals(
+            condition_id=cid,
+            trader_address=addr,
+            outcome=outcome,
+            trader_name=names[wc],
+            trader_pseudonym=pseudos[wc],
+            buy_shares=bs,
+            buy_usd=bu,
+            sell_shares=ss,
+            sell_usd=su,
+            trades_count=cnt,
+            first_ts=fts,
+            last_ts=lts,
+        )
+
+    ev = doc["event"]
+    report = EventReportData(
+        event_id=ev["event_id"],
+        event_slug=ev["event_slug"],
+        event_title=ev["event_title"],
+        as_of_utc=ev["as_of_utc"],
+        total_trades=ev["total_trades"],
+        unique_traders=ev["unique_traders"],
+        total_turnover_usd=ev["total_turnover_usd"],
+        markets=markets,
+        participants=participants,
+    )
+    return report, int(doc["high_water_id"])
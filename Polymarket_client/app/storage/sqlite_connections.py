@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+from app.storage.sqlite_event_store import _connect, ensure_db
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+@dataclass(frozen=True)
+class StoreConfig:
+    # сколько read-only соединений держим в пуле
+    readers: int = 4
+    # страничный кэш на соединение, KiB (отрицательное значение в PRAGMA = KiB)
+    cache_size_kib: int = 64 * 1024
+    # сколько байт файла читатели мапят в память
+    mmap_size: int = 256 * 1024 * 1024
+    busy_timeout_s: float = 30.0
+
+
+class SqliteStore:
+    """
+    Менеджер соединений к одному файлу стора.
+
+    - одна пишущая connection в отдельном потоке; записи приходят через очередь
+      (write / submit_write), каждая задача — своя транзакция;
+    - пул read-only соединений (WAL), читатели не ждут писателя и видят
+      последнее закоммиченное состояние.
+
+    Схема накатывается один раз на файл (ensure_db), а не на каждое соединение.
+
+    Если соединение писателя не открылось — исключение из конструктора; если
+    поток писателя упал позже — ждущие и новые записи получают RuntimeError
+    с этой причиной, а не висят на Future.result().
+    """
+
+    def __init__(self, db_path: str | Path, cfg: StoreConfig | None = None) -> None:
+        self.cfg = cfg or StoreConfig()
+        self.db_path = str(Path(ensure_db(str(db_path))).resolve())
+
+        self._jobs: queue.Queue = queue.Queue()
+        self._jobs_lock = threading.Lock()
+        self._failure: BaseException | None = None
+        started: Future = Future()
+        self._writer = threading.Thread(
+            target=self._writer_loop, args=(started,), name=f"sqlite-writer:{Path(self.db_path).name}", daemon=True
+        )
+        self._writer.start()
+        # ошибка открытия / PRAGMA писателя (БД занята миграцией, нет места) — сразу здесь
+        started.result()
+
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        self._readers_opened = 0
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+    # ---------- writes ----------
+    def submit_write(self, fn: Callable[[sqlite3.Connection], T]) -> Future:
+        if self._closed:
+            raise RuntimeError("store is closed")
+        fut: Future = Future()
+        with self._jobs_lock:
+            if self._failure is not None:
+                raise RuntimeError("store writer has failed") from self._failure
+            self._jobs.put((fn, fut))
+        return fut
+
+    def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if threading.current_thread() is self._writer:
+            # вложенная запись из задачи писателя — выполняем сразу, иначе дедлок
+            return fn(self._writer_conn)
+        return self.submit_write(fn).result()
+
+    def _writer_loop(self, started: Future) -> None:
+        try:
+            conn = _connect(self.db_path)
+            self._apply_pragmas(conn)
+        except BaseException as e:
+            started.set_exception(e)
+            return
+        self._writer_conn = conn
+        started.set_result(None)
+
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is _STOP:
+                    break
+                fn, fut = job
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(conn)
+                    conn.commit()
+                except BaseException as e:
+                    fut.set_exception(e)
+                    # rollback тоже может упасть (диск, I/O) — тогда писатель мёртв
+                    conn.rollback()
+                else:
+                    fut.set_result(result)
+        except BaseException as e:
+            self._fail_pending(e)
+        finally:
+            conn.close()
+
+    def _fail_pending(self, error: BaseException) -> None:
+        with self._jobs_lock:
+            self._failure = error
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not _STOP and job[1].set_running_or_notify_cancel():
+                    exc = RuntimeError("store writer has failed")
+                    exc.__cause__ = error
+                    job[1].set_exception(exc)
+        with _stores_lock:
+            # следующий get_store откроет стор заново
+            if _stores.get(self.db_path) is self:
+                del _stores[self.db_path]
+
+    # ---------- reads ----------
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Read-only соединение из пула; внутри — одна read-транзакция (согласованный снимок)."""
+        conn = self._acquire_reader()
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+        finally:
+            self._readers.put(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if self._readers_opened < self.cfg.readers:
+                self._readers_opened += 1
+                return self._open_reader()
+
+        return self._readers.get()
+
+    def _open_reader(self) -> sqlite3.Connection:
+        return open_read_only(self.db_path, self.cfg)
+
+    def _apply_pragmas(self, conn: sqlite3.Connection) -> None:
+        _apply_pragmas(conn, self.cfg)
+
+    # ---------- lifecycle ----------
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        with _stores_lock:
+            if _stores.get(self.db_path) is self:
+                del _stores[self.db_path]
+        self._jobs.put(_STOP)
+        self._writer.join()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_stores: dict[str, SqliteStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _apply_pragmas(conn: sqlite3.Connection, cfg: StoreConfig) -> None:
+    conn.execute(f"PRAGMA cache_size=-{int(cfg.cache_size_kib)}")
+    conn.execute(f"PRAGMA mmap_size={int(cfg.mmap_size)}")
+    conn.execute(f"PRAGMA busy_timeout={int(cfg.busy_timeout_s * 1000)}")
+
+
+def open_read_only(db_path: str | Path, cfg: StoreConfig | None = None) -> sqlite3.Connection:
+    """
+    Отдельное read-only соединение без SqliteStore — для дочерних процессов
+    (после fork реестр get_store унаследован вместе с мёртвым потоком писателя).
+    """
+    cfg = cfg or StoreConfig()
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=cfg.busy_timeout_s, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=ON")
+    _apply_pragmas(conn, cfg)
+    return conn
+
+
+def get_store(db_path: str | Path, cfg: StoreConfig | None = None) -> SqliteStore:
+    """Один SqliteStore (один писатель) на файл в процессе."""
+    key = str(Path(db_path).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SqliteStore(key, cfg)
+        return store
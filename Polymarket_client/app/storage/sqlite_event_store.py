@@ -1,11 +1,13 @@
 from __future__ import annotations
 
+import hashlib
 import sqlite3
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, Iterator, Optional
 
-from app.ingestion.event_resolver import EventMeta, MarketMeta
+from app.ingestion.event_resolver import EventMeta
 from app.ingestion.trades_loader import Trade
 
 
@@ -15,9 +17,19 @@ class DbStats:
     ignored: int
 
 
+@dataclass(frozen=True)
+class EventSyncState:
+    event_id: int
+    full_synced: bool
+    taker_only: bool
+    filter_key: str  # MarketFilter.fingerprint, с которым качали ("" — без фильтра)
+    high_water_ts: int | None
+    last_synced_at: float | None
+
+
+# journal_mode=WAL хранится в самом файле — ставим один раз вместе со схемой
 SCHEMA_SQL = """
 PRAGMA journal_mode=WAL;
-PRAGMA synchronous=NORMAL;
 
 CREATE TABLE IF NOT EXISTS events (
   event_id INTEGER PRIMARY KEY,
@@ -26,6 +38,16 @@ CREATE TABLE IF NOT EXISTS events (
   created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
+-- свежесть данных по ивенту в общем сторе (см. app/services/event_report_service)
+CREATE TABLE IF NOT EXISTS event_sync (
+  event_id INTEGER PRIMARY KEY,
+  full_synced INTEGER NOT NULL DEFAULT 0,  -- хотя бы раз выкачали всю историю до конца
+  taker_only INTEGER NOT NULL DEFAULT 0,   -- с каким takerOnly качали
+  filter_key TEXT NOT NULL DEFAULT '',     -- с каким фильтром рынков качали ('' — без фильтра)
+  high_water_ts INTEGER,                   -- самый свежий timestamp трейда в БД
+  last_synced_at REAL                      -- unix time последней синхронизации
+);
+
 CREATE TABLE IF NOT EXISTS markets (
   event_id INTEGER NOT NULL,
   condition_id TEXT NOT NULL,
@@ -35,17 +57,28 @@ CREATE TABLE IF NOT EXISTS markets (
   PRIMARY KEY (event_id, condition_id)
 );
 
+-- справочники: одна строка на кошелёк (вместе с профилем) и на рынок,
+-- в trades хранятся только их integer-ключи
+CREATE TABLE IF NOT EXISTS wallets (
+  wallet_id INTEGER PRIMARY KEY,
+  proxy_wallet TEXT NOT NULL UNIQUE,
+  name TEXT,
+  pseudonym TEXT
+);
+
+CREATE TABLE IF NOT EXISTS trade_markets (
+  market_key INTEGER PRIMARY KEY,
+  condition_id TEXT NOT NULL UNIQUE,
+  slug TEXT,
+  title TEXT
+);
+
 CREATE TABLE IF NOT EXISTS trades (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   event_id INTEGER NOT NULL,
 
-  condition_id TEXT NOT NULL,
-  market_slug TEXT,
-  market_title TEXT,
-
-  proxy_wallet TEXT NOT NULL,
-  name TEXT,
-  pseudonym TEXT,
+  market_key INTEGER NOT NULL REFERENCES trade_markets(market_key),
+  wallet_id INTEGER NOT NULL REFERENCES wallets(wallet_id),
 
   side TEXT,
   outcome TEXT,
@@ -56,24 +89,416 @@ CREATE TABLE IF NOT EXISTS trades (
   timestamp INTEGER,
   tx_hash TEXT,
 
-  inserted_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  -- 16 байт blake2b от полей, которые раньше были в UNIQUE(...) (см. trade_dedup_key)
+  dedup_key BLOB NOT NULL,
 
-  UNIQUE (
-    event_id, condition_id, proxy_wallet,
-    side, outcome, size, price, timestamp, tx_hash
-  )
+  inserted_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX IF NOT EXISTS idx_trades_event_id ON trades(event_id);
-CREATE INDEX IF NOT EXISTS idx_trades_event_condition ON trades(event_id, condition_id);
-CREATE INDEX IF NOT EXISTS idx_trades_event_wallet ON trades(event_id, proxy_wallet);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_trades_dedup_key ON trades(dedup_key);
+CREATE INDEX IF NOT EXISTS idx_trades_event_wallet ON trades(event_id, wallet_id);
+
+-- покрывающий индекс под агрегацию по ивенту (GROUP BY идёт по индексу в нужном
+-- порядке и не трогает саму таблицу). Заодно заменяет индексы (event_id) и
+-- (event_id, market_key) — они его префиксы.
+CREATE INDEX IF NOT EXISTS idx_trades_agg ON trades(
+  event_id, market_key, wallet_id, outcome, side, size, price, timestamp
+);
 """
 
+# агрегаты, которые insert_trades обновляет в той же транзакции только по
+# новым строкам — отчёт читает их и не сканирует trades
+AGGREGATES_SQL = """
+CREATE TABLE IF NOT EXISTS participant_totals (
+  event_id INTEGER NOT NULL,
+  market_key INTEGER NOT NULL,
+  wallet_id INTEGER NOT NULL,
+  outcome TEXT NOT NULL,
+
+  buy_shares REAL NOT NULL DEFAULT 0,
+  buy_usd REAL NOT NULL DEFAULT 0,
+  sell_shares REAL NOT NULL DEFAULT 0,
+  sell_usd REAL NOT NULL DEFAULT 0,
+  turnover_usd REAL NOT NULL DEFAULT 0,
+
+  trades_count INTEGER NOT NULL DEFAULT 0,
+  first_ts INTEGER,
+  last_ts INTEGER,
+
+  PRIMARY KEY (event_id, market_key, wallet_id, outcome)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS market_totals (
+  event_id INTEGER NOT NULL,
+  market_key INTEGER NOT NULL,
+
+  trades_count INTEGER NOT NULL DEFAULT 0,
+  buy_usd REAL NOT NULL DEFAULT 0,
+  sell_usd REAL NOT NULL DEFAULT 0,
+  turnover_usd REAL NOT NULL DEFAULT 0,
+
+  PRIMARY KEY (event_id, market_key)
+) WITHOUT ROWID;
+"""
+
+SCHEMA_SQL += AGGREGATES_SQL
+
+# свёртка трейдов с id > ? в агрегаты. Строки без кошелька / conditionId
+# пропускаем — как и aggregate_event. "+t.event_id" — чтобы планировщик шёл
+# по диапазону rowid (только новые строки), а не по индексу всего ивента.
+_FOLD_PARTICIPANTS_SQL = """
+INSERT INTO participant_totals(
+  event_id, market_key, wallet_id, outcome,
+  buy_shares, buy_usd, sell_shares, sell_usd, turnover_usd,
+  trades_count, first_ts, last_ts
+)
+SELECT
+  t.event_id, t.market_key, t.wallet_id, COALESCE(t.outcome, ''),
+  TOTAL(CASE WHEN UPPER(t.side)='BUY' THEN t.size END),
+  TOTAL(CASE WHEN UPPER(t.side)='BUY' THEN t.size * t.price END),
+  TOTAL(CASE WHEN UPPER(t.side)='SELL' THEN t.size END),
+  TOTAL(CASE WHEN UPPER(t.side)='SELL' THEN t.size * t.price END),
+  TOTAL(t.size * t.price),
+  COUNT(*),
+  MIN(NULLIF(t.timestamp, 0)),
+  MAX(NULLIF(t.timestamp, 0))
+FROM trades AS t
+JOIN trade_markets AS m ON m.market_key = t.market_key
+JOIN wallets AS w ON w.wallet_id = t.wallet_id
+WHERE +t.event_id = ? AND t.id > ? AND m.condition_id != '' AND w.proxy_wallet != ''
+GROUP BY t.market_key, t.wallet_id, COALESCE(t.outcome, '')
+ON CONFLICT(event_id, market_key, wallet_id, outcome) DO UPDATE SET
+  buy_shares = buy_shares + excluded.buy_shares,
+  buy_usd = buy_usd + excluded.buy_usd,
+  sell_shares = sell_shares + excluded.sell_shares,
+  sell_usd = sell_usd + excluded.sell_usd,
+  turnover_usd = turnover_usd + excluded.turnover_usd,
+  trades_count = trades_count + excluded.trades_count,
+  first_ts = COALESCE(MIN(first_ts, excluded.first_ts), first_ts, excluded.first_ts),
+  last_ts = COALESCE(MAX(last_ts, excluded.last_ts), last_ts, excluded.last_ts)
+"""
+
+_FOLD_MARKETS_SQL = """
+INSERT INTO market_totals(event_id, market_key, trades_count, buy_usd, sell_usd, turnover_usd)
+SELECT
+  t.event_id, t.market_key,
+  COUNT(*),
+  TOTAL(CASE WHEN UPPER(t.side)='BUY' THEN t.size * t.price END),
+  TOTAL(CASE WHEN UPPER(t.side)='SELL' THEN t.size * t.price END),
+  TOTAL(t.size * t.price)
+FROM trades AS t
+JOIN trade_markets AS m ON m.market_key = t.market_key
+JOIN wallets AS w ON w.wallet_id = t.wallet_id
+WHERE +t.event_id = ? AND t.id > ? AND m.condition_id != '' AND w.proxy_wallet != ''
+GROUP BY t.market_key
+ON CONFLICT(event_id, market_key) DO UPDATE SET
+  trades_count = trades_count + excluded.trades_count,
+  buy_usd = buy_usd + excluded.buy_usd,
+  sell_usd = sell_usd + excluded.sell_usd,
+  turnover_usd = turnover_usd + excluded.turnover_usd
+"""
+
+# PRAGMA user_version:
+#   0 — исходная схема (UNIQUE по 9 колонкам)
+#   1 — dedup_key BLOB + уникальный индекс по нему
+#   2 — кошельки/профили и рынки вынесены в справочники wallets / trade_markets
+#   3 — покрывающий индекс idx_trades_agg под агрегацию в SQL
+#   4 — инкрементальные агрегаты participant_totals / market_totals
+#   5 — event_sync: метаданные свежести для общего стора на много ивентов
+#   6 — event_sync.filter_key: с каким фильтром рынков выкачана история
+SCHEMA_VERSION = 6
+
+# размер пачки для "... WHERE x IN (?, ?, ...)" (лимит переменных SQLite)
+_IN_CHUNK = 500
+
+_DEDUP_KEY_SIZE = 16
+
+
+def _dedup_key_raw(
+    event_id: int,
+    condition_id: str | None,
+    proxy_wallet: str | None,
+    side: str | None,
+    outcome: str | None,
+    size: float | None,
+    price: float | None,
+    timestamp: int | None,
+    tx_hash: str | None,
+) -> bytes:
+    # те же 9 полей, что были в UNIQUE(...); float через repr — точное представление REAL
+    parts = (
+        str(int(event_id)),
+        condition_id or "",
+        proxy_wallet or "",
+        side or "",
+        outcome or "",
+        repr(float(size or 0.0)),
+        repr(float(price or 0.0)),
+        str(int(timestamp or 0)),
+        tx_hash or "",
+    )
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=_DEDUP_KEY_SIZE).digest()
+
+
+def trade_dedup_key(event_id: int, t: Trade) -> bytes:
+    return _dedup_key_raw(
+        event_id,
+        t.condition_id,
+        t.proxy_wallet,
+        t.side,
+        t.outcome,
+        t.size,
+        t.price,
+        t.timestamp,
+        t.tx_hash,
+    )
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _migrate_v0_to_v1(conn: sqlite3.Connection) -> None:
+    """
+    Пересобираем trades: вместо UNIQUE(9 колонок) — dedup_key BLOB.
+    SQLite не умеет дропать constraint через ALTER, поэтому копируем таблицу.
+    """
+    conn.create_function("_dedup_key", 9, _dedup_key_raw, deterministic=True)
+    conn.executescript(
+        """
+        BEGIN;
+        ALTER TABLE trades RENAME TO trades_v0;
+        DROP INDEX IF EXISTS idx_trades_event_id;
+        DROP INDEX IF EXISTS idx_trades_event_condition;
+        DROP INDEX IF EXISTS idx_trades_event_wallet;
+
+        CREATE TABLE trades (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          event_id INTEGER NOT NULL,
+
+          condition_id TEXT NOT NULL,
+          market_slug TEXT,
+          market_title TEXT,
+
+          proxy_wallet TEXT NOT NULL,
+          name TEXT,
+          pseudonym TEXT,
+
+          side TEXT,
+          outcome TEXT,
+          outcome_index INTEGER,
+
+          size REAL,
+          price REAL,
+          timestamp INTEGER,
+          tx_hash TEXT,
+
+          dedup_key BLOB NOT NULL,
+
+          inserted_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE UNIQUE INDEX idx_trades_dedup_key ON trades(dedup_key);
+
+        INSERT OR IGNORE INTO trades(
+          id, event_id,
+          condition_id, market_slug, market_title,
+          proxy_wallet, name, pseudonym,
+          side, outcome, outcome_index,
+          size, price, timestamp, tx_hash,
+          dedup_key, inserted_at
+        )
+        SELECT
+          id, event_id,
+          condition_id, market_slug, market_title,
+          proxy_wallet, name, pseudonym,
+          side, outcome, outcome_index,
+          size, price, timestamp, tx_hash,
+          _dedup_key(event_id, condition_id, proxy_wallet, side, outcome, size, price, timestamp, tx_hash),
+          inserted_at
+        FROM trades_v0
+        ORDER BY id;
+
+        DROP TABLE trades_v0;
+        PRAGMA user_version=1;
+        COMMIT;
+        """
+    )
+
+
+def _migrate_v1_to_v2(conn: sqlite3.Connection) -> None:
+    """
+    Выносим повторяющиеся на каждой строке wallet/name/pseudonym и slug/title
+    в справочники. Профиль берём из первой строки, где он не пустой —
+    так же, как это делает aggregate_event.
+    """
+    conn.executescript(
+        """
+        BEGIN;
+        ALTER TABLE trades RENAME TO trades_v1;
+        DROP INDEX IF EXISTS idx_trades_dedup_key;
+        DROP INDEX IF EXISTS idx_trades_event_id;
+        DROP INDEX IF EXISTS idx_trades_event_condition;
+        DROP INDEX IF EXISTS idx_trades_event_wallet;
+
+        CREATE TABLE wallets (
+          wallet_id INTEGER PRIMARY KEY,
+          proxy_wallet TEXT NOT NULL UNIQUE,
+          name TEXT,
+          pseudonym TEXT
+        );
+
+        CREATE TABLE trade_markets (
+          market_key INTEGER PRIMARY KEY,
+          condition_id TEXT NOT NULL UNIQUE,
+          slug TEXT,
+          title TEXT
+        );
+
+        INSERT INTO wallets(proxy_wallet, name, pseudonym)
+        SELECT w.proxy_wallet, n.name, p.pseudonym
+        FROM (SELECT proxy_wallet, MIN(id) AS first_id FROM trades_v1 GROUP BY proxy_wallet) AS w
+        LEFT JOIN (
+          SELECT proxy_wallet, name, MIN(id) FROM trades_v1 WHERE name != '' GROUP BY proxy_wallet
+        ) AS n USING (proxy_wallet)
+        LEFT JOIN (
+          SELECT proxy_wallet, pseudonym, MIN(id) FROM trades_v1 WHERE pseudonym != '' GROUP BY proxy_wallet
+        ) AS p USING (proxy_wallet)
+        ORDER BY w.first_id;
+
+        INSERT INTO trade_markets(condition_id, slug, title)
+        SELECT m.condition_id, s.market_slug, t.market_title
+        FROM (SELECT condition_id, MIN(id) AS first_id FROM trades_v1 GROUP BY condition_id) AS m
+        LEFT JOIN (
+          SELECT condition_id, market_slug, MIN(id) FROM trades_v1 WHERE market_slug != '' GROUP BY condition_id
+        ) AS s USING (condition_id)
+        LEFT JOIN (
+          SELECT condition_id, market_title, MIN(id) FROM trades_v1 WHERE market_title != '' GROUP BY condition_id
+        ) AS t USING (condition_id)
+        ORDER BY m.first_id;
+
+        CREATE TABLE trades (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          event_id INTEGER NOT NULL,
+
+          market_key INTEGER NOT NULL REFERENCES trade_markets(market_key),
+          wallet_id INTEGER NOT NULL REFERENCES wallets(wallet_id),
+
+          side TEXT,
+          outcome TEXT,
+          outcome_index INTEGER,
+
+          size REAL,
+          price REAL,
+          timestamp INTEGER,
+          tx_hash TEXT,
+
+          dedup_key BLOB NOT NULL,
+
+          inserted_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+
+        INSERT INTO trades(
+          id, event_id, market_key, wallet_id,
+          side, outcome, outcome_index,
+          size, price, timestamp, tx_hash,
+          dedup_key, inserted_at
+        )
+        SELECT
+          t.id, t.event_id, m.market_key, w.wallet_id,
+          t.side, t.outcome, t.outcome_index,
+          t.size, t.price, t.timestamp, t.tx_hash,
+          t.dedup_key, t.inserted_at
+        FROM trades_v1 AS t
+        JOIN trade_markets AS m ON m.condition_id = t.condition_id
+        JOIN wallets AS w ON w.proxy_wallet = t.proxy_wallet
+        ORDER BY t.id;
+
+        DROP TABLE trades_v1;
+        PRAGMA user_version=2;
+        COMMIT;
+        """
+    )
+
+
+def _migrate_v2_to_v3(conn: sqlite3.Connection) -> None:
+    # сам idx_trades_agg создаст SCHEMA_SQL, тут только убираем его префиксы
+    conn.executescript(
+        """
+        BEGIN;
+        DROP INDEX IF EXISTS idx_trades_event_id;
+        DROP INDEX IF EXISTS idx_trades_event_market;
+        PRAGMA user_version=3;
+        COMMIT;
+        """
+    )
+
+
+def _migrate_v3_to_v4(conn: sqlite3.Connection) -> None:
+    conn.executescript(AGGREGATES_SQL)
+    event_ids = [int(r[0]) for r in conn.execute("SELECT DISTINCT event_id FROM trades")]
+    for event_id in event_ids:
+        rebuild_event_aggregates(conn, event_id=event_id)
+    conn.execute("PRAGMA user_version=4")
+    conn.commit()
+
+
+def _migrate_v5_to_v6(conn: sqlite3.Connection) -> None:
+    # до v5 таблицы event_sync нет — её создаст SCHEMA_SQL уже с колонкой
+    if _table_columns(conn, "event_sync") and "filter_key" not in _table_columns(conn, "event_sync"):
+        conn.execute("ALTER TABLE event_sync ADD COLUMN filter_key TEXT NOT NULL DEFAULT ''")
+    conn.execute("PRAGMA user_version=6")
+    conn.commit()
+
+
+_MIGRATIONS = [
+    (1, _migrate_v0_to_v1),
+    (2, _migrate_v1_to_v2),
+    (3, _migrate_v2_to_v3),
+    (4, _migrate_v3_to_v4),
+    # 5: только новая таблица event_sync, её создаёт SCHEMA_SQL
+    (6, _migrate_v5_to_v6),
+]
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    if version < SCHEMA_VERSION and "id" in _table_columns(conn, "trades"):
+        # старый файл ивента: догоняем схему по шагам
+        migrated = False
+        for target, migrate in _MIGRATIONS:
+            if version < target:
+                migrate(conn)
+                version = target
+                migrated = True
+        if migrated:
+            # после пересборки таблиц освобождаем место на диске
+            conn.execute("VACUUM")
+
+    conn.executescript(SCHEMA_SQL)
+    conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+
+# файлы, для которых схема уже проверена/накатана в этом процессе
+_schema_ready: set[str] = set()
+_schema_lock = threading.Lock()
+
+
+def _prepare_schema_once(conn: sqlite3.Connection, db_path: str) -> None:
+    key = str(Path(db_path).resolve())
+    if key in _schema_ready:
+        return
+    with _schema_lock:
+        if key not in _schema_ready:
+            _ensure_schema(conn)
+            _schema_ready.add(key)
+
 
 def _connect(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path, timeout=30)
     conn.row_factory = sqlite3.Row
-    conn.executescript(SCHEMA_SQL)
+    # synchronous — настройка соединения, а не файла
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _prepare_schema_once(conn, db_path)
     return conn
 
 
@@ -123,6 +548,124 @@ def upsert_markets(conn: sqlite3.Connection, event: EventMeta) -> None:
     )
 
 
+def get_event_sync(conn: sqlite3.Connection, *, event_id: int) -> EventSyncState | None:
+    row = conn.execute(
+        """
+        SELECT full_synced, taker_only, filter_key, high_water_ts, last_synced_at
+        FROM event_sync WHERE event_id=?
+        """,
+        (int(event_id),),
+    ).fetchone()
+    if row is None:
+        return None
+    return EventSyncState(
+        event_id=int(event_id),
+        full_synced=bool(row[0]),
+        taker_only=bool(row[1]),
+        filter_key=str(row[2] or ""),
+        high_water_ts=int(row[3]) if row[3] is not None else None,
+        last_synced_at=float(row[4]) if row[4] is not None else None,
+    )
+
+
+def mark_event_synced(
+    conn: sqlite3.Connection,
+    *,
+    event_id: int,
+    full_synced: bool,
+    taker_only: bool,
+    high_water_ts: int | None,
+    synced_at: float,
+    filter_key: str = "",
+) -> None:
+    # full_synced не сбрасываем: дельта поверх полной истории тоже полная
+    # (если не поменялся режим takerOnly / фильтр рынков — тогда история уже другая)
+    conn.execute(
+        """
+        INSERT INTO event_sync(event_id, full_synced, taker_only, filter_key, high_water_ts, last_synced_at)
+        VALUES(?, ?, ?, ?, ?, ?)
+        ON CONFLICT(event_id) DO UPDATE SET
+          full_synced=CASE
+            WHEN event_sync.taker_only = excluded.taker_only AND event_sync.filter_key = excluded.filter_key
+            THEN MAX(event_sync.full_synced, excluded.full_synced)
+            ELSE excluded.full_synced
+          END,
+          taker_only=excluded.taker_only,
+          filter_key=excluded.filter_key,
+          high_water_ts=COALESCE(MAX(event_sync.high_water_ts, excluded.high_water_ts),
+                                 event_sync.high_water_ts, excluded.high_water_ts),
+          last_synced_at=excluded.last_synced_at
+        """,
+        (int(event_id), int(full_synced), int(taker_only), filter_key, high_water_ts, float(synced_at)),
+    )
+
+
+def _resolve_wallet_ids(conn: sqlite3.Connection, trades: list[Trade]) -> dict[str, int]:
+    # профиль: первый непустой name/pseudonym в пачке; в БД дописываем только пустые поля
+    profiles: dict[str, list[str]] = {}
+    for t in trades:
+        prof = profiles.get(t.proxy_wallet)
+        if prof is None:
+            profiles[t.proxy_wallet] = [t.name or "", t.pseudonym or ""]
+            continue
+        if not prof[0] and t.name:
+            prof[0] = t.name
+        if not prof[1] and t.pseudonym:
+            prof[1] = t.pseudonym
+
+    conn.executemany(
+        """
+        INSERT INTO wallets(proxy_wallet, name, pseudonym)
+        VALUES(?, ?, ?)
+        ON CONFLICT(proxy_wallet) DO UPDATE SET
+          name=COALESCE(NULLIF(wallets.name, ''), excluded.name),
+          pseudonym=COALESCE(NULLIF(wallets.pseudonym, ''), excluded.pseudonym)
+        WHERE (COALESCE(wallets.name, '') = '' AND excluded.name != '')
+           OR (COALESCE(wallets.pseudonym, '') = '' AND excluded.pseudonym != '')
+        """,
+        [(w, p[0], p[1]) for w, p in profiles.items()],
+    )
+    return _select_ids(conn, "SELECT proxy_wallet, wallet_id FROM wallets WHERE proxy_wallet IN ({})", profiles)
+
+
+def _resolve_market_keys(conn: sqlite3.Connection, trades: list[Trade]) -> dict[str, int]:
+    markets: dict[str, list[str]] = {}
+    for t in trades:
+        mk = markets.get(t.condition_id)
+        if mk is None:
+            markets[t.condition_id] = [t.market_slug or "", t.market_title or ""]
+            continue
+        if not mk[0] and t.market_slug:
+            mk[0] = t.market_slug
+        if not mk[1] and t.market_title:
+            mk[1] = t.market_title
+
+    conn.executemany(
+        """
+        INSERT INTO trade_markets(condition_id, slug, title)
+        VALUES(?, ?, ?)
+        ON CONFLICT(condition_id) DO UPDATE SET
+          slug=COALESCE(NULLIF(trade_markets.slug, ''), excluded.slug),
+          title=COALESCE(NULLIF(trade_markets.title, ''), excluded.title)
+        WHERE (COALESCE(trade_markets.slug, '') = '' AND excluded.slug != '')
+           OR (COALESCE(trade_markets.title, '') = '' AND excluded.title != '')
+        """,
+        [(cid, m[0], m[1]) for cid, m in markets.items()],
+    )
+    return _select_ids(conn, "SELECT condition_id, market_key FROM trade_markets WHERE condition_id IN ({})", markets)
+
+
+def _select_ids(conn: sqlite3.Connection, sql_tpl: str, keys: Iterable[str]) -> dict[str, int]:
+    keys = list(keys)
+    out: dict[str, int] = {}
+    for i in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[i:i + _IN_CHUNK]
+        sql = sql_tpl.format(", ".join("?" * len(chunk)))
+        for k, v in conn.execute(sql, chunk):
+            out[k] = int(v)
+    return out
+
+
 def insert_trades(
     conn: sqlite3.Connection,
     *,
@@ -131,30 +674,36 @@ def insert_trades(
 ) -> DbStats:
     sql = """
     INSERT OR IGNORE INTO trades(
-      event_id,
-      condition_id, market_slug, market_title,
-      proxy_wallet, name, pseudonym,
+      event_id, market_key, wallet_id,
       side, outcome, outcome_index,
-      size, price, timestamp, tx_hash
+      size, price, timestamp, tx_hash,
+      dedup_key
     ) VALUES (
-      ?, ?, ?, ?,
       ?, ?, ?,
       ?, ?, ?,
-      ?, ?, ?, ?
+      ?, ?, ?, ?,
+      ?
     )
     """
 
+    trades = list(trades)
+    if not trades:
+        return DbStats(inserted=0, ignored=0)
+
+    wallet_ids = _resolve_wallet_ids(conn, trades)
+    market_keys = _resolve_market_keys(conn, trades)
+
+    # мы уже в транзакции записи (upsert справочников выше), так что всё с id > high_water
+    # после вставки — ровно новые строки этой пачки (AUTOINCREMENT не переиспользует id)
+    high_water = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM trades").fetchone()[0])
+
     data = []
     for t in trades:
         data.append(
             (
                 int(event_id),
-                t.condition_id,
-                t.market_slug,
-                t.market_title,
-                t.proxy_wallet,
-                t.name,
-                t.pseudonym,
+                market_keys[t.condition_id],
+                wallet_ids[t.proxy_wallet],
                 t.side,
                 t.outcome,
                 int(t.outcome_index) if t.outcome_index is not None else None,
@@ -162,6 +711,7 @@ def insert_trades(
                 float(t.price),
                 int(t.timestamp),
                 t.tx_hash,
+                trade_dedup_key(event_id, t),
             )
         )
 
@@ -171,9 +721,56 @@ def insert_trades(
 
     inserted = after - before
     ignored = max(0, len(data) - inserted)
+
+    if inserted:
+        _fold_aggregates(conn, event_id=int(event_id), after_id=high_water)
+
     return DbStats(inserted=inserted, ignored=ignored)
 
 
+def _fold_aggregates(conn: sqlite3.Connection, *, event_id: int, after_id: int) -> None:
+    conn.execute(_FOLD_PARTICIPANTS_SQL, (event_id, after_id))
+    conn.execute(_FOLD_MARKETS_SQL, (event_id, after_id))
+
+
+def rebuild_event_aggregates(conn: sqlite3.Connection, *, event_id: int) -> None:
+    """Пересчитать агрегаты ивента с нуля (миграция / ручной ремонт). Коммит — на вызывающем."""
+    conn.execute("DELETE FROM participant_totals WHERE event_id=?", (int(event_id),))
+    conn.execute("DELETE FROM market_totals WHERE event_id=?", (int(event_id),))
+    _fold_aggregates(conn, event_id=int(event_id), after_id=0)
+
+
+def purge_event_trades(conn: sqlite3.Connection, *, event_id: int) -> None:
+    """
+    Удалить трейды ивента, его агрегаты и состояние синхронизации (сменился
+    режим takerOnly или фильтр рынков: старая история другая). id трейдов не
+    переиспользуются (AUTOINCREMENT) — кэши по high-water id видят удаление
+    через has_trade_id.
+    Коммит — на вызывающем.
+    """
+    conn.execute("DELETE FROM trades WHERE event_id=?", (int(event_id),))
+    conn.execute("DELETE FROM participant_totals WHERE event_id=?", (int(event_id),))
+    conn.execute("DELETE FROM market_totals WHERE event_id=?", (int(event_id),))
+    conn.execute("DELETE FROM event_sync WHERE event_id=?", (int(event_id),))
+
+
+def has_trade_id(conn: sqlite3.Connection, *, event_id: int, trade_id: int) -> bool:
+    """Есть ли ещё трейд trade_id у ивента (0 — пустая история, всегда True)."""
+    if int(trade_id) <= 0:
+        return True
+    row = conn.execute("SELECT event_id FROM trades WHERE id=?", (int(trade_id),)).fetchone()
+    return row is not None and int(row[0]) == int(event_id)
+
+
+def max_trade_id(conn: sqlite3.Connection, *, event_id: int, after_id: int = 0) -> int:
+    """id последнего трейда ивента (high-water mark); after_id — известная нижняя граница."""
+    row = conn.execute(
+        "SELECT MAX(id) FROM trades WHERE id>? AND +event_id=?",
+        (int(after_id), int(event_id)),
+    ).fetchone()
+    return int(row[0]) if row and row[0] is not None else int(after_id)
+
+
 def count_trades(conn: sqlite3.Connection, *, event_id: int) -> int:
     row = conn.execute(
         "SELECT COUNT(1) AS c FROM trades WHERE event_id=?",
@@ -182,54 +779,208 @@ def count_trades(conn: sqlite3.Connection, *, event_id: int) -> int:
     return int(row["c"])
 
 
-def iter_trades_from_db(
+# порядок колонок в TradeBatch.columns / строках iter_trade_batches
+TRADE_BATCH_COLUMNS = (
+    "id",
+    "condition_id", "market_slug", "market_title",
+    "proxy_wallet", "name", "pseudonym",
+    "side", "outcome", "outcome_index",
+    "size", "price", "timestamp", "tx_hash",
+)
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+@dataclass(frozen=True)
+class TradeBatch:
+    """
+    Пачка трейдов в колоночном виде: columns[i] — кортеж значений колонки
+    TRADE_BATCH_COLUMNS[i]. last_id — для keyset-продолжения (after_id=last_id).
+    """
+    columns: tuple[tuple, ...]
+    last_id: int
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name: str) -> tuple:
+        return self.columns[TRADE_BATCH_COLUMNS.index(name)]
+
+
+def iter_trade_batches(
     conn: sqlite3.Connection,
     *,
     event_id: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
     condition_id: Optional[str] = None,
-) -> Iterator[Trade]:
-    if condition_id:
-        cur = conn.execute(
-            """
-            SELECT
-              condition_id, market_slug, market_title,
-              proxy_wallet, name, pseudonym,
-              side, outcome, outcome_index,
-              size, price, timestamp, tx_hash
-            FROM trades
-            WHERE event_id=? AND condition_id=?
-            ORDER BY id
-            """,
-            (int(event_id), condition_id),
-        )
+    since_ts: Optional[int] = None,
+    until_ts: Optional[int] = None,
+    wallets: Optional[Iterable[str]] = None,
+    wallet_partition: Optional[tuple[int, int]] = None,
+    after_id: int = 0,
+    as_rows: bool = False,
+) -> Iterator[TradeBatch] | Iterator[list[tuple]]:
+    """
+    Читает трейды ивента пачками по batch_size через fetchmany, без sqlite3.Row
+    и без объекта на строку. Порядок — по t.id, так что (after_id=batch.last_id)
+    продолжает чтение с места остановки даже в новом соединении/транзакции.
+
+    since_ts / until_ts — полуинтервал [since_ts, until_ts) по timestamp трейда.
+    wallets — только эти proxy_wallet.
+    wallet_partition=(k, n) — только кошельки с wallet_id % n == k (разбиение по кошелькам).
+    as_rows=True отдаёт сами строки-кортежи (list[tuple]) вместо TradeBatch.
+    NULL-ы текстовых и числовых полей приводятся к "" / 0 в самом SQL.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be > 0")
+
+    sql = """
+    SELECT
+      t.id,
+      m.condition_id, COALESCE(m.slug, ''), COALESCE(m.title, ''),
+      w.proxy_wallet, COALESCE(w.name, ''), COALESCE(w.pseudonym, ''),
+      COALESCE(t.side, ''), COALESCE(t.outcome, ''), t.outcome_index,
+      COALESCE(t.size, 0.0), COALESCE(t.price, 0.0), COALESCE(t.timestamp, 0), COALESCE(t.tx_hash, '')
+    FROM trades AS t
+    JOIN trade_markets AS m ON m.market_key = t.market_key
+    JOIN wallets AS w ON w.wallet_id = t.wallet_id
+    """
+    if after_id:
+        # продолжение: "+t.event_id" — идём по диапазону rowid от after_id,
+        # а не по индексу всего ивента (см. _FOLD_PARTICIPANTS_SQL)
+        sql += " WHERE t.id>? AND +t.event_id=?"
+        params: list = [int(after_id), int(event_id)]
     else:
-        cur = conn.execute(
-            """
-            SELECT
-              condition_id, market_slug, market_title,
-              proxy_wallet, name, pseudonym,
-              side, outcome, outcome_index,
-              size, price, timestamp, tx_hash
-            FROM trades
-            WHERE event_id=?
-            ORDER BY id
-            """,
-            (int(event_id),),
-        )
+        sql += " WHERE t.event_id=?"
+        params = [int(event_id)]
 
-    for r in cur:
-        yield Trade(
-            condition_id=str(r["condition_id"] or ""),
-            market_slug=str(r["market_slug"] or ""),
-            market_title=str(r["market_title"] or ""),
-            proxy_wallet=str(r["proxy_wallet"] or ""),
-            name=str(r["name"] or ""),
-            pseudonym=str(r["pseudonym"] or ""),
-            side=str(r["side"] or ""),
-            outcome=str(r["outcome"] or ""),
-            outcome_index=r["outcome_index"],
-            size=float(r["size"] or 0.0),
-            price=float(r["price"] or 0.0),
-            timestamp=int(r["timestamp"] or 0),
-            tx_hash=str(r["tx_hash"] or ""),
+    if condition_id:
+        sql += " AND m.condition_id=?"
+        params.append(condition_id)
+    if since_ts is not None:
+        sql += " AND t.timestamp>=?"
+        params.append(int(since_ts))
+    if until_ts is not None:
+        sql += " AND t.timestamp<?"
+        params.append(int(until_ts))
+    if wallets is not None:
+        wallet_ids = _select_ids(
+            conn, "SELECT proxy_wallet, wallet_id FROM wallets WHERE proxy_wallet IN ({})", set(wallets)
         )
+        if not wallet_ids:
+            return
+        # id — наши же int-ы из БД, их можно подставить прямо в текст запроса
+        sql += " AND t.wallet_id IN ({})".format(", ".join(str(i) for i in sorted(wallet_ids.values())))
+
+    if wallet_partition is not None:
+        part, parts = wallet_partition
+        sql += " AND t.wallet_id % ? = ?"
+        params.extend([int(parts), int(part)])
+
+    sql += " ORDER BY t.id"
+
+    cur = conn.cursor()
+    cur.row_factory = None  # голые кортежи даже если у соединения sqlite3.Row
+    cur.arraysize = batch_size
+    cur.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            if as_rows:
+                yield rows
+            else:
+                yield TradeBatch(columns=tuple(zip(*rows)), last_id=int(rows[-1][0]))
+    finally:
+        cur.close()
+
+
+def iter_trades_from_db(
+    conn: sqlite3.Connection,
+    *,
+    event_id: int,
+    condition_id: Optional[str] = None,
+    after_id: int = 0,
+) -> Iterator[Trade]:
+    rows_iter = iter_trade_batches(conn, event_id=event_id, condition_id=condition_id, after_id=after_id, as_rows=True)
+    for rows in rows_iter:
+        for r in rows:
+            yield Trade(
+                condition_id=r[1],
+                market_slug=r[2],
+                market_title=r[3],
+                proxy_wallet=r[4],
+                name=r[5],
+                pseudonym=r[6],
+                side=r[7],
+                outcome=r[8],
+                outcome_index=r[9],
+                size=float(r[10]),
+                price=float(r[11]),
+                timestamp=int(r[12]),
+                tx_hash=r[13],
+            )
+
+
+# ---------- итоги ивента (participant_totals / market_totals) ----------
+# Сборку EventReportData из этих строк делает app/services/db_aggregator.
+
+
+def iter_market_totals(conn: sqlite3.Connection, *, event_id: int) -> Iterator[tuple]:
+    """(condition_id, slug, title, trades_count, buy_usd, sell_usd, turnover_usd) по рынкам ивента."""
+    return conn.execute(
+        """
+        SELECT m.condition_id, m.slug, m.title, a.trades_count, a.buy_usd, a.sell_usd, a.turnover_usd
+        FROM market_totals AS a
+        JOIN trade_markets AS m ON m.market_key = a.market_key
+        WHERE a.event_id=?
+        """,
+        (int(event_id),),
+    )
+
+
+def iter_participant_totals(conn: sqlite3.Connection, *, event_id: int) -> Iterator[tuple]:
+    """
+    (condition_id, proxy_wallet, name, pseudonym, outcome, buy_shares, buy_usd,
+     sell_shares, sell_usd, trades_count, first_ts, last_ts) по участникам ивента.
+    """
+    return conn.execute(
+        """
+        SELECT
+          m.condition_id, w.proxy_wallet, w.name, w.pseudonym, a.outcome,
+          a.buy_shares, a.buy_usd, a.sell_shares, a.sell_usd,
+          a.trades_count, a.first_ts, a.last_ts
+        FROM participant_totals AS a
+        JOIN trade_markets AS m ON m.market_key = a.market_key
+        JOIN wallets AS w ON w.wallet_id = a.wallet_id
+        WHERE a.event_id=?
+        """,
+        (int(event_id),),
+    )
+
+
+def count_participants(conn: sqlite3.Connection, *, event_id: int) -> int:
+    (n,) = conn.execute("SELECT COUNT(*) FROM participant_totals WHERE event_id=?", (int(event_id),)).fetchone()
+    return int(n)
+
+
+def iter_market_trader_counts(conn: sqlite3.Connection, *, event_id: int) -> Iterator[tuple[str, int]]:
+    """(condition_id, число разных кошельков) по рынкам ивента."""
+    return conn.execute(
+        """
+        SELECT m.condition_id, COUNT(DISTINCT a.wallet_id)
+        FROM participant_totals AS a
+        JOIN trade_markets AS m ON m.market_key = a.market_key
+        WHERE a.event_id=?
+        GROUP BY a.market_key
+        """,
+        (int(event_id),),
+    )
+
+
+def count_event_traders(conn: sqlite3.Connection, *, event_id: int) -> int:
+    (n,) = conn.execute(
+        "SELECT COUNT(DISTINCT wallet_id) FROM participant_totals WHERE event_id=?", (int(event_id),)
+    ).fetchone()
+    return int(n)
@@ -0,0 +1,386 @@
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+log = logging.getLogger(__name__)
+
+# Append-only лог сырых трейдов Data API: первая, дешёвая точка записи.
+# Дальше (Postgres, окна, алерты) читают его с любого offset-а.
+#
+#   <dir>/segment_<base_offset:020d>.log   заголовок + записи фиксированной длины
+#   <dir>/index.json                       сегменты: base_offset, records, first_ts, last_ts
+#   <dir>/consumers/<name>.offset          закоммиченный offset потребителя
+#
+# Запись (little-endian, 148 байт):
+#   crc32(остальной записи) u32 | timestamp i64 | size f64 | price f64 |
+#   side i8 | outcome_index i8 | pad 2 | wallet 20s | condition_id 32s |
+#   asset (uint256 token id) 32s | tx_hash 32s
+
+_RECORD = struct.Struct("<Iqddbb2x20s32s32s32s")
+RECORD_SIZE = _RECORD.size
+
+_MAGIC = b"PMTLOG1\0"
+_HEADER = struct.Struct("<8sI4x")  # magic, record size
+HEADER_SIZE = _HEADER.size
+
+_SIDES = {"BUY": 1, "SELL": -1}
+_SIDE_NAMES = {1: "BUY", -1: "SELL", 0: ""}
+
+
+class TradeLogEncodeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class TradeLogConfig:
+    # сколько записей в сегменте до ротации (~148 МБ)
+    segment_records: int = 1_000_000
+    # fsync группой: по числу записей или по времени, что раньше
+    group_records: int = 256
+    group_interval_s: float = 0.5
+
+
+def _hex_bytes(value: Any, width: int, field: str) -> bytes:
+    s = str(value or "")
+    if not s:
+        return b"\0" * width
+    if s[:2] in ("0x", "0X"):
+        s = s[2:]
+    try:
+        b = bytes.fromhex(s)
+    except ValueError as e:
+        raise TradeLogEncodeError(f"{field} is not hex: {value!r}") from e
+    if len(b) > width:
+        raise TradeLogEncodeError(f"{field} longer than {width} bytes: {value!r}")
+    return b.rjust(width, b"\0")
+
+
+def _bytes_hex(b: bytes, width: int) -> str:
+    if not any(b):
+        return ""
+    return "0x" + b[-width:].hex()
+
+
+def encode_trade(t: dict[str, Any]) -> bytes:
+    """Сырой dict Data API -> запись фиксированной длины."""
+    asset = str(t.get("asset") or "")
+    try:
+        asset_b = int(asset).to_bytes(32, "big") if asset else b"\0" * 32
+    except (ValueError, OverflowError) as e:
+        raise TradeLogEncodeError(f"asset is not uint256: {asset!r}") from e
+
+    oi = t.get("outcomeIndex")
+    body = _RECORD.pack(
+        0,
+        int(t.get("timestamp") or 0),
+        float(t.get("size") or 0.0),
+        float(t.get("price") or 0.0),
+        _SIDES.get(str(t.get("side") or "").upper(), 0),
+        int(oi) if oi is not None else -1,
+        _hex_bytes(t.get("proxyWallet"), 20, "proxyWallet"),
+        _hex_bytes(t.get("conditionId"), 32, "conditionId"),
+        asset_b,
+        _hex_bytes(t.get("transactionHash"), 32, "transactionHash"),
+    )
+    return struct.pack("<I", zlib.crc32(body[4:])) + body[4:]
+
+
+def decode_trade(rec: bytes) -> dict[str, Any] | None:
+    """Запись -> dict в формате Data API (поля, нужные normalize()). None — битая запись."""
+    crc, ts, size, price, side, oi, wallet, cid, asset, tx = _RECORD.unpack(rec)
+    if crc != zlib.crc32(rec[4:]):
+        return None
+    asset_i = int.from_bytes(asset, "big")
+    return {
+        "proxyWallet": _bytes_hex(wallet, 20),
+        "conditionId": _bytes_hex(cid, 32),
+        "asset": str(asset_i) if asset_i else "",
+        "side": _SIDE_NAMES.get(side, ""),
+        "outcomeIndex": oi if oi >= 0 else None,
+        "size": size,
+        "price": price,
+        "timestamp": ts,
+        "transactionHash": _bytes_hex(tx, 32),
+    }
+
+
+@dataclass
+class _Segment:
+    base_offset: int
+    path: Path
+    records: int
+    first_ts: int | None = None
+    last_ts: int | None = None
+
+
+class TradeLog:
+    """
+    Писатель и читатель лога. Писатель в процессе должен быть один
+    (лог рассчитан на single-writer / many-readers).
+    """
+
+    def __init__(self, log_dir: str | Path, cfg: TradeLogConfig | None = None) -> None:
+        self.dir = Path(log_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.cfg = cfg or TradeLogConfig()
+
+        self._segments: list[_Segment] = self._scan_segments()
+        self._fh = None
+        self._pending: list[bytes] = []
+        self._pending_ts: list[int] = []
+        self._last_sync = time.monotonic()
+
+    # ---------- layout ----------
+    def _segment_path(self, base_offset: int) -> Path:
+        return self.dir / f"segment_{base_offset:020d}.log"
+
+    def _scan_segments(self, *, recover: bool = True) -> list[_Segment]:
+        # recover=False — для читателей: чужой недописанный хвост не трогаем
+        index = self._read_index()
+        segments: list[_Segment] = []
+        for p in sorted(self.dir.glob("segment_*.log")):
+            base = int(p.stem.split("_", 1)[1])
+            if recover:
+                records = self._recover_tail(p)
+            else:
+                records = max(0, (p.stat().st_size - HEADER_SIZE) // RECORD_SIZE)
+            meta = index.get(base, {})
+            segments.append(
+                _Segment(
+                    base_offset=base,
+                    path=p,
+                    records=records,
+                    first_ts=meta.get("first_ts"),
+                    last_ts=meta.get("last_ts"),
+                )
+            )
+        return segments
+
+    def _read_index(self) -> dict[int, dict]:
+        try:
+            data = json.loads((self.dir / "index.json").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {int(s["base_offset"]): s for s in data.get("segments", [])}
+
+    def _write_index(self) -> None:
+        data = {
+            "record_size": RECORD_SIZE,
+            "segments": [
+                {
+                    "file": s.path.name,
+                    "base_offset": s.base_offset,
+                    "records": s.records,
+                    "first_ts": s.first_ts,
+                    "last_ts": s.last_ts,
+                }
+                for s in self._segments
+            ],
+        }
+        tmp = self.dir / "index.json.tmp"
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        os.replace(tmp, self.dir / "index.json")
+
+    @staticmethod
+    def _recover_tail(path: Path) -> int:
+        """Обрезает недописанный хвост (крах посреди записи). Возвращает число целых записей."""
+        size = path.stat().st_size
+        if size < HEADER_SIZE:
+            with path.open("r+b") as f:
+                f.truncate(0)
+                f.write(_HEADER.pack(_MAGIC, RECORD_SIZE))
+            return 0
+
+        records = (size - HEADER_SIZE) // RECORD_SIZE
+        with path.open("r+b") as f:
+            magic, rec_size = _HEADER.unpack(f.read(HEADER_SIZE))
+            if magic != _MAGIC or rec_size != RECORD_SIZE:
+                raise ValueError(f"not a trade log segment: {path}")
+
+            # с конца отбрасываем записи с битым crc
+            while records > 0:
+                f.seek(HEADER_SIZE + (records - 1) * RECORD_SIZE)
+                if decode_trade(f.read(RECORD_SIZE)) is not None:
+                    break
+                records -= 1
+
+            end = HEADER_SIZE + records * RECORD_SIZE
+            if end != size:
+                log.warning("trade log: truncating torn tail of %s (%s -> %s bytes)", path.name, size, end)
+                f.truncate(end)
+        return records
+
+    @property
+    def next_offset(self) -> int:
+        if not self._segments:
+            return len(self._pending)
+        last = self._segments[-1]
+        return last.base_offset + last.records + len(self._pending)
+
+    # ---------- write ----------
+    def append(self, raw_trade: dict[str, Any]) -> int:
+        """Кладёт трейд в буфер группы; возвращает присвоенный offset. Долговечен после sync()."""
+        rec = encode_trade(raw_trade)
+        offset = self.next_offset
+        self._pending.append(rec)
+        self._pending_ts.append(int(raw_trade.get("timestamp") or 0))
+
+        if len(self._pending) >= self.cfg.group_records or (
+            time.monotonic() - self._last_sync >= self.cfg.group_interval_s
+        ):
+            self.sync()
+        return offset
+
+    def append_many(self, raw_trades: Iterable[dict[str, Any]]) -> tuple[int, int]:
+        """Возвращает (первый offset, сколько записали). Нераспознанные трейды пропускаются с warning."""
+        first = self.next_offset
+        n = 0
+        for t in raw_trades:
+            try:
+                self.append(t)
+            except TradeLogEncodeError as e:
+                log.warning("trade log: skip trade: %s", e)
+                continue
+            n += 1
+        return first, n
+
+    def sync(self) -> None:
+        """Пишет группу в активный сегмент (с ротацией) и делает один fsync."""
+        if not self._pending:
+            self._last_sync = time.monotonic()
+            return
+
+        pending, pending_ts = self._pending, self._pending_ts
+        self._pending, self._pending_ts = [], []
+
+        i = 0
+        rotated = False
+        while i < len(pending):
+            seg = self._active_segment()
+            room = self.cfg.segment_records - seg.records
+            if room <= 0:
+                self._close_active()
+                self._segments.append(self._new_segment(seg.base_offset + seg.records))
+                rotated = True
+                continue
+
+            chunk = pending[i:i + room]
+            chunk_ts = [ts for ts in pending_ts[i:i + room] if ts]
+            self._fh.write(b"".join(chunk))
+            seg.records += len(chunk)
+            if chunk_ts:
+                lo, hi = min(chunk_ts), max(chunk_ts)
+                seg.first_ts = lo if seg.first_ts is None else min(seg.first_ts, lo)
+                seg.last_ts = hi if seg.last_ts is None else max(seg.last_ts, hi)
+            i += len(chunk)
+
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._last_sync = time.monotonic()
+
+        if rotated:
+            self._write_index()
+
+    def _active_segment(self) -> _Segment:
+        if not self._segments:
+            self._segments.append(self._new_segment(0))
+            self._write_index()
+        seg = self._segments[-1]
+        if self._fh is None:
+            self._fh = seg.path.open("ab")
+        return seg
+
+    def _new_segment(self, base_offset: int) -> _Segment:
+        path = self._segment_path(base_offset)
+        with path.open("wb") as f:
+            f.write(_HEADER.pack(_MAGIC, RECORD_SIZE))
+            f.flush()
+            os.fsync(f.fileno())
+        return _Segment(base_offset=base_offset, path=path, records=0)
+
+    def _close_active(self) -> None:
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+
+    def close(self) -> None:
+        self.sync()
+        self._close_active()
+        if self._segments:
+            self._write_index()
+
+    def __enter__(self) -> "TradeLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ---------- read ----------
+    def read(self, from_offset: int = 0, *, limit: int | None = None) -> Iterator[tuple[int, dict[str, Any]]]:
+        """
+        (offset, raw_trade) начиная с from_offset. Видно только то, что уже на диске
+        (после sync). Читать можно и из другого процесса: TradeLog(dir).read(...).
+        """
+        segments = self._scan_segments(recover=False)
+        if not segments:
+            return
+        bases = [s.base_offset for s in segments]
+        i = max(0, bisect.bisect_right(bases, from_offset) - 1)
+
+        offset = max(from_offset, segments[0].base_offset)
+        left = limit
+        for seg in segments[i:]:
+            n_records = (seg.path.stat().st_size - HEADER_SIZE) // RECORD_SIZE
+            if offset >= seg.base_offset + n_records:
+                continue
+            with seg.path.open("rb") as f:
+                f.seek(HEADER_SIZE + (offset - seg.base_offset) * RECORD_SIZE)
+                while offset < seg.base_offset + n_records:
+                    want = seg.base_offset + n_records - offset
+                    if left is not None:
+                        want = min(want, left)
+                    buf = f.read(min(want, 4096) * RECORD_SIZE)
+                    if len(buf) < RECORD_SIZE:
+                        break
+                    for j in range(0, len(buf) - RECORD_SIZE + 1, RECORD_SIZE):
+                        t = decode_trade(buf[j:j + RECORD_SIZE])
+                        if t is None:
+                            # хвост, который писатель ещё дописывает
+                            return
+                        yield offset, t
+                        offset += 1
+                        if left is not None:
+                            left -= 1
+                            if left <= 0:
+                                return
+
+
+def _consumer_path(log_dir: str | Path, consumer: str) -> Path:
+    return Path(log_dir) / "consumers" / f"{consumer}.offset"
+
+
+def load_consumer_offset(log_dir: str | Path, consumer: str) -> int:
+    try:
+        return int(_consumer_path(log_dir, consumer).read_text(encoding="utf-8").strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def commit_consumer_offset(log_dir: str | Path, consumer: str, offset: int) -> None:
+    """offset — следующая непрочитанная запись."""
+    path = _consumer_path(log_dir, consumer)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(str(int(offset)), encoding="utf-8")
+    os.replace(tmp, path)
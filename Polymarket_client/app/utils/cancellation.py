@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Iterable, Iterator, TypeVar
+
+# Кооперативная отмена долгих операций (выгрузка из API, агрегация, экспорт).
+#
+# Код, который долго работает, периодически вызывает token.raise_if_cancelled()
+# (на границе страницы API, куска трейдов, листа отчёта) и спит через
+# token.sleep() — такой сон прерывается сразу при отмене. Отменивший
+# вызывает token.cancel(); операция выходит исключением OperationCancelled.
+#
+# По умолчанию токен держит threading.Event (потоки одного процесса). Для
+# работы в пуле процессов нужен Event, который переживает pickle, —
+# CancelToken.for_processes(multiprocessing.Manager()).
+
+# как часто горячие циклы (по трейдам / строкам) смотрят на токен
+CHECK_EVERY = 4096
+
+T = TypeVar("T")
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    __slots__ = ("_event",)
+
+    def __init__(self, event=None) -> None:
+        # любой объект с set() / is_set() / wait(timeout) — threading.Event или прокси Manager().Event()
+        self._event = event if event is not None else threading.Event()
+
+    @classmethod
+    def for_processes(cls, manager) -> "CancelToken":
+        return cls(manager.Event())
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise OperationCancelled("operation cancelled")
+
+    def sleep(self, seconds: float) -> None:
+        """time.sleep, который прерывается отменой (OperationCancelled)."""
+        if seconds <= 0:
+            self.raise_if_cancelled()
+            return
+        if self._event.wait(seconds):
+            raise OperationCancelled("operation cancelled")
+
+    def __getstate__(self):
+        return self._event
+
+    def __setstate__(self, event) -> None:
+        self._event = event
+
+    def __repr__(self) -> str:
+        return f"CancelToken(cancelled={self.cancelled})"
+
+
+def sleep(seconds: float, cancel: CancelToken | None = None) -> None:
+    """Сон с учётом токена; без токена — обычный time.sleep."""
+    if cancel is not None:
+        cancel.sleep(seconds)
+    elif seconds > 0:
+        time.sleep(seconds)
+
+
+def checked(items: Iterable[T], cancel: CancelToken | None, every: int = CHECK_EVERY) -> Iterator[T]:
+    """Пропускает items как есть, проверяя токен перед первым и каждым every-м элементом."""
+    if cancel is None:
+        yield from items
+        return
+    for i, item in enumerate(items):
+        if i % every == 0:
+            cancel.raise_if_cancelled()
+        yield item
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Эксклюзивная блокировка "на файл": потоки своего процесса — через
+# threading.Lock на путь, другие процессы (пул отчётов бота, CLI) — через
+# flock на сам файл. Без fcntl (Windows) — только потоки своего процесса.
+
+_guard = threading.Lock()
+_thread_locks: dict[str, threading.Lock] = {}
+
+
+@contextmanager
+def file_lock(path: str | Path) -> Iterator[None]:
+    """Держит блокировку path (файл и папка создаются) на время with."""
+    path = Path(path).resolve()
+    with _guard:
+        lock = _thread_locks.get(str(path))
+        if lock is None:
+            lock = _thread_locks[str(path)] = threading.Lock()
+
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import hashlib
+import math
+from typing import Iterable
+
+# HyperLogLog для приблизительного числа уникальных строк (кошельков).
+#
+# Пока элементов мало (до sparse_limit), держим их точным set-ом — маленькие
+# рынки считаются без ошибки и не тратят 2^p байт. Дальше — регистры
+# bytearray(2^p), стандартная ошибка ~1.04 / sqrt(2^p) (p=12: ~1.6%, 4 KiB).
+# Объединение (|=) — поэлементный max регистров, т.е. ассоциативно.
+
+DEFAULT_PRECISION = 12
+
+_HASH_BITS = 64
+
+
+def _hash64(item: str) -> int:
+    # hash() строк рандомизирован между процессами — для слияния из пула не годится
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    __slots__ = ("p", "sparse_limit", "_exact", "_registers")
+
+    def __init__(self, p: int = DEFAULT_PRECISION, *, sparse_limit: int | None = None) -> None:
+        if not 4 <= p <= 18:
+            raise ValueError("p must be in [4, 18]")
+        self.p = p
+        # до 2^p/8 элементов считаем точно: на маленьких рынках ошибка HLL заметнее всего
+        self.sparse_limit = (1 << p) // 8 if sparse_limit is None else sparse_limit
+        self._exact: set[str] | None = set()
+        self._registers: bytearray | None = None
+
+    # ---------- заполнение ----------
+    def add(self, item: str) -> None:
+        if self._exact is not None:
+            self._exact.add(item)
+            if len(self._exact) > self.sparse_limit:
+                self._densify()
+            return
+        self._add_hash(_hash64(item))
+
+    def update(self, items: Iterable[str]) -> None:
+        for item in items:
+            self.add(item)
+
+    def _add_hash(self, h: int) -> None:
+        idx = h & ((1 << self.p) - 1)
+        w = h >> self.p
+        rank = (_HASH_BITS - self.p) - w.bit_length() + 1
+        regs = self._registers
+        if rank > regs[idx]:
+            regs[idx] = rank
+
+    def _densify(self) -> None:
+        exact, self._exact = self._exact, None
+        self._registers = bytearray(1 << self.p)
+        for item in exact or ():
+            self._add_hash(_hash64(item))
+
+    # ---------- оценка ----------
+    def __len__(self) -> int:
+        if self._exact is not None:
+            return len(self._exact)
+
+        m = 1 << self.p
+        regs = self._registers
+        zeros = regs.count(0)
+        raw = _alpha(m) * m * m / sum(2.0 ** -r for r in regs)
+        if raw <= 2.5 * m and zeros:
+            # малый диапазон — linear counting
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    @property
+    def is_exact(self) -> bool:
+        return self._exact is not None
+
+    # ---------- слияние ----------
+    def __ior__(self, other: "HyperLogLog | set[str]") -> "HyperLogLog":
+        if isinstance(other, (set, frozenset)):
+            self.update(other)
+            return self
+        if other.p != self.p:
+            raise ValueError("cannot merge HyperLogLog with different precision")
+        if other._exact is not None:
+            self.update(other._exact)
+            return self
+        if self._exact is not None:
+            self._densify()
+        regs = self._registers
+        for i, r in enumerate(other._registers):
+            if r > regs[i]:
+                regs[i] = r
+        return self
+
+    def __or__(self, other: "HyperLogLog | set[str]") -> "HyperLogLog":
+        out = self.copy()
+        out |= other
+        return out
+
+    def copy(self) -> "HyperLogLog":
+        out = HyperLogLog(self.p, sparse_limit=self.sparse_limit)
+        if self._exact is not None:
+            out._exact = set(self._exact)
+        else:
+            out._exact = None
+            out._registers = bytearray(self._registers)
+        return out
+
+    # ---------- сериализация (снапшоты) ----------
+    def to_state(self) -> dict:
+        if self._exact is not None:
+            return {"p": self.p, "sparse_limit": self.sparse_limit, "exact": sorted(self._exact)}
+        return {"p": self.p, "sparse_limit": self.sparse_limit, "registers": self._registers.hex()}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "HyperLogLog":
+        out = cls(int(state["p"]), sparse_limit=int(state["sparse_limit"]))
+        if "exact" in state:
+            out._exact = set(state["exact"])
+        else:
+            out._exact = None
+            out._registers = bytearray.fromhex(state["registers"])
+        return out
+
+    def __repr__(self) -> str:
+        kind = "exact" if self._exact is not None else f"p={self.p}"
+        return f"HyperLogLog({kind}, ~{len(self)})"
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
@@ -13,6 +13,20 @@ class ProgressConfig:
     # минимальный интервал между сообщениями (защита от спама)
     min_interval_s: float = 1.5
 
+    # ETA показываем, только когда пройдено хотя бы столько (раньше оценка скачет)
+    eta_min_fraction: float = 0.02
+
+
+def format_duration(seconds: float) -> str:
+    s = max(0, int(round(seconds)))
+    if s < 60:
+        return f"{s} с"
+    m, s = divmod(s, 60)
+    if m < 60:
+        return f"{m} мин {s:02d} с"
+    h, m = divmod(m, 60)
+    return f"{h} ч {m:02d} мин"
+
 
 class ProgressReporter:
     """
@@ -20,7 +34,13 @@ class ProgressReporter:
 
     emit: функция, которая принимает строку и куда-то её отправляет:
       - print(...) для консоли
-      - позже подключим в Telegram (send_message / edit_message_text)
+      - в Telegram — через общий state, который бот показывает edit_message_text
+        (см. tg_bot/handlers/reports/event_report_handler.py)
+
+    Прогресс внутри этапа: сколько обработано, скорость (с начала этапа) и,
+    если известна доля пройденного (fraction), оценка оставшегося времени.
+    Сообщения чаще min_interval_s не уходят — промежуточные просто
+    пропускаются, следующее несёт актуальные цифры.
     """
     def __init__(self, emit: Callable[[str], None], cfg: Optional[ProgressConfig] = None) -> None:
         self.emit = emit
@@ -30,18 +50,29 @@ class ProgressReporter:
         self._last_trades_notified: int = 0
 
         self._current_stage: str = ""
+        self._stage_started_ts: float = time.time()
 
     def stage(self, name: str) -> None:
         self._current_stage = name
+        self._stage_started_ts = time.time()
+        self._last_trades_notified = 0
         self._emit_now(f"Этап: {name}")
 
     def info(self, text: str) -> None:
         self._emit_now(text)
 
-    def trades_progress(self, processed_total: int, inserted_total: int | None = None) -> None:
+    def trades_progress(
+        self,
+        processed_total: int,
+        inserted_total: int | None = None,
+        *,
+        fraction: float | None = None,
+        unit: str = "трейдов",
+    ) -> None:
         """
         Вызывай после каждой пачки.
         Пишет прогресс каждые cfg.trades_step обработанных трейдов.
+        fraction — доля этапа, пройденная к этому моменту (0..1), для ETA.
         """
         if processed_total < self._last_trades_notified + self.cfg.trades_step:
             return
@@ -51,10 +82,10 @@ class ProgressReporter:
 
         self._last_trades_notified = processed_total
 
-        if inserted_total is None:
-            self._emit_now(f"Обработано: {processed_total} трейдов…")
-        else:
-            self._emit_now(f"Обработано: {processed_total} трейдов… (в БД добавлено новых: {inserted_total})")
+        text = f"Обработано: {processed_total} {unit}…"
+        if inserted_total is not None:
+            text += f" (в БД добавлено новых: {inserted_total})"
+        self._emit_now(text + self._rate_eta(processed_total, fraction, unit))
 
     def done(self, excel_path: str | None = None) -> None:
         if excel_path:
@@ -66,6 +97,16 @@ class ProgressReporter:
         self._emit_now(f"Ошибка: {text}")
 
     # ---------- internal ----------
+    def _rate_eta(self, processed_total: int, fraction: float | None, unit: str) -> str:
+        elapsed = time.time() - self._stage_started_ts
+        if elapsed <= 0:
+            return ""
+        parts = [f"{processed_total / elapsed:.0f} {unit}/с"]
+        if fraction is not None and fraction >= self.cfg.eta_min_fraction:
+            fraction = min(1.0, fraction)
+            parts.append(f"осталось ~{format_duration(elapsed * (1.0 - fraction) / fraction)}")
+        return "\n" + " · ".join(parts)
+
     def _can_emit(self) -> bool:
         now = time.time()
         return (now - self._last_emit_ts) >= self.cfg.min_interval_s
@@ -1,6 +1,7 @@
 import json
 import subprocess
 from datetime import datetime, timezone
+from pathlib import Path
 
 from db.raw_trades_repo import save_raw_trade
 from app.state.user_state_updater import update_user_state
@@ -10,9 +11,19 @@ from db.trade_windows_repo import mark_window_alerted
 from app.rules_loader import load_rules
 from db.user_state_repo import get_user_state
 from app.alert_engine.alert_decider import should_alert
+from app.config_loader import load_yaml
+from app.market_filter import MarketFilter
+from app.notification.alert_outbox import Alert, open_alert_outbox
+from app.storage.trade_log import TradeLog, TradeLogConfig, commit_consumer_offset, load_consumer_offset
 
 
 TRADES_URL = "https://data-api.polymarket.com/trades?limit=25&offset=0&takerOnly=true"
+BASE_DIR = Path(__file__).resolve().parents[1]
+MARKETS_CONFIG = BASE_DIR / "config" / "markets.yaml"
+SETTINGS_CONFIG = BASE_DIR / "config" / "settings.yaml"
+
+# имя потребителя лога, под которым храним прочитанный offset
+LOG_CONSUMER = "ingest_once"
 
 
 def fetch_trades() -> list[dict]:
@@ -54,16 +65,55 @@ def normalize(t: dict) -> dict:
     }
 
 
+def open_trade_log() -> TradeLog:
+    settings = load_yaml(SETTINGS_CONFIG) or {}
+    cfg = settings.get("trade_log", {}) or {}
+    log_dir = Path(cfg.get("dir", "data/trade_log"))
+    if not log_dir.is_absolute():
+        log_dir = BASE_DIR / log_dir
+    return TradeLog(
+        log_dir,
+        TradeLogConfig(
+            segment_records=int(cfg.get("segment_records", 1_000_000)),
+            group_records=int(cfg.get("group_records", 256)),
+            group_interval_s=float(cfg.get("group_interval_s", 0.5)),
+        ),
+    )
+
+
 def main():
     rules = load_rules()  # грузим один раз
+    market_filter = MarketFilter(MARKETS_CONFIG)
 
     trades = fetch_trades()
     print("fetched:", len(trades))
 
+    # фильтруем по сырым dict-ам, до нормализации и похода в БД
+    trades = list(market_filter.filter_raw_trades(trades))
+    print("after market filter:", len(trades))
+
+    # 0) сначала — в append-only лог (одним fsync на пачку); всё остальное
+    #    дальше читает из лога с сохранённого offset-а, так что недообработанное
+    #    в прошлый раз (упали на Postgres) доедет сейчас
+    trade_log = open_trade_log()
+    first_offset, logged = trade_log.append_many(trades)
+    trade_log.sync()
+    print("logged:", logged, "from offset", first_offset)
+
+    # в лог пишутся не все поля Data API — событие и название рынка берём из свежей пачки
+    market_meta = {
+        str(t.get("conditionId") or "").lower(): (str(t.get("eventSlug") or ""), str(t.get("title") or ""))
+        for t in trades
+    }
+    alert_outbox = open_alert_outbox(SETTINGS_CONFIG)
+
     ok = 0
     skipped_existing = 0
 
-    for t in trades:
+    consumer_offset = load_consumer_offset(trade_log.dir, LOG_CONSUMER)
+    for offset, t in trade_log.read(consumer_offset):
+        # offset коммитим до обработки следующей записи: повтор безопасен (ON CONFLICT по trade_id)
+        commit_consumer_offset(trade_log.dir, LOG_CONSUMER, offset)
         nt = normalize(t)
 
         if not nt["wallet_address"] or nt["notional"] is None or not nt["condition_id"]:
@@ -122,6 +172,26 @@ def main():
                     "reason",
                     decision.get("reason"),
                 )
+                # 5) в очередь бота — он разошлёт подписчикам рынка / события / кошелька
+                event_slug, market_title = market_meta.get(nt["condition_id"].lower(), ("", ""))
+                alert_outbox.put(
+                    Alert(
+                        alert_type=str(decision.get("alert_type") or ""),
+                        reason=str(decision.get("reason") or ""),
+                        wallet=nt["wallet_address"],
+                        condition_id=nt["condition_id"],
+                        side=nt["side"] or "",
+                        notional_usd=float(win["total_notional"]),
+                        trade_count=int(win["trade_count"]),
+                        window_start_ts=int(win["window_start_ts"].timestamp()),
+                        event_slug=event_slug,
+                        market_title=market_title,
+                    )
+                )
+
+    commit_consumer_offset(trade_log.dir, LOG_CONSUMER, trade_log.next_offset)
+    trade_log.close()
+    alert_outbox.close()
 
     print("processed:", ok, "skipped_existing:", skipped_existing)
 
@@ -2,37 +2,30 @@ from __future__ import annotations
 
 import argparse
 import sys
-from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
 
 from app.ingestion.event_resolver import resolve_event
-from app.ingestion.trades_loader import iter_event_trades, Trade
-from app.reporting.excel_exporter import export_event_report_xlsx
-from app.services.event_aggregator import aggregate_event
+from app.market_filter import MarketFilter
+from app.reporting.report_formats import DEFAULT_REPORT_FORMAT, REPORT_FORMATS, export_event_report, get_report_format
+from app.services.db_aggregator import aggregate_event_from_db
+from app.services.event_aggregator import COMPACT_MIN_PARTICIPANTS
+from app.services.event_report_service import aggregate_event_incremental, sync_event_trades, utc_now_str
+from app.services.parallel_aggregator import aggregate_event_parallel_from_db
+from app.services.vectorized_aggregator import aggregate_event_from_cache
+from app.storage.columnar_cache import default_cache_dir
 
-from app.storage.sqlite_event_store import (
-    ensure_db,
-    _connect,
-    upsert_event,
-    upsert_markets,
-    insert_trades,
-    count_trades,
-    iter_trades_from_db,
-)
+from app.storage.sqlite_connections import get_store
+from app.storage.sqlite_event_store import count_trades
 
 
 def log(msg: str) -> None:
     print(msg, flush=True)
 
 
-def utc_now_str() -> str:
-    return datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-
-
 def parse_args(argv: list[str]) -> argparse.Namespace:
     p = argparse.ArgumentParser(
-        description="Fetch event trades into SQLite, aggregate from DB, export XLSX."
+        description="Fetch event trades into SQLite, aggregate from DB, export XLSX (or another format)."
     )
     p.add_argument("event_url", help="https://polymarket.com/event/<slug>?tid=...")
     p.add_argument(
@@ -40,6 +33,17 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         default=str(Path.cwd() / "out"),
         help="Output directory (default: ./out)",
     )
+    p.add_argument(
+        "--db",
+        default=None,
+        help="Shared multi-event SQLite store (default: <out-dir>/events.sqlite)",
+    )
+    p.add_argument(
+        "--max-age",
+        type=float,
+        default=60.0,
+        help="Skip the API if the event was synced less than N seconds ago (default: 60)",
+    )
 
     # API page size (how many trades per API request)
     p.add_argument("--api-limit", type=int, default=500)
@@ -56,7 +60,58 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         help="Stop after cumulative abs(size) >= X (0 = no limit)",
     )
 
+    p.add_argument(
+        "--engine",
+        choices=("sql", "numpy", "parallel", "incremental"),
+        default="sql",
+        help=(
+            "sql = stored aggregates in SQLite; numpy = columnar cache + vectorized aggregation; "
+            "parallel = process pool over market/wallet partitions; "
+            "incremental = saved aggregation snapshot + trades newer than it"
+        ),
+    )
+    p.add_argument("--workers", type=int, default=0, help="Processes for --engine parallel (0 = all cores)")
+    p.add_argument(
+        "--partition-by",
+        choices=("condition_id", "wallet"),
+        default="condition_id",
+        help="How --engine parallel splits trades (default: condition_id)",
+    )
+
+    p.add_argument(
+        "--compact",
+        choices=("auto", "on", "off"),
+        default="auto",
+        help=(
+            "Keep participants in a columnar table instead of per-participant objects "
+            f"(--engine sql/incremental; auto = above {COMPACT_MIN_PARTICIPANTS} participants)"
+        ),
+    )
+    p.add_argument(
+        "--approx-traders",
+        action="store_true",
+        help="Count unique traders per market with HyperLogLog, ~1%% error (--engine incremental)",
+    )
+
+    p.add_argument(
+        "--format",
+        choices=tuple(REPORT_FORMATS),
+        default=DEFAULT_REPORT_FORMAT,
+        help="; ".join(f"{f.name} = {f.description}" for f in REPORT_FORMATS.values()),
+    )
+    p.add_argument(
+        "--top-k",
+        type=int,
+        default=0,
+        help="Per market sheet: only the top N participants plus an 'others' row (0 = all)",
+    )
+
     p.add_argument("--taker-only", action="store_true", help="Pass takerOnly=true to API")
+    p.add_argument(
+        "--markets-config",
+        default=None,
+        help="Path to markets.yaml; trades of filtered-out markets are dropped before DB insert",
+    )
 
     return p.parse_args(argv)
 
@@ -74,114 +129,103 @@ def main(argv: Optional[list[str]] = None) -> int:
     log(f"Event: {ev.title} (id={ev.event_id}, slug={ev.slug})")
     log(f"As of (UTC): {as_of}")
 
-    db_path = out_dir / f"event_{ev.slug}.sqlite"
-    xlsx_path = out_dir / f"event_{ev.slug}.xlsx"
-    xlsx_tmp_path = out_dir / f"event_{ev.slug}.xlsx.part"
+    db_path = Path(args.db) if args.db else out_dir / "events.sqlite"
+    report_format = get_report_format(args.format)
+    report_path = out_dir / f"event_{ev.slug}{report_format.extension}"
+    report_tmp_path = out_dir / f"event_{ev.slug}{report_format.extension}.part"
 
     log("2) DB created/opened...")
-    ensure_db(str(db_path))
-    conn = _connect(str(db_path))
+    store = get_store(db_path)
 
     try:
-        upsert_event(conn, ev)
-        upsert_markets(conn, ev)
-        conn.commit()
-
         # =========================
-        # Load trades -> DB
+        # Load trades -> DB (full history once, then deltas)
         # =========================
         log("3) Loading trades from API -> SQLite...")
 
-        buf: List[Trade] = []
-        fetched = 0
-        inserted_total = 0
-        ignored_total = 0
-        cum_shares = 0.0
+        market_filter = MarketFilter(Path(args.markets_config)) if args.markets_config else None
 
-        trades_iter = iter_event_trades(
-            ev.event_id,
-            limit=int(args.api_limit),
+        sync = sync_event_trades(
+            store,
+            ev,
+            max_age_s=float(args.max_age),
+            api_limit=int(args.api_limit),
+            chunk_size=int(args.chunk_size),
             taker_only=bool(args.taker_only),
+            # стор помнит фильтр (fingerprint): другой фильтр -> ивент выкачивается заново
+            raw_filter=market_filter.is_trade_allowed if market_filter and not market_filter.passes_all else None,
+            raw_filter_key=market_filter.fingerprint if market_filter else "",
+            max_trades=int(args.max_trades) or None,
+            max_shares=float(args.max_shares) or None,
+            log=log,
+        )
+        log(
+            f"   sync mode={sync.mode} fetched={sync.fetched} "
+            f"inserted={sync.inserted} ignored={sync.ignored} complete={sync.complete}"
         )
 
-        for tr in trades_iter:
-            fetched += 1
-            cum_shares += abs(float(tr.size or 0.0))
-            buf.append(tr)
-
-            if len(buf) >= int(args.chunk_size):
-                stats = insert_trades(conn, event_id=ev.event_id, trades=buf)
-                conn.commit()
-                inserted_total += stats.inserted
-                ignored_total += stats.ignored
-                buf.clear()
-                log(
-                    f"   +{args.chunk_size} fetched. total_fetched={fetched} "
-                    f"inserted={inserted_total} ignored={ignored_total} cum_shares≈{cum_shares:.4f}"
-                )
-
-            if args.max_trades and fetched >= int(args.max_trades):
-                log(f"   Reached --max-trades={args.max_trades}, stopping fetch.")
-                break
-
-            if args.max_shares and cum_shares >= float(args.max_shares):
-                log(f"   Reached --max-shares={args.max_shares}, stopping fetch.")
-                break
-
-        # flush leftovers
-        if buf:
-            stats = insert_trades(conn, event_id=ev.event_id, trades=buf)
-            conn.commit()
-            inserted_total += stats.inserted
-            ignored_total += stats.ignored
-            log(
-                f"   +{len(buf)} fetched. total_fetched={fetched} "
-                f"inserted={inserted_total} ignored={ignored_total} cum_shares≈{cum_shares:.4f}"
-            )
-            buf.clear()
-
-        in_db = count_trades(conn, event_id=ev.event_id)
+        with store.reader() as conn:
+            in_db = count_trades(conn, event_id=ev.event_id)
         log(f"DB filled. trades_in_db={in_db}")
 
         # =========================
         # Aggregate from DB
         # =========================
-        log("4) Aggregating from DB...")
-        report = aggregate_event(
-            ev,
-            iter_trades_from_db(conn, event_id=ev.event_id),
-            as_of_utc=as_of,
-        )
+        log(f"4) Aggregating from DB (engine={args.engine})...")
+        compact = {"auto": None, "on": True, "off": False}[args.compact]
+        if args.engine == "parallel":
+            report = aggregate_event_parallel_from_db(
+                db_path,
+                ev,
+                as_of_utc=as_of,
+                workers=int(args.workers) or None,
+                partition_by=args.partition_by,
+            )
+        elif args.engine == "incremental":
+            report = aggregate_event_incremental(
+                store, ev, as_of_utc=as_of, compact=compact, approx_unique_traders=bool(args.approx_traders)
+            )
+        else:
+            with store.reader() as conn:
+                if args.engine == "numpy":
+                    report = aggregate_event_from_cache(
+                        conn, ev, cache_root=default_cache_dir(db_path), as_of_utc=as_of
+                    )
+                else:
+                    report = aggregate_event_from_db(conn, ev, as_of_utc=as_of, compact=compact)
 
         # =========================
-        # Export Excel
+        # Export
         # =========================
-        log("5) Exporting XLSX...")
-        if xlsx_tmp_path.exists():
+        log(f"5) Exporting {report_format.name}...")
+        if report_tmp_path.exists():
             try:
-                xlsx_tmp_path.unlink()
+                report_tmp_path.unlink()
             except Exception:
                 pass
 
-        export_event_report_xlsx(event=ev, report=report, out_path=str(xlsx_tmp_path))
+        export_event_report(
+            report_format.name,
+            event=ev,
+            report=report,
+            out_path=str(report_tmp_path),
+            top_k=int(args.top_k) or None,
+        )
 
         # atomic-ish replace
-        if xlsx_path.exists():
+        if report_path.exists():
             try:
-                xlsx_path.unlink()
+                report_path.unlink()
             except Exception:
                 pass
-        xlsx_tmp_path.rename(xlsx_path)
+        report_tmp_path.rename(report_path)
 
-        log(f"6) Done. XLSX: {xlsx_path}")
+        log(f"6) Done. {report_format.name}: {report_path}")
         log(f"   DB: {db_path}")
         return 0
 
     finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+        store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from pathlib import Path
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from tg_bot.services.db import is_authorized
+from tg_bot.handlers.menu.main_menu import build_main_menu
+
+# чтобы импортировать Polymarket_client/app/...
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+POLYMARKET_CLIENT_DIR = PROJECT_ROOT / "Polymarket_client"
+if str(POLYMARKET_CLIENT_DIR) not in sys.path:
+    sys.path.insert(0, str(POLYMARKET_CLIENT_DIR))
+
+from app.ingestion.event_resolver import extract_event_slug, resolve_event
+from app.notification.alert_outbox import open_alert_outbox
+from app.notification.subscriptions import SubscriptionStore
+
+# подписки пользователей (индексы в памяти бота, SQLite — для рестартов)
+SUBSCRIPTIONS = SubscriptionStore(PROJECT_ROOT / "out" / "subscriptions.sqlite")
+# очередь, которую пишет Polymarket_client/scripts/ingest_once.py — путь из того же
+# Polymarket_client/config/settings.yaml (alert_outbox.path)
+ALERT_OUTBOX = open_alert_outbox()
+
+KIND_ALIASES = {
+    "market": "market", "рынок": "market",
+    "event": "event", "событие": "event",
+    "wallet": "wallet", "кошелёк": "wallet", "кошелек": "wallet",
+    "min": "min_usd", "от": "min_usd",
+}
+KIND_TITLES = {"market": "рынок", "event": "событие", "wallet": "кошелёк", "min_usd": "все алёрты от $"}
+
+HELP_TEXT = (
+    "Подписаться:\n"
+    "follow market <conditionId>\n"
+    "follow event <ссылка на событие>\n"
+    "follow wallet <адрес 0x…>\n"
+    "follow min <сумма в $>\n"
+    "Отписаться — то же с unfollow."
+)
+
+
+def _parse_alert_command(text: str) -> tuple[bool, str, str]:
+    """
+    "follow|unfollow <тип> <значение>" -> (подписка?, тип, значение).
+    Неверная команда -> ValueError.
+    """
+    parts = text.split(maxsplit=2)
+    if len(parts) != 3 or parts[0].lower() not in ("follow", "unfollow"):
+        raise ValueError("Не понял команду.")
+    kind = KIND_ALIASES.get(parts[1].lower())
+    if kind is None:
+        raise ValueError(f"Неизвестный тип подписки: {parts[1]}")
+    return parts[0].lower() == "follow", kind, parts[2].strip()
+
+
+def _subscriptions_lines(user_id: int, kinds: tuple[str, ...]) -> list[str]:
+    return [
+        f"• {KIND_TITLES[kind]}: {value}"
+        for kind, value in SUBSCRIPTIONS.user_subscriptions(user_id)
+        if kind in kinds
+    ]
+
+
+def alerts_text(user_id: int) -> str:
+    lines = _subscriptions_lines(user_id, ("market", "event", "wallet", "min_usd"))
+    head = "🔔 Подписки на алёрты:\n" + "\n".join(lines) if lines else "🔔 Подписок на алёрты пока нет."
+    return f"{head}\n\n{HELP_TEXT}"
+
+
+def markets_text(user_id: int) -> str:
+    lines = _subscriptions_lines(user_id, ("market", "event"))
+    if not lines:
+        return "📈 Ты пока не следишь ни за одним рынком. Подписаться — в разделе 🔔 Алёрты."
+    return "📈 Мои рынки и события:\n" + "\n".join(lines)
+
+
+def _follow_event(user_id: int, url_or_slug: str) -> tuple[bool, str]:
+    # рынки события нужны индексу: в алёрте из лога трейдов есть только conditionId
+    ev = resolve_event(url_or_slug)
+    SUBSCRIPTIONS.set_event_markets(ev.slug, [m.condition_id for m in ev.markets])
+    return SUBSCRIPTIONS.follow(user_id, "event", ev.slug), ev.title
+
+
+async def handle_alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get("waiting_for_alert_command"):
+        return
+
+    user_id = update.effective_user.id
+    context.user_data["waiting_for_alert_command"] = False
+
+    if not is_authorized(user_id):
+        await update.message.reply_text("Сначала /start и авторизация.")
+        return
+
+    try:
+        follow, kind, value = _parse_alert_command((update.message.text or "").strip())
+        if kind == "event":
+            value = extract_event_slug(value)
+
+        if follow and kind == "event":
+            changed, title = await asyncio.to_thread(_follow_event, user_id, value)
+            value = title or value
+        elif follow:
+            changed = SUBSCRIPTIONS.follow(user_id, kind, value)
+        else:
+            changed = SUBSCRIPTIONS.unfollow(user_id, kind, value)
+    except ValueError as e:
+        context.user_data["waiting_for_alert_command"] = True
+        await update.message.reply_text(f"{e}\n\n{HELP_TEXT}")
+        return
+    except Exception as e:
+        await update.message.reply_text(f"Ошибка: {e}")
+        return
+
+    if follow:
+        text = f"✅ Подписка: {KIND_TITLES[kind]} {value}" if changed else "Такая подписка уже есть."
+    else:
+        text = f"Отписал: {KIND_TITLES[kind]} {value}" if changed else "Такой подписки не было."
+    await update.message.reply_text(text)
+    await update.message.reply_text("Меню:", reply_markup=build_main_menu(user_id))
@@ -4,6 +4,8 @@ from telegram.ext import ContextTypes
 from tg_bot.services.db import get_all_users, is_authorized
 from tg_bot.config.settings import ADMIN_ID
 from tg_bot.handlers.menu.main_menu import build_main_menu
+from tg_bot.handlers.alerts.alerts_handler import alerts_text, markets_text
+from tg_bot.handlers.reports.event_report_handler import formats_hint
 
 
 async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -19,17 +21,23 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if action == "markets":
-        await query.edit_message_text("📈 Раздел рынков — скоро добавим функционал.")
+        await query.edit_message_text(markets_text(user_id))
 
     elif action == "alerts":
-        await query.edit_message_text("🔔 Раздел алёртов — в разработке.")
+        # следующее сообщение — команда follow / unfollow
+        context.user_data["waiting_for_event_url"] = False
+        context.user_data["waiting_for_alert_command"] = True
+        await query.edit_message_text(alerts_text(user_id))
 
     elif action == "settings":
         await query.edit_message_text("⚙ Настройки — будут позже.")
 
     elif action == "event_report":
+        context.user_data["waiting_for_alert_command"] = False
         context.user_data["waiting_for_event_url"] = True
-        await query.edit_message_text("Скинь ссылку на событие (формат: https://polymarket.com/event/...)")
+        await query.edit_message_text(
+            "Скинь ссылку на событие (формат: https://polymarket.com/event/...)\n" + formats_hint()
+        )
 
     elif action == "cancel_report":
         task = context.user_data.get("report_task")
@@ -2,13 +2,16 @@ from __future__ import annotations
 
 import asyncio
 import sys
+import time
 from pathlib import Path
-from datetime import datetime, timezone
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 
 from tg_bot.services.db import is_authorized
+from tg_bot.services.report_scheduler import QueueFull, ReportScheduler, ReportTicket
+from tg_bot.services.telegram_limits import retry_after_s
 from tg_bot.handlers.menu.main_menu import build_main_menu
 
 # чтобы импортировать Polymarket_client/app/...
@@ -17,72 +20,241 @@ POLYMARKET_CLIENT_DIR = PROJECT_ROOT / "Polymarket_client"
 if str(POLYMARKET_CLIENT_DIR) not in sys.path:
     sys.path.insert(0, str(POLYMARKET_CLIENT_DIR))
 
-from app.ingestion.event_resolver import resolve_event
-from app.ingestion.trades_loader import iter_event_trades
-from app.services.event_aggregator import aggregate_event
-from app.reporting.excel_exporter import export_event_report_xlsx
+from app.ingestion.event_resolver import extract_event_slug
+from app.services.event_report_service import build_event_report_file
+from app.reporting.report_formats import DEFAULT_REPORT_FORMAT, REPORT_FORMATS, get_report_format
+from app.storage.report_cache import CachedReport, ReportCache
+from app.utils.cancellation import CancelToken
+from app.utils.progress_reporter import ProgressConfig, ProgressReporter
+
+# общий стор на все ивенты: второй запрос того же ивента — локальные данные + дельта
+EVENTS_DB_PATH = PROJECT_ROOT / "out" / "events.sqlite"
+# сверх этого участники отчёта уходят во временный файл, а не в память бота
+REPORT_MEMORY_BUDGET_MB = 256
+
+# готовые файлы отчётов + их Telegram file_id: одинаковый запрос по тем же данным не пересобирается
+REPORT_CACHE_DIR = PROJECT_ROOT / "out" / "report_cache"
+REPORT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+_report_cache_instance: ReportCache | None = None
+
+# одна очередь на всех пользователей: не больше 2 отчётов собирается одновременно,
+# одинаковые запросы (ивент + формат) собираются один раз
+REPORT_SCHEDULER = ReportScheduler(max_workers=2, max_queue=50)
+# как часто смотреть на место в очереди / прогресс сборки
+STATUS_POLL_S = 1.0
+# не чаще одного edit_message_text на сообщение за столько секунд: у Telegram лимит
+# на правки в чате, а между правками всё равно показываем только последнее состояние
+STATUS_EDIT_INTERVAL_S = 3.0
+# как часто процесс сборки обновляет общий state прогресса
+PROGRESS_EMIT_INTERVAL_S = 1.0
+
+
+def _report_cache() -> ReportCache:
+    """
+    ReportCache текущего процесса. Открывается при первом обращении: у бота и
+    у каждого процесса пула своё соединение с индексом, а не унаследованное.
+    """
+    global _report_cache_instance
+    if _report_cache_instance is None:
+        _report_cache_instance = ReportCache(REPORT_CACHE_DIR, max_bytes=REPORT_CACHE_MAX_BYTES)
+    return _report_cache_instance
+
+
+def formats_hint() -> str:
+    """Подсказка про --format: только форматы, которые доступны в этой установке."""
+    others = " | ".join(name for name in REPORT_FORMATS if name != DEFAULT_REPORT_FORMAT)
+    return f"Другой формат файла: <ссылка> --format {others}"
 
 
 def _cancel_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="cancel_report")]])
 
 
-def _build_report_sync(event_url_or_slug: str) -> tuple[str, str]:
-    ev = resolve_event(event_url_or_slug)
+def _parse_report_request(text: str) -> tuple[str, str]:
+    """
+    "<ссылка> [--format csv]" (или "format=csv") -> (ссылка, формат).
+    Неизвестный формат -> ValueError.
+    """
+    parts = text.split()
+    if not parts:
+        return "", DEFAULT_REPORT_FORMAT
+
+    url, rest = parts[0], parts[1:]
+    fmt = DEFAULT_REPORT_FORMAT
+    i = 0
+    while i < len(rest):
+        tok = rest[i]
+        if tok in ("--format", "-f") and i + 1 < len(rest):
+            fmt = rest[i + 1]
+            i += 2
+            continue
+        if tok.startswith("--format=") or tok.startswith("format="):
+            fmt = tok.split("=", 1)[1]
+        i += 1
+
+    return url, get_report_format(fmt).name
 
-    as_of = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
-    # ВАЖНО: передаём conditionId всех маркетов (fallback для огромных ивентов)
-    trades = iter_event_trades(
-        ev.event_id,
+def _build_report_sync(
+    event_url_or_slug: str, report_format: str = DEFAULT_REPORT_FORMAT, *, cancel_event=None, progress_state=None
+) -> tuple[str, CachedReport]:
+    # cancel_event — от планировщика: отчёт больше никто не ждёт -> сборка бросает OperationCancelled;
+    # progress_state — общий dict, из которого бот берёт текст для сообщения о прогрессе
+    progress = None
+    if progress_state is not None:
+        progress = ProgressReporter(
+            lambda text: progress_state.__setitem__("text", text),
+            ProgressConfig(trades_step=1, min_interval_s=PROGRESS_EMIT_INTERVAL_S),
+        )
+
+    ev, cached = build_event_report_file(
+        event_url_or_slug,
+        cache=_report_cache(),
+        fmt=report_format,
+        db_path=EVENTS_DB_PATH,
+        memory_budget_mb=REPORT_MEMORY_BUDGET_MB,
         taker_only=False,
-        market_condition_ids=[m.condition_id for m in ev.markets],
+        cancel=CancelToken(cancel_event) if cancel_event is not None else None,
+        progress=progress,
     )
+    return ev.title, cached
 
-    report = aggregate_event(ev, trades, as_of_utc=as_of)
 
-    out_dir = PROJECT_ROOT / "out"
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"event_{ev.slug}_{int(datetime.now().timestamp())}.xlsx"
+def _submit_report(job_key: tuple[str, str], event_url_or_slug: str, report_format: str) -> ReportTicket:
+    return REPORT_SCHEDULER.submit(
+        job_key, _build_report_sync, event_url_or_slug, report_format, cancellable=True, with_progress=True
+    )
+
+
+async def _send_cached_report(
+    *, chat_id: int, title: str, cached: CachedReport, context: ContextTypes.DEFAULT_TYPE
+) -> bool:
+    """
+    False — отправить нечем: файл вытеснен из кэша, а file_id Telegram не
+    принял (или его нет). Запись тогда выкидывается — отчёт надо собрать заново.
+    """
+    if cached.tg_file_id:
+        try:
+            await context.bot.send_document(chat_id=chat_id, document=cached.tg_file_id, caption=title)
+            return True
+        except BadRequest:
+            # file_id протух (или от другого бота) — загрузим файл заново
+            _report_cache().forget_file_id(cached.key)
+
+    try:
+        if cached.path is None:
+            raise FileNotFoundError(cached.key)
+        f = open(cached.path, "rb")
+    except FileNotFoundError:
+        # файл вытеснили, пока отчёт ждал отправки
+        _report_cache().discard(cached.key)
+        return False
+
+    with f:
+        msg = await context.bot.send_document(
+            chat_id=chat_id,
+            document=f,
+            filename=cached.filename,
+            caption=title,
+        )
+    if msg.document is not None:
+        _report_cache().set_file_id(cached.key, msg.document.file_id)
+    return True
+
 
-    export_event_report_xlsx(event=ev, report=report, out_path=str(out_path))
-    return ev.title, str(out_path)
+def _queue_text(position: int) -> str:
+    if position > 0:
+        return f"Ок, ты в очереди: {position}-й. Соберу отчёт, как дойдёт очередь…"
+    return "Ок, собираю отчёт…"
+
+
+def _status_text(ticket: ReportTicket) -> str:
+    position = ticket.position
+    progress = ticket.progress_text if position == 0 else None
+    if progress:
+        return f"Собираю отчёт…\n{progress}"
+    return _queue_text(position)
+
+
+async def _wait_for_report(ticket: ReportTicket, status_msg) -> tuple[str, CachedReport]:
+    """
+    Ждёт задачу планировщика, пока ждём — показывает в status_msg место в
+    очереди, а после старта — прогресс сборки. Правки схлопываются: не чаще
+    STATUS_EDIT_INTERVAL_S, только если текст изменился, всегда последнее состояние.
+    """
+    waiter = asyncio.ensure_future(ticket.wait())
+    shown = status_msg.text
+    next_edit_at = time.monotonic() + STATUS_EDIT_INTERVAL_S
+    try:
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=STATUS_POLL_S)
+            if done:
+                return waiter.result()
+            now = time.monotonic()
+            if now < next_edit_at:
+                continue
+            text = _status_text(ticket)
+            if text == shown:
+                continue
+            try:
+                await status_msg.edit_text(text, reply_markup=_cancel_kb())
+                shown = text
+                next_edit_at = now + STATUS_EDIT_INTERVAL_S
+            except RetryAfter as e:
+                # упёрлись в лимит Telegram — ждём, сколько сказали
+                next_edit_at = now + retry_after_s(e)
+            except BadRequest:
+                # сообщение удалили / не изменилось — не критично
+                shown = text
+                next_edit_at = now + STATUS_EDIT_INTERVAL_S
+    finally:
+        waiter.cancel()
 
 
 async def _run_report_job(
     *,
     chat_id: int,
     user_id: int,
-    event_url_or_slug: str,
+    ticket: ReportTicket,
+    status_msg,
     context: ContextTypes.DEFAULT_TYPE,
+    job_key: tuple[str, str],
+    event_url_or_slug: str,
+    report_format: str,
 ):
     try:
-        title, out_path = await asyncio.to_thread(_build_report_sync, event_url_or_slug)
+        for attempt in range(2):
+            title, cached = await _wait_for_report(ticket, status_msg)
 
-        # если отменили — не шлём файл
-        task = context.user_data.get("report_task")
-        if task and task.cancelled():
-            return
+            # если отменили — не шлём файл
+            task = context.user_data.get("report_task")
+            if task and task.cancelled():
+                return
 
-        with open(out_path, "rb") as f:
-            await context.bot.send_document(
-                chat_id=chat_id,
-                document=f,
-                filename=Path(out_path).name,
-                caption=title,
-            )
+            try:
+                # убираем кнопку отмены и последний прогресс
+                await status_msg.edit_text("Готово, отправляю файл…")
+            except (BadRequest, RetryAfter):
+                pass
 
-        await context.bot.send_message(chat_id=chat_id, text="Меню:", reply_markup=build_main_menu(user_id))
+            # файл остаётся в кэше (вытесняет его ReportCache), повторный запрос уйдёт по file_id
+            if await _send_cached_report(chat_id=chat_id, title=title, cached=cached, context=context):
+                break
+            if attempt:
+                raise RuntimeError("не удалось отправить файл отчёта")
+            # из кэша отправить нечего — собираем отчёт заново через общую очередь
+            ticket = _submit_report(job_key, event_url_or_slug, report_format)
 
-        # чистим файл (если хочешь хранить — убери это)
-        try:
-            Path(out_path).unlink(missing_ok=True)
-        except Exception:
-            pass
+        await context.bot.send_message(chat_id=chat_id, text="Меню:", reply_markup=build_main_menu(user_id))
 
     except asyncio.CancelledError:
         await context.bot.send_message(chat_id=chat_id, text="Ок, отменено.")
         raise
+    except QueueFull:
+        # пересборка не встала в очередь
+        await context.bot.send_message(
+            chat_id=chat_id, text="Сейчас слишком много отчётов в очереди, попробуй через пару минут."
+        )
     except Exception as e:
         await context.bot.send_message(chat_id=chat_id, text=f"Ошибка при генерации отчёта: {e}")
     finally:
@@ -102,7 +274,12 @@ async def handle_event_report_url(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("Сначала /start и авторизация.")
         return
 
-    text = (update.message.text or "").strip()
+    try:
+        event_url_or_slug, report_format = _parse_report_request((update.message.text or "").strip())
+    except ValueError:
+        context.user_data["waiting_for_event_url"] = True
+        await update.message.reply_text(f"Неизвестный формат. Доступны: {', '.join(REPORT_FORMATS)}")
+        return
 
     # если уже идёт отчёт — не запускаем второй
     prev_task = context.user_data.get("report_task")
@@ -110,14 +287,34 @@ async def handle_event_report_url(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("У тебя уже идёт отчёт. Нажми ❌ Отмена.")
         return
 
-    await update.message.reply_text("Ок, собираю отчёт…", reply_markup=_cancel_kb())
+    try:
+        job_key = (extract_event_slug(event_url_or_slug), report_format)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+
+    try:
+        ticket = _submit_report(job_key, event_url_or_slug, report_format)
+    except QueueFull:
+        await update.message.reply_text("Сейчас слишком много отчётов в очереди, попробуй через пару минут.")
+        return
+
+    if ticket.joined and ticket.position == 0:
+        text = "Этот отчёт уже собирается — пришлю, как будет готов."
+    else:
+        text = _queue_text(ticket.position)
+    status_msg = await update.message.reply_text(text, reply_markup=_cancel_kb())
 
     task = asyncio.create_task(
         _run_report_job(
             chat_id=chat_id,
             user_id=user_id,
-            event_url_or_slug=text,
+            ticket=ticket,
+            status_msg=status_msg,
             context=context,
+            job_key=job_key,
+            event_url_or_slug=event_url_or_slug,
+            report_format=report_format,
         )
     )
     context.user_data["report_task"] = task
@@ -3,6 +3,7 @@ from telegram.ext import ContextTypes
 
 from tg_bot.handlers.auth.auth_handler import handle_password
 from tg_bot.handlers.reports.event_report_handler import handle_event_report_url
+from tg_bot.handlers.alerts.alerts_handler import handle_alert_command
 
 
 async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -12,5 +13,8 @@ async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("waiting_for_event_url"):
         return await handle_event_report_url(update, context)
 
+    if context.user_data.get("waiting_for_alert_command"):
+        return await handle_alert_command(update, context)
+
     # если ни один режим не активен — игнор
     return
@@ -1,17 +1,56 @@
+import asyncio
+import logging
+
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
-from tg_bot.services.db import init_db, set_role
+from tg_bot.services.db import close_db, init_db, is_authorized, set_role
 from tg_bot.config.settings import TOKEN, ADMIN_ID
 from tg_bot.handlers.auth.auth_handler import start
 from tg_bot.handlers.menu.callbacks import menu_callback
 from tg_bot.handlers.text_router import text_router
+from tg_bot.handlers.reports.event_report_handler import REPORT_SCHEDULER
+from tg_bot.handlers.alerts.alerts_handler import ALERT_OUTBOX, SUBSCRIPTIONS
+from tg_bot.services.alert_sender import run_alert_sender
+
+log = logging.getLogger(__name__)
+
+_background: list[asyncio.Task] = []
+
+
+def _log_crash(task: asyncio.Task) -> None:
+    # фоновая задача не должна умирать молча: иначе алёрты просто перестают приходить
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        log.error("background task %s crashed", task.get_name(), exc_info=exc)
+
+
+async def _post_init(app: Application) -> None:
+    task = asyncio.create_task(
+        run_alert_sender(app.bot, outbox=ALERT_OUTBOX, subscriptions=SUBSCRIPTIONS, is_allowed=is_authorized),
+        name="alert_sender",
+    )
+    task.add_done_callback(_log_crash)
+    _background.append(task)
+
+
+async def _post_shutdown(app: Application) -> None:
+    for t in _background:
+        t.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    _background.clear()
+    await REPORT_SCHEDULER.close()
+    ALERT_OUTBOX.close()
+    SUBSCRIPTIONS.close()
+    close_db()
 
 
 def main():
     init_db()
     set_role(ADMIN_ID, "admin")
 
-    app = Application.builder().token(TOKEN).build()
+    app = Application.builder().token(TOKEN).post_init(_post_init).post_shutdown(_post_shutdown).build()
 
     app.add_handler(CommandHandler("start", start))
 
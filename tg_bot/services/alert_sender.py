@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+from typing import Callable
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from app.notification.alert_outbox import decode_alert
+from tg_bot.services.telegram_limits import GLOBAL_SEND_INTERVAL_S, retry_after_s
+
+log = logging.getLogger(__name__)
+
+# Фоновая рассылка алёртов: читает очередь, которую пишет ingest_once
+# (app/notification/alert_outbox.AlertOutbox), находит подписчиков через
+# индексы SubscriptionStore.match() и шлёт каждому сообщение.
+# Offset потребителя коммитится после каждого алёрта: после рестарта бот
+# продолжит с того же места (алёрт, на котором упали, может прийти дважды).
+# Алёрт, который не разбирается / не форматируется, логируется и пропускается
+# (offset всё равно коммитится) — иначе он блокировал бы очередь после каждого рестарта.
+
+CONSUMER = "tg_bot"
+POLL_S = 5.0
+BATCH = 100
+
+
+def format_alert(alert) -> str:
+    title = alert.market_title or alert.condition_id
+    lines = [
+        f"🚨 {alert.alert_type}: {alert.side} ${alert.notional_usd:,.0f} ({alert.trade_count} трейдов в окне)",
+        f"Рынок: {title}",
+    ]
+    if alert.event_slug:
+        lines.append(f"Событие: https://polymarket.com/event/{alert.event_slug}")
+    lines.append(f"Кошелёк: https://polymarket.com/profile/{alert.wallet}")
+    return "\n".join(lines)
+
+
+async def _send(bot, chat_id: int, text: str) -> None:
+    for _attempt in range(2):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+            return
+        except RetryAfter as e:
+            await asyncio.sleep(retry_after_s(e))
+        except Forbidden:
+            # пользователь заблокировал бота
+            return
+        except TelegramError as e:
+            log.warning("alert to %s failed: %r", chat_id, e)
+            return
+
+
+async def run_alert_sender(
+    bot,
+    *,
+    outbox,
+    subscriptions,
+    is_allowed: Callable[[int], bool],
+    poll_s: float = POLL_S,
+) -> None:
+    """Крутится до отмены задачи. is_allowed — кому вообще можно слать (авторизация)."""
+    last_id = await asyncio.to_thread(outbox.load_offset, CONSUMER)
+    if last_id is None:
+        # первый запуск — накопленные до бота алёрты не рассылаем
+        last_id = await asyncio.to_thread(outbox.last_id)
+        await asyncio.to_thread(outbox.commit_offset, CONSUMER, last_id)
+
+    while True:
+        try:
+            batch = await asyncio.to_thread(outbox.read, last_id, limit=BATCH)
+        except sqlite3.Error as e:
+            log.warning("alert outbox read failed: %r", e)
+            batch = []
+        if not batch:
+            await asyncio.sleep(poll_s)
+            continue
+
+        for alert_id, payload in batch:
+            try:
+                alert = decode_alert(payload)
+                text = format_alert(alert)
+                user_ids = [u for u in sorted(subscriptions.match(alert)) if is_allowed(u)]
+            except Exception:
+                log.exception("alert %s skipped", alert_id)
+                user_ids = []
+            for user_id in user_ids:
+                try:
+                    await _send(bot, user_id, text)
+                except Exception:
+                    log.exception("alert %s to %s failed", alert_id, user_id)
+                await asyncio.sleep(GLOBAL_SEND_INTERVAL_S)
+            last_id = alert_id
+            await asyncio.to_thread(outbox.commit_offset, CONSUMER, last_id)
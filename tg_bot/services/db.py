@@ -1,72 +1,106 @@
 import sqlite3
+import threading
 from pathlib import Path
 
 DB_PATH = Path("tg_bot.db")
 
+# Одно долгоживущее соединение на процесс (под локом: хендлеры бота и потоки
+# PTB ходят в него конкурентно) и кэш авторизации в памяти: user_id -> role.
+# Кэш загружается в init_db() и обновляется при каждой записи (write-through),
+# так что is_authorized / get_role на каждый апдейт в SQLite не ходят.
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS authorized_users (
-            user_id INTEGER PRIMARY KEY,
-            role TEXT DEFAULT 'user',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+_lock = threading.RLock()
+_conn: sqlite3.Connection | None = None
+_roles: dict[int, str] | None = None
 
-    conn.commit()
-    conn.close()
 
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    return _conn
 
-def authorize(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "INSERT OR IGNORE INTO authorized_users (user_id) VALUES (?)",
-        (user_id,)
-    )
+def _load_roles() -> dict[int, str]:
+    global _roles
+    if _roles is None:
+        rows = _connection().execute("SELECT user_id, role FROM authorized_users").fetchall()
+        _roles = {int(user_id): role for user_id, role in rows}
+    return _roles
 
-    conn.commit()
-    conn.close()
 
+def init_db():
+    with _lock:
+        conn = _connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS authorized_users (
+                user_id INTEGER PRIMARY KEY,
+                role TEXT DEFAULT 'user',
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+        global _roles
+        _roles = None
+        _load_roles()
+
+
+def close_db():
+    global _conn, _roles
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        _roles = None
 
-def is_authorized(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "SELECT user_id FROM authorized_users WHERE user_id = ?",
-        (user_id,)
-    )
+def authorize(user_id: int):
+    with _lock:
+        roles = _load_roles()
+        if user_id in roles:
+            return
+
+        conn = _connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO authorized_users (user_id) VALUES (?)",
+            (user_id,)
+        )
+        conn.commit()
+
+        (role,) = conn.execute(
+            "SELECT role FROM authorized_users WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        roles[user_id] = role
 
-    row = cursor.fetchone()
-    conn.close()
 
-    return row is not None
+def is_authorized(user_id: int) -> bool:
+    with _lock:
+        return user_id in _load_roles()
 
 
-def set_role(user_id: int, role: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_role(user_id: int) -> str | None:
+    with _lock:
+        return _load_roles().get(user_id)
 
-    cursor.execute(
-        "UPDATE authorized_users SET role = ? WHERE user_id = ?",
-        (role, user_id)
-    )
 
-    conn.commit()
-    conn.close()
+def set_role(user_id: int, role: str):
+    with _lock:
+        roles = _load_roles()
 
+        conn = _connection()
+        cur = conn.execute(
+            "UPDATE authorized_users SET role = ? WHERE user_id = ?",
+            (role, user_id)
+        )
+        conn.commit()
 
-def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+        # как и раньше, роль ставится только уже авторизованному пользователю
+        if cur.rowcount:
+            roles[user_id] = role
 
-    cursor.execute("SELECT user_id, role, timestamp FROM authorized_users")
-    rows = cursor.fetchall()
 
-    conn.close()
-    return rows
+def get_all_users():
+    with _lock:
+        return _connection().execute("SELECT user_id, role, timestamp FROM authorized_users").fetchall()
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+# Глобальная очередь отчётов бота.
+#
+# - фиксированное число воркеров: одновременно собирается не больше
+#   max_workers отчётов, сама сборка (API, агрегация, экспорт) — в пуле
+#   процессов, event loop бота не занят;
+# - single-flight: запросы с одним ключом (ивент + формат) сливаются в одну
+#   задачу, её результат получают все, кто ждёт;
+# - очередь ограничена max_queue; место в очереди видно через position().
+#
+# Отмена ожидания одним пользователем задачу не отменяет, пока её ждёт
+# кто-то ещё; задача, которую перестали ждать до старта, выкидывается.
+# Уже идущую задачу (submit(..., cancellable=True)) останавливает сама fn:
+# она получает cancel_event — Event из multiprocessing.Manager(), который
+# виден из процесса пула, — и должна периодически смотреть на него.
+# Event ставится, когда задачу перестаёт ждать последний пользователь.
+#
+# submit(..., with_progress=True): fn получает progress_state — dict из того
+# же Manager, куда пишет последнее сообщение о прогрессе (ключ "text");
+# ожидающие читают его через ticket.progress_text. Храним только последнее
+# значение — промежуточные, которые никто не успел показать, теряются.
+#
+# Пул и Manager стартуют через spawn (mp_context): fork копировал бы в
+# воркер открытые SQLite-соединения и локи процесса бота. Всё, что нужно
+# fn (кэш, стор), она открывает сама в процессе пула.
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class ReportJob:
+    key: Hashable
+    fn: Callable[..., Any]
+    args: tuple
+    future: asyncio.Future
+    waiters: int = 0
+    started: bool = False
+    cancel_event: Any = None  # прокси Manager().Event() у cancellable-задач
+    progress_state: Any = None  # прокси Manager().dict() у задач with_progress
+
+
+class ReportTicket:
+    """Место одного пользователя в задаче; await ticket -> результат задачи."""
+
+    def __init__(self, scheduler: "ReportScheduler", job: ReportJob, *, joined: bool) -> None:
+        self._scheduler = scheduler
+        self.job = job
+        self.joined = joined  # True — присоединились к уже поставленной задаче
+        self._released = False
+
+    @property
+    def position(self) -> int:
+        return self._scheduler.position(self.job)
+
+    @property
+    def progress_text(self) -> str | None:
+        """Последнее сообщение о прогрессе задачи (None — ещё не было / не заказано)."""
+        state = self.job.progress_state
+        if state is None:
+            return None
+        try:
+            return state.get("text")
+        except (OSError, EOFError):
+            # менеджер уже остановлен
+            return None
+
+    async def wait(self) -> Any:
+        try:
+            # shield: отмена одного ожидающего не отменяет общую задачу
+            return await asyncio.shield(self.job.future)
+        finally:
+            self.release()
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self.job)
+
+
+class ReportScheduler:
+    def __init__(self, *, max_workers: int = 2, max_queue: int = 50, mp_context=None) -> None:
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(1, int(max_queue))
+        self._mp_context = mp_context or multiprocessing.get_context("spawn")
+        self._jobs: dict[Hashable, ReportJob] = {}
+        self._pending: deque[ReportJob] = deque()
+        self._wakeup: asyncio.Condition | None = None
+        self._workers: list[asyncio.Task] = []
+        self._pool: ProcessPoolExecutor | None = None
+        self._manager = None  # multiprocessing.Manager — только для задач с отменой / прогрессом
+
+    # ---------- постановка ----------
+    def submit(
+        self,
+        key: Hashable,
+        fn: Callable[..., Any],
+        *args: Any,
+        cancellable: bool = False,
+        with_progress: bool = False,
+    ) -> ReportTicket:
+        """
+        fn(*args) выполняется в процессе пула — должна быть функцией уровня
+        модуля, аргументы и результат — picklable.
+        cancellable=True — fn получает ещё cancel_event=<Event>,
+        with_progress=True — progress_state=<dict>.
+        """
+        self._ensure_started()
+
+        job = self._jobs.get(key)
+        if job is not None:
+            job.waiters += 1
+            return ReportTicket(self, job, joined=True)
+
+        if len(self._pending) >= self.max_queue:
+            raise QueueFull(f"report queue is full ({self.max_queue})")
+
+        job = ReportJob(key=key, fn=fn, args=args, future=asyncio.get_running_loop().create_future(), waiters=1)
+        if cancellable:
+            job.cancel_event = self._shared_manager().Event()
+        if with_progress:
+            job.progress_state = self._shared_manager().dict()
+        self._jobs[key] = job
+        self._pending.append(job)
+        self._notify()
+        return ReportTicket(self, job, joined=False)
+
+    def position(self, job: ReportJob) -> int:
+        """0 — уже собирается (или готова), иначе номер в очереди с 1."""
+        if job.started or job.future.done():
+            return 0
+        try:
+            return self._pending.index(job) + 1
+        except ValueError:
+            return 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _release(self, job: ReportJob) -> None:
+        job.waiters -= 1
+        if job.waiters > 0 or job.future.done():
+            return
+        if job.started:
+            if job.cancel_event is not None:
+                # результат больше никому не нужен — просим fn остановиться; новый
+                # запрос с тем же ключом не должен присоединиться к отменённой задаче
+                self._cancel_job(job)
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+            return
+        # никто не ждёт, а собирать ещё не начали — выкидываем
+        try:
+            self._pending.remove(job)
+        except ValueError:
+            pass
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        job.future.cancel()
+
+    def _shared_manager(self):
+        if self._manager is None:
+            self._manager = self._mp_context.Manager()
+        return self._manager
+
+    @staticmethod
+    def _cancel_job(job: ReportJob) -> None:
+        if job.cancel_event is None:
+            return
+        try:
+            job.cancel_event.set()
+        except (OSError, EOFError):
+            # процесс менеджера уже завершён (остановка бота)
+            pass
+
+    # ---------- воркеры ----------
+    def _ensure_started(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Condition()
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._mp_context)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def _notify(self) -> None:
+        async def notify() -> None:
+            async with self._wakeup:
+                self._wakeup.notify()
+
+        asyncio.get_running_loop().create_task(notify())
+
+    async def _next_job(self) -> ReportJob:
+        async with self._wakeup:
+            while not self._pending:
+                await self._wakeup.wait()
+            job = self._pending.popleft()
+            job.started = True
+            return job
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._next_job()
+            try:
+                extra = {}
+                if job.cancel_event is not None:
+                    extra["cancel_event"] = job.cancel_event
+                if job.progress_state is not None:
+                    extra["progress_state"] = job.progress_state
+                fn = functools.partial(job.fn, **extra) if extra else job.fn
+                result = await loop.run_in_executor(self._pool, fn, *job.args)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                # следующий запрос с тем же ключом — уже новая задача (данные могли обновиться)
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+                if job.future.done() and not job.future.cancelled():
+                    # результат мог никому не понадобиться — не шумим "exception was never retrieved"
+                    job.future.exception()
+
+    async def close(self) -> None:
+        for job in list(self._jobs.values()):
+            self._cancel_job(job)
+        for t in self._workers:
+            t.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,10 @@
+from telegram.error import RetryAfter
+
+# Лимиты Bot API: ~30 сообщений в секунду на бота, около одного в секунду в чат.
+GLOBAL_SEND_INTERVAL_S = 1 / 25
+
+
+def retry_after_s(e: RetryAfter) -> float:
+    # в разных версиях PTB retry_after — секунды или timedelta
+    value = e.retry_after
+    return float(value.total_seconds()) if hasattr(value, "total_seconds") else float(value)